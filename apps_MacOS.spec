@@ -10,7 +10,7 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['GPTtest'],
     noarchive=False,
     optimize=0,
     module_collection_mode={ 'gradio': 'py',}
@@ -1,8 +1,16 @@
-import file_processor
+import artifact_store
+import config
+import importlib.util
+import ingestion
+import result_store
+import threading
 import gradio as gr
 
+# file_processor (連帶 models、bootstrap、exporter) 在事件處理函式中才匯入，介面啟動後由 warm_up 於背景預先載入
+
 
 def update_sheet_names(file_path):
+    import file_processor
     try:
         sheet_names = file_processor.get_sheet_names(file_path)
         return gr.Dropdown(choices=sheet_names, value=sheet_names[0])
@@ -12,18 +20,57 @@ def update_sheet_names(file_path):
 
 
 def update_inflection_point(file_path, sheet_name):
+    import file_processor
+    import models
     try:
         unique_times = file_processor.get_time_columns(file_path, sheet_name)
-        return gr.Dropdown(choices=unique_times, value=unique_times[-1])
+        # 第一個選項為自動搜尋轉折點
+        return gr.Dropdown(choices=[("自動選擇", models.AUTO_INFLECTION)] + unique_times, value=unique_times[-1])
     except Exception as e:
         print(f"Error reading file: {e}")
         return gr.Dropdown(choices=[], value="")
 
 
+def analyze(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point, custom_title, inflection_criterion,
+            request: gr.Request):
+    """分析事件：圖檔存入共用的 artifact_store，最後一個輸出為本次分析的 run ID (供儲存時取得分析紀錄)"""
+    import file_processor
+    run_id = result_store.new_run_id()
+    for outputs in file_processor.run_interface_stream(file_path, sheet_name, x_unit, y_unit, dose_unit,
+                                                       inflection_point, custom_title, inflection_criterion,
+                                                       session_id=request.session_hash, run_id=run_id):
+        yield outputs + (gr.skip(),)
+    yield outputs + (run_id,)
+
+
+def save(title_name, run_id, save_formats, request: gr.Request):
+    """儲存事件：由畫面上目前顯示的分析紀錄匯出，伺服器模式下依連線分開儲存"""
+    import file_processor
+    if run_id is None:
+        print("尚無可儲存的分析結果，請先執行分析")
+        return
+    cohort_format = "parquet" if "parquet" in save_formats else "csv" if "csv" in save_formats else None
+    image_formats = [image_format for image_format in config.IMAGE_FORMATS if image_format in save_formats]
+    file_processor.save_file(title_name, run_id, session_id=request.session_hash, excel="xlsx" in save_formats,
+                             cohort_format=cohort_format, image_formats=image_formats)
+
+
+def cleanup_session(request: gr.Request):
+    """連線結束 (關閉或重新整理分頁) 時移除該連線的分析紀錄 (圖檔由 artifact_store 依容量上限淘汰)"""
+    result_store.forget_session(request.session_hash)
+
+
+def warm_up():
+    """預先載入分析與繪圖模組，縮短第一次分析的等待時間 (介面啟動後於背景執行緒呼叫)"""
+    import file_processor
+    file_processor.warm_up()
+
+
 def reset_all():
     one_model_output = ("", "", None, "", "", None)
     two_model_output = ("", "", None, "", "", None)
     prompt_message = ("",)
+    run_id = (None,)
     interface_output = (
         None,
         "",
@@ -34,17 +81,24 @@ def reset_all():
         None
     )
 
-    return one_model_output + two_model_output + prompt_message + interface_output
+    return one_model_output + two_model_output + prompt_message + run_id + interface_output
+
 
+# 儲存格式選項；Parquet 彙整檔需要 pyarrow (未列於 requirements.txt)，未安裝時不提供
+SAVE_FORMATS = [("PNG 圖檔", "png"), ("SVG 圖檔", "svg"), ("WebP 圖檔", "webp"), ("Excel", "xlsx"), ("CSV 彙整檔", "csv")]
+if importlib.util.find_spec("pyarrow") is not None:
+    SAVE_FORMATS.append(("Parquet 彙整檔", "parquet"))
 
-# 使用 Blocks 和 Row/Column 佈局
-with gr.Blocks() as demo:
+
+# 使用 Blocks 和 Row/Column 佈局；伺服器模式下定期清除 Gradio 自身的暫存檔
+with gr.Blocks(delete_cache=(3600, 3600) if config.SERVING_MODE else None) as demo:
     gr.Markdown("## 藥物濃度分析工具")
 
     # 設定檔案上傳元件和下拉選單
     with gr.Row():
         with gr.Column():
-            file_input = gr.File(label="選擇 Excel 檔案", type="filepath", container=False)
+            file_input = gr.File(label="選擇 Excel / CSV / Parquet 檔案", type="filepath", container=False,
+                                 file_types=list(ingestion.SUPPORTED_EXTENSIONS))
         with gr.Column():
             sheet_name_input = gr.Dropdown(label="選擇工作表名稱", choices=[""], interactive=True,
                                            allow_custom_value=False)
@@ -59,20 +113,31 @@ with gr.Blocks() as demo:
             with gr.Row():
                 inflection_point = gr.Dropdown(label="轉折點資料集拆分(時間點)", choices=[""], interactive=True,
                                                allow_custom_value=False)
+                inflection_criterion = gr.Dropdown(label="自動轉折點評分標準",
+                                                   choices=[("調整後 R²", "adj_r2"), ("AIC", "aic"),
+                                                            ("轉折點判斷標準", "workbook")],
+                                                   value="adj_r2", interactive=True, allow_custom_value=False)
         with gr.Column():
             information_output = gr.Textbox(label="Prompt message", interactive=False, container=False)
 
+    # 畫面上目前顯示的分析紀錄 (result_store) 的 run ID
+    run_id_state = gr.State(None)
+
     run_button = gr.Button("Analyze")
     with gr.Row():
         reset_button = gr.Button("Reset")
         save_button = gr.Button("Save(image & .xlsx)")
+        # 圖檔以高解析度重新繪製；Excel 為單次分析的報表；彙整檔將每次儲存的結果逐列附加到同一個 CSV / Parquet 檔案
+        save_formats = gr.CheckboxGroup(label="儲存格式",
+                                        choices=SAVE_FORMATS,
+                                        value=["png", "xlsx"], interactive=True)
 
     # 左右佈局：一室模型在左，二室模型在右
     with gr.Row():
         # 一室模型平均值佈局
         with gr.Column():
             gr.Markdown("### 一室模型結果 (平均值)")
-            image_output_one_avg = gr.Image(label="一室模型圖表 (平均值)")
+            image_output_one_avg = gr.Image(label="一室模型圖表 (平均值)", type="filepath")
             with gr.Row():
                 one_model_value_name_avg = gr.Textbox(label="一室模型參數 (平均值)", interactive=False, lines=10,
                                                       scale=4)
@@ -80,7 +145,7 @@ with gr.Blocks() as demo:
         # 二室模型平均值佈局
         with gr.Column():
             gr.Markdown("### 二室模型結果 (平均值)")
-            image_output_two_avg = gr.Image(label="二室模型圖表 (平均值)")
+            image_output_two_avg = gr.Image(label="二室模型圖表 (平均值)", type="filepath")
             with gr.Row():
                 two_model_value_name_avg = gr.Textbox(label="二室模型參數 (平均值)", interactive=False, lines=10,
                                                       scale=4)
@@ -89,7 +154,7 @@ with gr.Blocks() as demo:
         # 一室模型原始數據佈局
         with gr.Column():
             gr.Markdown("### 一室模型結果 (原始數據)")
-            image_output_one = gr.Image(label="一室模型圖表 (原始數據)")
+            image_output_one = gr.Image(label="一室模型圖表 (原始數據)", type="filepath")
             with gr.Row():
                 one_model_value_name = gr.Textbox(label="一室模型參數 (原始數據)", interactive=False, lines=10, scale=4)
                 one_model_value_output = gr.Textbox(label="輸出數值 (原始數據)", interactive=False, lines=10, scale=6)
@@ -97,7 +162,7 @@ with gr.Blocks() as demo:
         # 二室模型原始數據佈局
         with gr.Column():
             gr.Markdown("### 二室模型結果 (原始數據)")
-            image_output_two = gr.Image(label="二室模型圖表 (原始數據)")
+            image_output_two = gr.Image(label="二室模型圖表 (原始數據)", type="filepath")
             with gr.Row():
                 two_model_value_name = gr.Textbox(label="二室模型參數 (原始數據)", interactive=False, lines=10, scale=4)
                 two_model_value_output = gr.Textbox(label="輸出數值 (原始數據)", interactive=False, lines=10, scale=6)
@@ -109,14 +174,18 @@ with gr.Blocks() as demo:
     sheet_name_input.change(update_inflection_point, inputs=[file_input, sheet_name_input], outputs=inflection_point)
 
     # 設定按鈕事件
+    # 以產生器逐一串流四個面板的結果，提示訊息顯示進度
     run_button.click(
-        file_processor.run_interface,
-        inputs=[file_input, sheet_name_input, x_unit, y_unit, dose_unit, inflection_point, title_input],
+        analyze,
+        inputs=[file_input, sheet_name_input, x_unit, y_unit, dose_unit, inflection_point, title_input,
+                inflection_criterion],
         outputs=[one_model_value_name_avg, one_model_value_output_avg, image_output_one_avg,
                  one_model_value_name, one_model_value_output, image_output_one,
                  two_model_value_name_avg, two_model_value_output_avg, image_output_two_avg,
                  two_model_value_name, two_model_value_output, image_output_two,
-                 information_output]
+                 information_output, run_id_state],
+        concurrency_limit=config.ANALYZE_CONCURRENCY_LIMIT,
+        concurrency_id="analyze"
     )
     reset_button.click(
         reset_all,
@@ -125,16 +194,29 @@ with gr.Blocks() as demo:
                  one_model_value_name, one_model_value_output, image_output_one,
                  two_model_value_name_avg, two_model_value_output_avg, image_output_two_avg,
                  two_model_value_name, two_model_value_output, image_output_two,
-                 information_output, file_input, sheet_name_input, title_input, x_unit, y_unit, dose_unit,
+                 information_output, run_id_state, file_input, sheet_name_input, title_input, x_unit, y_unit, dose_unit,
                  inflection_point]
     )
     save_button.click(
-        file_processor.save_file,
-        inputs=[title_input,
-                one_model_value_name, two_model_value_name,
-                one_model_value_output, two_model_value_output,
-                one_model_value_output_avg, two_model_value_output_avg],
-        outputs=[]
+        save,
+        inputs=[title_input, run_id_state, save_formats],
+        outputs=[],
+        concurrency_limit=config.SAVE_CONCURRENCY_LIMIT,
+        concurrency_id="save"
     )
-
-demo.launch(share=False, inbrowser=True)
+    demo.unload(cleanup_session)
+
+demo.queue(max_size=config.QUEUE_MAX_SIZE)
+
+if __name__ == '__main__':
+    print(f"TEMP_FOLDER_PATH: {config.ensure_temp_folder()}")
+    # 介面先啟動 (不阻塞)，再於背景載入 file_processor、matplotlib 等第一次分析才需要的模組
+    if config.SERVING_MODE:
+        # 伺服器模式：對區域網路開放，不自動開啟瀏覽器
+        demo.launch(share=False, inbrowser=False, server_name="0.0.0.0", prevent_thread_lock=True)
+    else:
+        demo.launch(share=False, inbrowser=True, prevent_thread_lock=True)
+    threading.Thread(target=warm_up, name="warm_up", daemon=True).start()
+    # 清除上次執行中斷寫入留下的暫存檔 (只刪除過舊的 .tmp，不影響寫入中的圖檔)，並將圖檔儲存區縮減到容量上限內
+    threading.Thread(target=artifact_store.sweep, name="artifact_sweep", daemon=True).start()
+    demo.block_thread()
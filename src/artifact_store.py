@@ -0,0 +1,235 @@
+"""圖檔的內容定址儲存區：以內容雜湊命名、重複的圖檔只存一份，總容量超過上限時依 LRU 順序淘汰
+
+所有繪圖結果存放於 config.ARTIFACT_DIR，檔名為內容的 BLAKE2b 雜湊 (例如 3f2a...c1.png)。
+相同內容的圖檔 (例如只重新分析、未改變任何輸入) 不會重複寫入，只更新其最近使用時間 (檔案的 mtime)，
+重新啟動後仍可依 mtime 重建 LRU 順序。檔案寫入後不再修改，可安全地被多個連線同時引用。
+
+仍被某個連線的分析紀錄引用 (畫面上顯示、稍後可能匯出) 的圖檔以 pin() 標記，淘汰時略過，
+引用數歸零 (unpin()) 後才依 LRU 順序淘汰；被標記的圖檔可使總容量暫時超過上限。
+
+匯出時以 export() 建立副本：依序嘗試 reflink (寫入時複製，Linux 的 Btrfs / XFS 等)、硬連結，
+都不支援 (例如跨檔案系統) 時才複製內容。淘汰只刪除儲存區中的連結，已匯出的檔案不受影響。
+注意硬連結與儲存區共用同一份內容，匯出的圖檔不應直接覆寫修改。
+
+索引只存在於目前的行程中，儲存區設計為由單一伺服器行程使用。
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from config import ARTIFACT_DIR, ARTIFACT_STORE_MAX_BYTES
+
+try:
+    import fcntl  # reflink 只在 Linux 上以 ioctl(FICLONE) 實作
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409
+# 超過此秒數未修改的 .tmp 才視為中斷寫入留下的暫存檔 (put / export 寫入中的暫存檔不會被 sweep 刪除)
+STALE_TEMP_SECONDS = 3600
+
+_index = None  # 檔名 -> 位元組數，依最近使用時間排列 (最舊的在前)
+_total_bytes = 0
+_pins = Counter()  # 檔名 -> 引用數 (引用中的圖檔不淘汰)
+_lock = threading.Lock()
+
+
+def _scan():
+    """依 mtime 由舊到新重建索引 (呼叫端須持有 _lock)"""
+    global _index, _total_bytes
+    entries = []
+    if os.path.isdir(ARTIFACT_DIR):
+        with os.scandir(ARTIFACT_DIR) as iterator:
+            for entry in iterator:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, entry.name, stat.st_size))
+    entries.sort()
+    _index = OrderedDict((name, size) for _, name, size in entries)
+    _total_bytes = sum(_index.values())
+
+
+def _evict(max_bytes, keep=None):
+    """刪除最久未使用的圖檔直到總容量不超過 max_bytes (略過 keep 與被引用的檔名)，回傳 (刪除數, 位元組數)"""
+    global _total_bytes
+    removed = removed_bytes = 0
+    for name in list(_index):
+        if _total_bytes <= max_bytes:
+            break
+        if name == keep or name in _pins:
+            continue
+        size = _index.pop(name)
+        _total_bytes -= size
+        try:
+            os.remove(os.path.join(ARTIFACT_DIR, name))
+        except FileNotFoundError:
+            pass
+        removed += 1
+        removed_bytes += size
+    return removed, removed_bytes
+
+
+def artifact_name(data, extension):
+    """內容雜湊檔名"""
+    return f"{hashlib.blake2b(data, digest_size=16).hexdigest()}.{extension}"
+
+
+def put(data, extension, max_bytes=None):
+    """存入圖檔內容並回傳其路徑；相同內容已存在時不重新寫入，只更新最近使用時間
+
+    max_bytes 預設為 config.ARTIFACT_STORE_MAX_BYTES，超過時淘汰最久未使用的圖檔 (剛存入的除外)。
+    """
+    global _total_bytes
+    name = artifact_name(data, extension)
+    path = os.path.join(ARTIFACT_DIR, name)
+    with _lock:
+        if _index is None:
+            _scan()
+        if name in _index and os.path.exists(path):
+            _index.move_to_end(name)
+            os.utime(path)
+            return path
+    # 先寫入暫存檔再改名，其他執行緒不會讀到寫到一半的圖檔 (同內容同時寫入時結果相同)
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    with _lock:
+        if name not in _index:
+            _total_bytes += len(data)
+        _index[name] = len(data)
+        _index.move_to_end(name)
+        _evict(ARTIFACT_STORE_MAX_BYTES if max_bytes is None else max_bytes, keep=name)
+    return path
+
+
+def _store_name(path):
+    """儲存區中的檔名；不在儲存區中的路徑 (例如佔位圖片) 回傳 None"""
+    if path is None or os.path.dirname(os.path.abspath(path)) != os.path.abspath(ARTIFACT_DIR):
+        return None
+    return os.path.basename(path)
+
+
+def pin(paths):
+    """增加圖檔的引用數，引用中的圖檔不會被淘汰；不在儲存區中的路徑不做任何事"""
+    names = [name for name in map(_store_name, paths) if name is not None]
+    with _lock:
+        _pins.update(names)
+
+
+def unpin(paths):
+    """減少圖檔的引用數 (與 pin 成對呼叫)，歸零後可再被淘汰"""
+    names = [name for name in map(_store_name, paths) if name is not None]
+    with _lock:
+        _pins.subtract(names)
+        for name in names:
+            if _pins[name] <= 0:
+                del _pins[name]
+
+
+@contextmanager
+def pinned(paths):
+    """在 with 區塊內引用圖檔 (例如匯出期間)"""
+    paths = list(paths)
+    pin(paths)
+    try:
+        yield paths
+    finally:
+        unpin(paths)
+
+
+def touch(path):
+    """標記圖檔為最近使用 (例如沿用上次分析的圖檔時)；不在儲存區中的路徑不做任何事"""
+    name = _store_name(path)
+    if name is None:
+        return
+    with _lock:
+        if _index is not None and name in _index:
+            _index.move_to_end(name)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _reflink(source, destination):
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def export(source, destination):
+    """將圖檔匯出到 destination (已存在時覆寫)，回傳使用的方式 ("reflink" / "hardlink" / "copy" / "unchanged")"""
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        # 上次匯出的硬連結 (同一份內容)；rename 到同一個檔案不會有任何動作，暫存檔會留下
+        touch(source)
+        return "unchanged"
+    temp_path = f'{destination}.{os.getpid()}-{threading.get_ident()}.tmp'
+    method = None
+    if fcntl is not None:
+        try:
+            _reflink(source, temp_path)
+            method = "reflink"
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    if method is None:
+        try:
+            os.link(source, temp_path)
+            method = "hardlink"
+        except OSError:
+            # 跨檔案系統、檔案系統不支援或沒有權限時改為複製 (來源不存在等錯誤由 copyfile 拋出)
+            pass
+    if method is None:
+        shutil.copyfile(source, temp_path)
+        method = "copy"
+    os.replace(temp_path, destination)
+    touch(source)
+    return method
+
+
+def stats():
+    """儲存區目前的圖檔數與總位元組數"""
+    with _lock:
+        if _index is None:
+            _scan()
+        return {'artifacts': len(_index), 'bytes': _total_bytes, 'max_bytes': ARTIFACT_STORE_MAX_BYTES,
+                'pinned': len(_pins)}
+
+
+def _remove(path):
+    """刪除單一檔案，回傳釋放的位元組數 (已不存在時為 None)"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return None
+
+
+def sweep(max_bytes=None):
+    """啟動時清理：刪除中斷寫入留下的暫存檔，重建索引並依容量上限淘汰
+
+    只刪除超過 STALE_TEMP_SECONDS 未修改的 .tmp，可與 put / export 同時執行 (例如在背景執行緒)。
+    回傳 {'removed_files', 'removed_bytes', 'artifacts', 'bytes'}。
+    """
+    files = []
+    if os.path.isdir(ARTIFACT_DIR):
+        deadline = time.time() - STALE_TEMP_SECONDS
+        with os.scandir(ARTIFACT_DIR) as iterator:
+            for entry in iterator:
+                try:
+                    if entry.name.endswith('.tmp') and entry.stat().st_mtime < deadline:
+                        files.append(entry.path)
+                except FileNotFoundError:  # 寫入完成後已改名
+                    pass
+    removed = [size for size in map(_remove, files) if size is not None]
+    with _lock:
+        _scan()
+        evicted, evicted_bytes = _evict(ARTIFACT_STORE_MAX_BYTES if max_bytes is None else max_bytes)
+        return {'removed_files': len(removed) + evicted, 'removed_bytes': sum(removed) + evicted_bytes,
+                'artifacts': len(_index), 'bytes': _total_bytes}
@@ -0,0 +1,234 @@
+"""批次分析命令列工具：不啟動 Gradio 介面，分析整個資料夾內所有活頁簿的所有工作表 (以及 CSV / Parquet 檔案)
+
+用法範例：
+    python src/batch_cli.py dataset/ -o results.csv --workers 8
+    python src/batch_cli.py a.xlsx b.xlsx -o results.parquet --inflection-point auto
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time as time_module
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bootstrap
+import exporter
+import file_processor
+import ingestion
+import models
+
+# 每個工作 (檔案, 工作表) 執行的四種分析：欄位前綴、模型類型、是否取平均值
+PANELS = (
+    ('one', "一室模型", False),
+    ('one_avg', "一室模型", True),
+    ('two', "二室模型", False),
+    ('two_avg', "二室模型", True),
+)
+BASE_COLUMNS = ['file', 'sheet', 'status', 'error', 'elapsed_s']
+# 續跑時視為已完成的狀態；'crashed' (子行程異常終止) 的工作會重新執行，其舊的列在續跑開始時移除
+DONE_STATUSES = ('ok', 'failed')
+# 會改變計算結果的分析選項 (續跑時須與輸出檔相同)；單位與標題只用於繪圖，批次分析不繪圖
+RESULT_OPTIONS = ('inflection_point', 'inflection_criterion', 'bootstrap')
+
+
+def result_columns(bootstrap=False):
+    """輸出檔的固定欄位順序；bootstrap=True 時每個參數另有 _ci_low / _ci_high 兩欄信賴區間"""
+    columns = list(BASE_COLUMNS)
+    for prefix, model_type, _ in PANELS:
+        keys = models.ONE_COMPARTMENT_KEYS if model_type == "一室模型" else models.TWO_COMPARTMENT_KEYS
+        columns += [f'{prefix}_{key}' for key in keys]
+        if model_type == "二室模型":
+            columns.append(f'{prefix}_inflection_point')
+        if bootstrap:
+            columns += [f'{prefix}_{key}_{bound}' for key in keys for bound in ('ci_low', 'ci_high')]
+        columns.append(f'{prefix}_error')
+    return columns
+
+
+def find_workbooks(paths, exclude=()):
+    """展開輸入的檔案與資料夾 (遞迴) 為活頁簿路徑列表；exclude 為要排除的路徑 (例如輸出檔本身)"""
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for extension in ingestion.SUPPORTED_EXTENSIONS:
+                workbooks += glob.glob(os.path.join(path, '**', f'*{extension}'), recursive=True)
+        else:
+            workbooks.append(path)
+    excluded = {os.path.abspath(path) for path in exclude}
+    # 排除 Excel 開啟中產生的暫存檔 (~$xxx.xlsx)，以及 Parquet 輸出資料夾中的 part 檔案
+    return sorted(os.path.abspath(path) for path in set(workbooks)
+                  if not os.path.basename(path).startswith('~$')
+                  and os.path.abspath(path) not in excluded
+                  and os.path.dirname(os.path.abspath(path)) not in excluded)
+
+
+def analyse_job(file_path, sheet_name, options):
+    """在子行程中分析一個工作表 (只計算不繪圖)，回傳一列結果 (錯誤記錄在列中而非拋出)"""
+    row = {'file': file_path, 'sheet': sheet_name, 'status': 'ok', 'error': ''}
+    start = time_module.perf_counter()
+    try:
+        for prefix, model_type, average in PANELS:
+            result, _, _ = file_processor.process_file(
+                file_path, sheet_name, model_type, options['x_unit'], options['y_unit'], options['dose_unit'],
+                options['inflection_point'], options['title'], average=average,
+                inflection_criterion=options['inflection_criterion'], render=False,
+                bootstrap=options.get('bootstrap'))
+            row[f'{prefix}_error'] = result.get('Error', '')
+            for key, value in result.items():
+                if key != 'Error':
+                    row[f'{prefix}_{key}'] = value
+        if all(row[f'{prefix}_error'] for prefix, _, _ in PANELS):
+            row['status'] = 'failed'
+            row['error'] = '所有模型皆未成功'
+    except Exception as e:
+        row['status'] = 'failed'
+        row['error'] = f'{type(e).__name__}: {e}'
+    row['elapsed_s'] = round(time_module.perf_counter() - start, 4)
+    return row
+
+
+def options_path(output):
+    """記錄分析選項的檔案：CSV 為同名的 .options.json，Parquet 資料夾為其中的 _options.json (讀取時會略過)"""
+    if output.endswith('.parquet'):
+        return os.path.join(output, '_options.json')
+    return output + '.options.json'
+
+
+def open_output(output, columns, options, resume=True):
+    """開啟輸出檔；resume=False 時先清除舊的輸出
+
+    options 只應包含會改變計算結果的選項 (見 RESULT_OPTIONS)。續跑時檢查輸出檔的欄位與這些選項
+    是否與這次相同 (例如 --bootstrap 會增加信賴區間欄位，轉折點設定不影響欄位但會改變結果)，
+    不同時結束程式，避免同一個檔案混合不同設定的結果；並移除將重新執行的 'crashed' 工作的舊列，
+    輸出檔中每個 (檔案, 工作表) 只有一列。
+    """
+    if not resume and os.path.exists(output):
+        if os.path.isdir(output):
+            for part in glob.glob(os.path.join(output, 'part-*.parquet')):
+                os.remove(part)
+        else:
+            os.remove(output)
+        if os.path.exists(options_path(output)):
+            os.remove(options_path(output))
+
+    try:
+        writer = exporter.open_writer(output, columns)
+    except ImportError as e:
+        raise SystemExit(str(e))
+    existing = writer.existing_columns()
+    options = json.loads(json.dumps(options))  # 與讀回的 JSON 比較 (tuple 轉為 list 等)
+    saved = None
+    if existing is not None and os.path.exists(options_path(output)):
+        with open(options_path(output), encoding='utf-8') as f:
+            saved = json.load(f)
+    mismatch = "欄位" if existing is not None and existing != columns else (
+        "分析選項" if saved is not None and saved != options else None)
+    if mismatch:
+        writer.close()
+        raise SystemExit(f"輸出檔 {output} 的{mismatch}與這次的設定不同，續跑會混合不同設定的結果；"
+                         f"請改用其他輸出檔，或加上 --no-resume 重新分析")
+    with open(options_path(output), 'w', encoding='utf-8') as f:
+        json.dump(options, f, ensure_ascii=False, indent=2)
+    if existing is not None and any(status not in DONE_STATUSES for status, in writer.read_rows(('status',))):
+        writer.drop_rows(lambda row: row['status'] in DONE_STATUSES)
+    return writer
+
+
+def completed_jobs(writer):
+    """輸出檔中已完成的 (檔案, 工作表) 工作"""
+    return {(file_path, sheet) for file_path, sheet, status in writer.read_rows(('file', 'sheet', 'status'))
+            if status in DONE_STATUSES}
+
+
+def build_jobs(workbooks, writer):
+    """列出所有 (檔案, 工作表) 工作，略過已完成的工作；無法讀取的檔案直接記錄為失敗
+
+    回傳 (工作列表, 略過數, 無法讀取的檔案數)。
+    """
+    done = completed_jobs(writer)
+    jobs = []
+    unreadable = 0
+    for file_path in workbooks:
+        try:
+            sheet_names = file_processor.get_sheet_names(file_path)
+        except Exception as e:
+            if (file_path, '') not in done:
+                writer.write({'file': file_path, 'sheet': '', 'status': 'failed',
+                              'error': f'{type(e).__name__}: {e}', 'elapsed_s': 0})
+                unreadable += 1
+            continue
+        jobs += [(file_path, sheet) for sheet in sheet_names if (file_path, sheet) not in done]
+    return jobs, len(done), unreadable
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批次分析活頁簿中所有工作表的一室、二室模型參數")
+    parser.add_argument('paths', nargs='+', help="活頁簿 / CSV / Parquet 檔案或資料夾 (資料夾會遞迴搜尋)")
+    parser.add_argument('-o', '--output', required=True, help="輸出檔案 (.csv 或 .parquet)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="平行處理的行程數")
+    parser.add_argument('--inflection-point', default=models.AUTO_INFLECTION,
+                        help="二室模型轉折點時間，預設為自動搜尋")
+    parser.add_argument('--inflection-criterion', default="adj_r2", choices=models.INFLECTION_CRITERIA)
+    parser.add_argument('--x-unit', default="Minute")
+    parser.add_argument('--y-unit', default="mg/L")
+    parser.add_argument('--dose-unit', default="mg")
+    parser.add_argument('--title', default="")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="每個參數另以 N 個 bootstrap 樣本計算信賴區間 (預設不計算)")
+    parser.add_argument('--bootstrap-method', default="case", choices=bootstrap.BOOTSTRAP_METHODS)
+    parser.add_argument('--ci', type=float, default=95, help="信賴區間百分比")
+    parser.add_argument('--seed', type=int, default=0, help="bootstrap 亂數種子")
+    parser.add_argument('--no-resume', action='store_true', help="不略過輸出檔中已完成的工作 (會覆寫輸出檔)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    inflection_point = args.inflection_point
+    if inflection_point != models.AUTO_INFLECTION:
+        inflection_point = float(inflection_point)
+    options = {
+        'x_unit': args.x_unit, 'y_unit': args.y_unit, 'dose_unit': args.dose_unit, 'title': args.title,
+        'inflection_point': inflection_point, 'inflection_criterion': args.inflection_criterion,
+        'bootstrap': None,
+    }
+    if args.bootstrap > 0:
+        # 各工作已在不同行程平行處理，bootstrap 本身不再平行
+        options['bootstrap'] = {'n_boot': args.bootstrap, 'method': args.bootstrap_method, 'seed': args.seed,
+                                'ci': args.ci, 'n_jobs': 1}
+
+    writer = open_output(args.output, result_columns(bootstrap=args.bootstrap > 0),
+                         {key: options[key] for key in RESULT_OPTIONS}, resume=not args.no_resume)
+    workbooks = find_workbooks(args.paths, exclude=[args.output])
+    jobs, skipped, unreadable = build_jobs(workbooks, writer)
+    print(f"{len(workbooks)} 個活頁簿，{len(jobs)} 個工作待處理，略過 {skipped} 個已完成的工作", file=sys.stderr)
+
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = {executor.submit(analyse_job, file_path, sheet, options): (file_path, sheet)
+                       for file_path, sheet in jobs}
+            for count, future in enumerate(as_completed(futures), start=1):
+                file_path, sheet = futures[future]
+                try:
+                    row = future.result()
+                except Exception:
+                    # 子行程異常終止等情況，仍記錄為該工作失敗，續跑時會重試
+                    row = {'file': file_path, 'sheet': sheet, 'status': 'crashed',
+                           'error': traceback.format_exc(limit=1).strip(), 'elapsed_s': 0}
+                failed += row['status'] != 'ok'
+                writer.write(row)
+                print(f"[{count}/{len(jobs)}] {row['status']} {os.path.basename(file_path)} / {sheet}",
+                      file=sys.stderr)
+    finally:
+        writer.close()
+
+    print(f"完成：{len(jobs) - failed} 成功，{failed + unreadable} 失敗，結果已寫入 {args.output}", file=sys.stderr)
+    # 有任何工作失敗 ('failed' / 'crashed'，包含無法讀取的檔案) 時以非零結束碼結束，方便腳本與 CI 判斷
+    return 1 if failed or unreadable else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,557 @@
+"""效能基準測試：以合成的一室 / 二室模型濃度-時間資料，分別計時整個分析流程的各個階段
+
+結果以 JSON 輸出 (含 git commit 與套件版本)，可用 --compare 與先前的結果比較，找出變慢的項目；
+每次執行前會先做數值等價檢查，確認批次 / 快取等加速路徑與逐一計算的結果相同。
+
+用法範例：
+    python src/benchmark.py --quick
+    python src/benchmark.py -o bench.json
+    python src/benchmark.py --points 10,1000,1000000 --subjects 1,100,10000 -o bench.json
+    python src/benchmark.py --quick --compare bench.json
+    python src/benchmark.py --only startup --startup-budget 15
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as time_module
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import artifact_store
+import config
+import exporter
+import file_processor
+import image_processor
+import instrumentation
+import models
+import result_store
+
+# 合成資料的真實參數 (濃度單位 mg/L，時間單位 hr)
+ONE_COMPARTMENT_TRUTH = {'c0': 50.0, 'k': 0.25}
+TWO_COMPARTMENT_TRUTH = {'a': 60.0, 'alpha': 1.5, 'b': 15.0, 'beta': 0.15}
+SYNTHETIC_DOSE = 100.0
+SYNTHETIC_T_MAX = 24.0
+
+# 單一基準項目的資料量上限 (受試者數 x 點數)，超過時略過以免耗盡記憶體
+MAX_CELLS = 5 * 10 ** 7
+# 寫入 Excel 的點數上限 (process_file / save_file 需要實際的活頁簿)
+MAX_WORKBOOK_POINTS = 10 ** 4
+
+DEFAULT_POINTS = (10, 100, 1000, 10000)
+DEFAULT_SUBJECTS = (1, 100, 1000)
+QUICK_POINTS = (10, 1000)
+QUICK_SUBJECTS = (1, 100)
+
+# 啟動時不應載入的模組 (第一次使用時才載入)；本專案的分析模組由 apps 的事件處理函式或 warm_up 匯入
+LAZY_MODULES = ('matplotlib', 'statsmodels', 'scipy', 'openpyxl', 'xlsxwriter', 'python_calamine',
+                'file_processor', 'models', 'bootstrap', 'exporter')
+# 啟動時間預算 (秒)：import apps 與開啟第一個頁面的中位數耗時
+DEFAULT_STARTUP_BUDGET = 20.0
+STARTUP_TIMEOUT = 120.0
+
+
+def synthetic_profiles(n_subjects, n_points, model="two", noise=0.05, seed=0, t_max=SYNTHETIC_T_MAX):
+    """產生合成的濃度-時間資料
+
+    回傳 (time, cp, inflection_point)：time 為 (點數,) 的等比間隔取樣時間，cp 為 (受試者數, 點數)。
+    每位受試者的參數在真實值附近以對數常態分布變動 (變異係數約 10%)，
+    觀測值再乘上 exp(noise * 標準常態) 的乘法誤差。inflection_point 為二室模型後段 (beta 相)
+    開始的時間點 (取樣時間中第一個 alpha 相低於 beta 相 5% 的時間)，一室模型時為 None。
+    """
+    rng = np.random.default_rng(seed)
+    # 取樣時間前密後疏 (等比間隔)，與臨床採血的安排相近
+    time = np.geomspace(min(0.05, t_max / n_points), t_max, n_points)
+
+    def vary(value):
+        return value * np.exp(0.1 * rng.standard_normal((n_subjects, 1)))
+
+    if model == "one":
+        truth = ONE_COMPARTMENT_TRUTH
+        cp = vary(truth['c0']) * np.exp(-vary(truth['k']) * time)
+        inflection_point = None
+    else:
+        truth = TWO_COMPARTMENT_TRUTH
+        cp = (vary(truth['a']) * np.exp(-vary(truth['alpha']) * time)
+              + vary(truth['b']) * np.exp(-vary(truth['beta']) * time))
+        alpha_phase = truth['a'] * np.exp(-truth['alpha'] * time)
+        beta_phase = truth['b'] * np.exp(-truth['beta'] * time)
+        index = min(int(np.argmax(alpha_phase < 0.05 * beta_phase)), n_points - 2)
+        inflection_point = float(time[index])
+
+    cp = cp * np.exp(noise * rng.standard_normal(cp.shape))
+    return time, cp, inflection_point
+
+
+def write_workbook(path, time, cp, dose=SYNTHETIC_DOSE):
+    """將合成資料寫成 [Time][Cp][Dose] 格式的活頁簿，每位受試者一個工作表"""
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        for subject, row in enumerate(np.atleast_2d(cp), start=1):
+            doses = np.full(len(time), np.nan)
+            doses[0] = dose
+            pd.DataFrame({'Time': time, 'Cp': row, 'Dose': doses}).to_excel(writer, sheet_name=str(subject),
+                                                                          index=False)
+    return path
+
+
+def measure(function, repeat, min_time=0.0):
+    """執行 function repeat 次 (總時間未達 min_time 秒時繼續執行)，回傳每次的耗時 (秒)"""
+    timings = []
+    while len(timings) < repeat or sum(timings) < min_time:
+        start = time_module.perf_counter()
+        function()
+        timings.append(time_module.perf_counter() - start)
+        if len(timings) >= 1000:
+            break
+    return timings
+
+
+def record(name, params, timings):
+    return {
+        'name': name,
+        'params': params,
+        'runs': len(timings),
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+    }
+
+
+# ---------- 數值等價檢查 ----------
+
+def check_equivalence(seed=0):
+    """確認加速路徑 (閉合解、批次、族群殘差法、擬合快取) 與逐一計算的結果相同，回傳 (檢查名稱, 是否通過, 說明) 列表"""
+    checks = []
+    time, cp, inflection_point = synthetic_profiles(50, 40, "two", seed=seed)
+    ln_cp = np.log(cp)
+
+    # 閉合解 OLS 與 numpy 多項式回歸
+    slope, intercept = models.ols_fit(time, ln_cp)
+    reference = np.array([np.polyfit(time, row, 1) for row in ln_cp])
+    ok = np.allclose(slope, reference[:, 0], rtol=1e-9) and np.allclose(intercept, reference[:, 1], rtol=1e-9)
+    checks.append(('ols_fit == np.polyfit', ok, ''))
+
+    # 閉合解 OLS 與 statsmodels (未安裝時略過)
+    try:
+        summary = models.regression_summary(time, ln_cp[0])
+        ok = np.isclose(summary['slope'], slope[0], rtol=1e-9) and np.isclose(summary['intercept'], intercept[0],
+                                                                              rtol=1e-9)
+        checks.append(('ols_fit == statsmodels OLS', ok, ''))
+    except ImportError:
+        checks.append(('ols_fit == statsmodels OLS', True, '未安裝 statsmodels，略過'))
+
+    # 批次回歸與逐一回歸 (linear_regression 的截距、斜率四捨五入到小數第 4 位)
+    _, batch_intercept, batch_slope, _ = models.linear_regression_batch(time, ln_cp, time[-1])
+    single = np.array([models.linear_regression(time, row, time[-1])[1:3] for row in ln_cp])
+    ok = np.array_equal(np.round(batch_intercept, 4), single[:, 0]) and np.array_equal(np.round(batch_slope, 4),
+                                                                                        single[:, 1])
+    checks.append(('linear_regression_batch == linear_regression', ok, ''))
+
+    # 族群殘差法與單一受試者的二室模型擬合
+    cohort = models.strip_two_compartment_cohort(time, cp, inflection_point)
+    mismatches = 0
+    for subject in range(len(cp)):
+        fit = models.fit_two_compartment(time, cp[subject], SYNTHETIC_DOSE, inflection_point)
+        if fit is None:
+            mismatches += bool(cohort['valid'][subject])
+            continue
+        expected = [fit.results[key] for key in ('a', 'alpha', 'b', 'beta')]
+        actual = [round(float(cohort[key][subject]), 4) for key in ('a', 'alpha', 'b', 'beta')]
+        mismatches += not (cohort['valid'][subject] and np.allclose(actual, expected, atol=1e-4))
+    checks.append(('strip_two_compartment_cohort == fit_two_compartment', mismatches == 0,
+                   f'{mismatches} 位受試者不一致' if mismatches else ''))
+
+    # 擬合快取命中時的結果與直接擬合相同
+    file_processor.clear_fit_cache()
+    direct = models.fit_two_compartment(time, cp[0], SYNTHETIC_DOSE, models.AUTO_INFLECTION)
+    first, _ = file_processor.cached_fit(time, cp[0], SYNTHETIC_DOSE, "二室模型", False, models.AUTO_INFLECTION,
+                                         "adj_r2")
+    second, _ = file_processor.cached_fit(time, cp[0], SYNTHETIC_DOSE, "二室模型", False, models.AUTO_INFLECTION,
+                                          "adj_r2")
+    ok = second is first and (first.results == direct.results if direct is not None else first is None)
+    checks.append(('cached_fit == fit_two_compartment', ok, ''))
+    return checks
+
+
+# ---------- 各階段的基準測試 ----------
+
+def bench_models(points, subjects, repeat, min_time):
+    """linear_regression、模型擬合 (單一受試者) 與批次 / 族群運算"""
+    records = []
+    for n_points in points:
+        time, cp, inflection_point = synthetic_profiles(1, n_points, "two")
+        ln_cp = np.log(cp[0])
+        params = {'points': n_points}
+        records.append(record('linear_regression', params, measure(
+            lambda: models.linear_regression(time, ln_cp, time[-1]), repeat, min_time)))
+        records.append(record('fit_one_compartment', params, measure(
+            lambda: models.fit_one_compartment(time, cp[0], SYNTHETIC_DOSE), repeat, min_time)))
+        records.append(record('fit_two_compartment', params, measure(
+            lambda: models.fit_two_compartment(time, cp[0], SYNTHETIC_DOSE, inflection_point), repeat, min_time)))
+        records.append(record('fit_two_compartment[auto]', params, measure(
+            lambda: models.fit_two_compartment(time, cp[0], SYNTHETIC_DOSE, models.AUTO_INFLECTION), repeat,
+            min_time)))
+
+        for n_subjects in subjects:
+            if n_subjects * n_points > MAX_CELLS:
+                continue
+            time, cohort_cp, inflection_point = synthetic_profiles(n_subjects, n_points, "two")
+            ln_cohort = np.log(cohort_cp)
+            params = {'points': n_points, 'subjects': n_subjects}
+            records.append(record('linear_regression_batch', params, measure(
+                lambda: models.linear_regression_batch(time, ln_cohort, time[-1]), repeat, min_time)))
+            records.append(record('strip_two_compartment_cohort', params, measure(
+                lambda: models.strip_two_compartment_cohort(time, cohort_cp, inflection_point), repeat, min_time)))
+            records.append(record('fit_cohort_curves[auto]', params, measure(
+                lambda: models.fit_cohort_curves("二室模型", time, cohort_cp), repeat, min_time)))
+    return records
+
+
+def bench_renderers(points, subjects, repeat, min_time):
+    """image_processor 的繪圖 (圖檔位元組，不含寫檔)；export 設定沿用原本的項目名稱，preview 設定另加 [preview]"""
+    records = []
+    for n_points in points:
+        time, cp, inflection_point = synthetic_profiles(1, n_points, "two")
+        one = models.fit_one_compartment(time, cp[0], SYNTHETIC_DOSE)
+        two = models.fit_two_compartment(time, cp[0], SYNTHETIC_DOSE, inflection_point)
+        params = {'points': n_points}
+        records.append(record('decimate_minmax', params, measure(
+            lambda: image_processor.decimate_minmax(time, cp[0], 1000), repeat, min_time)))
+        for profile, suffix in (("export", ""), ("preview", "[preview]")):
+            records.append(record(f'render_one_compartment{suffix}', params, measure(
+                lambda: image_processor.render_one_compartment(one.time, one.cp, one.dose, one.new_time_range,
+                                                               one.predicted_cp, "Hour", "mg/L", "mg",
+                                                               profile=profile),
+                repeat, min_time)))
+            if two is not None:
+                records.append(record(f'render_two_compartment{suffix}', params, measure(
+                    lambda: image_processor.render_two_compartment(two.time, two.cp, two.dose, two.new_time_range_a,
+                                                                   two.predicted_cp_a, two.new_time_range_b,
+                                                                   two.predicted_cp_b, two.a, two.b, "Hour", "mg/L",
+                                                                   "mg", profile=profile),
+                    repeat, min_time)))
+
+        for n_subjects in subjects:
+            if n_subjects * n_points > MAX_CELLS:
+                continue
+            time, cohort_cp, _ = synthetic_profiles(n_subjects, n_points, "two")
+            fitted = models.fit_cohort_curves("二室模型", time, cohort_cp)
+            records.append(record('render_cohort', {'points': n_points, 'subjects': n_subjects}, measure(
+                lambda: image_processor.render_cohort(time, cohort_cp, fitted['time'], fitted['curves'], "Hour", "mg/L",
+                                                      band=(5, 95)),
+                repeat, min_time)))
+    return records
+
+
+@contextlib.contextmanager
+def isolated_temp_folder(work_dir):
+    """暫時將暫存資料夾、圖檔儲存區與量測紀錄指向 work_dir 之下，結束後還原
+
+    各模組在匯入時以 from config import ... 取得路徑，因此一併替換這些模組中的名稱；
+    基準測試的圖檔與匯出不會寫入使用者的暫存資料夾，也不會淘汰其中的圖檔。
+    """
+    temp_dir = os.path.join(work_dir, 'temp')
+    artifact_dir = os.path.join(temp_dir, '.artifacts')
+    patches = [(config, 'TEMP_FOLDER_PATH', temp_dir), (config, 'ARTIFACT_DIR', artifact_dir),
+               (artifact_store, 'ARTIFACT_DIR', artifact_dir), (artifact_store, '_index', None),
+               (artifact_store, '_total_bytes', 0),
+               (instrumentation, 'PROFILE_LOG_PATH', os.path.join(temp_dir, 'profile_log.jsonl'))]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield temp_dir
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+
+def bench_pipeline(points, repeat, min_time, work_dir):
+    """process_file (冷快取 / 熱快取、是否繪圖)、run_interface 與 save_file (暫存檔都寫入 work_dir)"""
+    records = []
+    for n_points in points:
+        if n_points > MAX_WORKBOOK_POINTS:
+            continue
+        time, cp, inflection_point = synthetic_profiles(1, n_points, "two")
+        workbook = write_workbook(os.path.join(work_dir, f'synthetic_{n_points}.xlsx'), time, cp)
+        # 轉折點需與活頁簿讀回的時間值完全相同
+        sheet_times = np.array(file_processor.get_time_columns(workbook, '1'))
+        inflection_point = float(sheet_times[np.argmin(np.abs(sheet_times - inflection_point))])
+        params = {'points': n_points}
+
+        def process(render, cold):
+            if cold:
+                file_processor.clear_sheet_cache()
+                file_processor.clear_fit_cache()
+            result, _, _ = file_processor.process_file(workbook, '1', "二室模型", "Hour", "mg/L", "mg",
+                                                       inflection_point, "", render=render, output_dir=work_dir)
+            if 'Error' in result:
+                raise RuntimeError(result['Error'])
+
+        records.append(record('process_file[cold]', params, measure(lambda: process(False, True), repeat, min_time)))
+        records.append(record('process_file[warm]', params, measure(lambda: process(False, False), repeat, min_time)))
+        records.append(record('process_file[render]', params, measure(lambda: process(True, False), repeat,
+                                                                      min_time)))
+
+        def analyse():
+            file_processor.clear_sheet_cache()
+            file_processor.clear_fit_cache()
+            file_processor.forget_session('benchmark')
+            file_processor.run_interface(workbook, '1', "Hour", "mg/L", "mg", inflection_point, "",
+                                         session_id='benchmark')
+
+        records.append(record('run_interface[cold]', params, measure(analyse, repeat, min_time)))
+
+        title = f'benchmark_{n_points}'
+        records.append(record('save_file[xlsx]', params, measure(
+            lambda: file_processor.save_file(title, session_id='benchmark'), repeat, min_time)))
+        shutil.rmtree(config.export_dir(title, 'benchmark'), ignore_errors=True)
+        # 彙整檔寫入暫存資料夾，不附加到使用者的 cohort_results.csv
+        run = result_store.get_run('benchmark')
+        cohort_path = os.path.join(work_dir, 'cohort_results.csv')
+        records.append(record('exporter.append_run[csv]', params, measure(
+            lambda: exporter.append_run(cohort_path, run), repeat, min_time)))
+
+    file_processor.forget_session('benchmark')
+    return records
+
+
+# ---------- 啟動時間 ----------
+
+def _import_apps():
+    """在新的直譯器中以 -X importtime 匯入 apps
+
+    回傳 (耗時, 各模組的 (名稱, 自身 us, 累計 us, 巢狀層級) 列表, 啟動時已載入的延遲模組)
+    """
+    code = ("import sys, json, apps; "
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+    env = dict(os.environ, GRADIO_ANALYTICS_ENABLED='False')
+    start = time_module.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env, timeout=STARTUP_TIMEOUT)
+    elapsed = time_module.perf_counter() - start
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else "import apps 失敗")
+    # 格式：import time: self [us] | cumulative | imported package (名稱前每多一層巢狀多兩個空白)
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)', line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2)), (len(match.group(3)) - 1) // 2))
+    loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+    return elapsed, modules, loaded
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _first_page():
+    """以伺服器模式啟動 apps.py，回傳直到首頁回應 HTTP 200 的秒數"""
+    port = _free_port()
+    env = dict(os.environ, GRADIO_SERVER_PORT=str(port), GRADIO_ANALYTICS_ENABLED='False', PK_SERVING_MODE='1')
+    url = f'http://127.0.0.1:{port}/'
+    start = time_module.perf_counter()
+    process = subprocess.Popen([sys.executable, 'apps.py'], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time_module.perf_counter() - start < STARTUP_TIMEOUT:
+            if process.poll() is not None:
+                raise RuntimeError(f"apps.py 提前結束 (代碼 {process.returncode})")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time_module.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time_module.sleep(0.05)
+        raise RuntimeError(f"{STARTUP_TIMEOUT:.0f} 秒內首頁沒有回應")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def bench_startup(repeat, top=15):
+    """冷啟動：import apps 的耗時與 -X importtime 分解 (apps 直接匯入的模組依累計耗時排序)、啟動時已載入的延遲模組、
+    開啟首頁的耗時
+
+    回傳 (基準項目列表, 啟動報告)；報告中的 importtime 以最後一次執行為準。
+    """
+    import_timings = []
+    for _ in range(repeat):
+        elapsed, modules, loaded = _import_apps()
+        import_timings.append(elapsed)
+    page_timings = [_first_page() for _ in range(repeat)]
+
+    # 只加總最上層的模組即為總匯入時間；gradio 與本專案模組另外列出
+    top_level = [item for item in modules if item[3] == 0]
+    # importtime 先列出子模組再列出上層模組：apps 之前、上一個最上層模組之後的第一層即為 apps 直接匯入的模組
+    direct, children = [], []
+    for item in modules:
+        if item[3] == 1:
+            children.append(item)
+        elif item[3] == 0:
+            if item[0] == 'apps':
+                direct = children
+            children = []
+    own = {os.path.splitext(name)[0] for name in os.listdir(os.path.dirname(os.path.abspath(__file__)))
+           if name.endswith('.py')}
+    report = {
+        'import_total_ms': round(sum(item[2] for item in top_level) / 1e3, 1),
+        'gradio_ms': round(sum(item[2] for item in modules if item[0] == 'gradio') / 1e3, 1),
+        'app_self_ms': round(sum(item[1] for item in modules if item[0] in own) / 1e3, 1),
+        'top_cumulative': [{'module': name, 'self_ms': round(self_us / 1e3, 1),
+                            'cumulative_ms': round(cumulative_us / 1e3, 1)}
+                           for name, self_us, cumulative_us, _ in sorted(direct, key=lambda item: -item[2])[:top]],
+        'lazy_modules_loaded': loaded,
+    }
+    records = [record('startup.import_apps', {}, import_timings), record('startup.first_page', {}, page_timings)]
+    return records, report
+
+
+def check_startup(records, report, budget):
+    """回傳超出啟動預算或啟動時就載入延遲模組的問題列表"""
+    problems = [f"啟動時已載入: {name}" for name in report['lazy_modules_loaded']]
+    for item in records:
+        if item['median_s'] > budget:
+            problems.append(f"{item['name']} {item['median_s']:.2f} s 超過預算 {budget:.2f} s")
+    return problems
+
+
+# ---------- 輸出與比較 ----------
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': time_module.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _record_key(item):
+    return item['name'], json.dumps(item['params'], sort_keys=True)
+
+
+def compare(current, baseline, threshold):
+    """與先前的結果比較中位數耗時，回傳變慢超過 threshold 倍的項目"""
+    previous = {_record_key(item): item for item in baseline['results']}
+    regressions = []
+    for item in current['results']:
+        old = previous.get(_record_key(item))
+        if old is None:
+            continue
+        ratio = item['median_s'] / old['median_s'] if old['median_s'] > 0 else float('inf')
+        print(f"{item['name']:<45} {json.dumps(item['params']):<35} {old['median_s'] * 1e3:>10.3f} ms -> "
+              f"{item['median_s'] * 1e3:>10.3f} ms  x{ratio:.2f}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append((item, ratio))
+    return regressions
+
+
+def parse_sizes(text):
+    return tuple(int(float(value)) for value in text.split(','))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以合成資料計時分析流程的各個階段，輸出 JSON 結果")
+    parser.add_argument('-o', '--output', help="JSON 結果的輸出檔案 (預設輸出到標準輸出)")
+    parser.add_argument('--points', type=parse_sizes, help="每位受試者的取樣點數，以逗號分隔 (例如 10,1000,1e6)")
+    parser.add_argument('--subjects', type=parse_sizes, help="族群批次運算的受試者數，以逗號分隔 (例如 1,100,1e4)")
+    parser.add_argument('--repeat', type=int, default=5, help="每個項目至少執行的次數")
+    parser.add_argument('--min-time', type=float, default=0.2, help="每個項目至少累積的執行秒數")
+    parser.add_argument('--quick', action='store_true', help="只執行小規模資料 (快速確認用)")
+    parser.add_argument('--only', choices=('models', 'renderers', 'pipeline', 'startup'), action='append',
+                        help="只執行指定的階段 (可重複指定；startup 需另外指定，預設不執行)")
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help="import apps 與開啟首頁的中位數耗時上限 (秒)，超過時結束代碼為 3")
+    parser.add_argument('--compare', help="與先前輸出的 JSON 結果比較")
+    parser.add_argument('--threshold', type=float, default=1.25, help="中位數耗時變為幾倍以上時視為變慢")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    points = args.points or (QUICK_POINTS if args.quick else DEFAULT_POINTS)
+    subjects = args.subjects or (QUICK_SUBJECTS if args.quick else DEFAULT_SUBJECTS)
+    stages = args.only or ('models', 'renderers', 'pipeline')
+
+    # 分析流程本身的訊息改印到標準錯誤，標準輸出只留給 JSON 結果
+    with contextlib.redirect_stdout(sys.stderr):
+        checks = check_equivalence()
+        for name, ok, note in checks:
+            print(f"[{'OK' if ok else 'FAIL'}] {name} {note}".rstrip())
+
+        results = []
+        startup = None
+        work_dir = tempfile.mkdtemp(prefix='pk_benchmark_')
+        try:
+            if 'models' in stages:
+                results += bench_models(points, subjects, args.repeat, args.min_time)
+            if 'renderers' in stages:
+                results += bench_renderers(points, subjects, args.repeat, args.min_time)
+            if 'pipeline' in stages:
+                with isolated_temp_folder(work_dir):
+                    results += bench_pipeline(points, args.repeat, args.min_time, work_dir)
+            if 'startup' in stages:
+                startup_records, startup = bench_startup(args.repeat)
+                results += startup_records
+                startup['budget_s'] = args.startup_budget
+                startup['problems'] = check_startup(startup_records, startup, args.startup_budget)
+                for problem in startup['problems']:
+                    print(f"[FAIL] {problem}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'environment': environment_info(),
+        'equivalence': [{'name': name, 'ok': bool(ok), 'note': note} for name, ok, note in checks],
+        'results': results,
+    }
+    if startup is not None:
+        output['startup'] = startup
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    status = 0 if all(ok for _, ok, _ in checks) else 1
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(output, json.load(f), args.threshold)
+        for item, ratio in regressions:
+            print(f"變慢: {item['name']} {item['params']} x{ratio:.2f}", file=sys.stderr)
+        status = status or (2 if regressions else 0)
+    if startup is not None and startup['problems']:
+        status = status or 3
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Bootstrap 信賴區間：一次以批次閉合解回歸擬合所有重抽樣樣本
+
+兩種重抽樣方式：
+- case：每個樣本自原始資料點中重複抽取相同點數 (依時間排序後擬合)
+- residual：以點估計的擬合曲線加上重抽的對數殘差 (時間點不變)；二室模型的樣本另平移至以點估計為中心
+
+所有樣本排成 (樣本數, 點數) 的矩陣，一室模型以 models.ols_fit、二室模型以
+models.strip_two_compartment_cohort 一次擬合，參數公式與 fit_one_compartment / fit_two_compartment 相同。
+樣本依固定大小分塊，每塊使用由 seed 衍生的獨立亂數產生器，結果只取決於 seed 與樣本數，
+與 n_jobs (平行的執行緒數) 無關。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import models
+
+BOOTSTRAP_METHODS = ("case", "residual")
+CHUNK_SIZE = 500  # 每塊樣本數 (決定亂數序列的切分方式，修改後相同 seed 的結果會不同)
+
+
+def _one_compartment_parameters(time, cp, dose, slope, intercept):
+    """與 fit_one_compartment 相同的參數公式 (向量化，斜率與截距同樣先四捨五入)"""
+    slope = np.round(slope, 4)
+    k_e = np.round(intercept, 4)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        auc_observed = np.trapz(cp, time, axis=-1)
+        cp_0 = np.exp(k_e)
+        v_d = dose / cp_0
+        return {
+            'slope': slope,
+            'k_e': k_e,
+            'half_life': 0.693 / k_e,
+            'intercept': k_e,
+            'initial_concentration': cp_0,
+            'clearance': k_e * v_d,
+            'VD': v_d,
+            'AUC(0-t)': auc_observed,
+            'AUC(0-finity)': auc_observed + cp[..., -1] / (-slope),
+        }
+
+
+def _two_compartment_parameters(time, cp, dose, stripped):
+    """與 fit_two_compartment 相同的參數公式 (向量化)"""
+    a, alpha, b, beta = stripped['a'], stripped['alpha'], stripped['b'], stripped['beta']
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        k_21 = (a * beta + b * alpha) / (a + b)
+        k_10 = (alpha * beta) / k_21
+        k_12 = alpha + beta - k_21 - k_10
+        volume = dose / (a + b)
+        auc_observed = np.trapz(cp, time, axis=-1)
+        return {
+            'a': a,
+            'alpha': alpha,
+            'b': b,
+            'beta': beta,
+            'k_21': k_21,
+            'k_10': k_10,
+            'k_12': k_12,
+            'half_life_alpha': 0.693 / alpha,
+            'half_life_beta': 0.693 / beta,
+            'half_life_k21': 0.693 / k_21,
+            'half_life_k10': 0.693 / k_10,
+            'half_life_k12': 0.693 / k_12,
+            'AUC(0-t)': auc_observed,
+            'AUC(0-finity)': auc_observed + cp[..., -1] / beta,
+            'Volume': volume,
+            'VDss': volume * (1 + (k_12 / k_21)),
+            'clearance': k_10 * volume,
+            'Cmax': np.max(cp, axis=-1),
+        }
+
+
+def _case_samples(rng, time, cp, size):
+    """case 重抽樣：原始資料已依時間排序，排序抽出的索引即可讓每個樣本依時間排序"""
+    index = np.sort(rng.integers(0, len(time), size=(size, len(time))), axis=-1)
+    return time[index], cp[index]
+
+
+def _residual_samples(rng, time, ln_fitted, residuals, size):
+    """residual 重抽樣：擬合值 (對數) 加上重抽的殘差"""
+    index = rng.integers(0, len(residuals), size=(size, len(residuals)))
+    return np.broadcast_to(time, index.shape), np.exp(ln_fitted + residuals[index])
+
+
+def _one_compartment_chunk(rng, size, time, cp, dose, method, ln_fitted, residuals):
+    if method == "case":
+        sample_time, sample_cp = _case_samples(rng, time, cp, size)
+    else:
+        sample_time, sample_cp = _residual_samples(rng, time, ln_fitted, residuals, size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope, intercept = models.ols_fit(sample_time, np.log(sample_cp))
+    return _one_compartment_parameters(sample_time, sample_cp, dose, slope, intercept)
+
+
+def _two_compartment_chunk(rng, size, time, cp, dose, inflection_point, method, ln_fitted, residuals):
+    if method == "case":
+        sample_time, sample_cp = _case_samples(rng, time, cp, size)
+        # 轉折點可能未被抽中，改以每個樣本中第一個不早於轉折點的時間作為後段起點
+        sample_inflection = np.where(sample_time >= inflection_point, sample_time, np.inf).min(axis=-1)
+    else:
+        sample_time, sample_cp = _residual_samples(rng, time, ln_fitted, residuals, size)
+        sample_inflection = inflection_point
+    stripped = models.strip_two_compartment_cohort(sample_time, sample_cp, sample_inflection)
+    parameters = _two_compartment_parameters(sample_time, sample_cp, dose, stripped)
+    for key in parameters:
+        parameters[key] = np.where(stripped['valid'], parameters[key], np.nan)
+    return parameters
+
+
+def _run_chunks(chunk_function, n_boot, seed, n_jobs, *args):
+    """依固定大小分塊產生所有樣本並合併各參數"""
+    sizes = [min(CHUNK_SIZE, n_boot - start) for start in range(0, n_boot, CHUNK_SIZE)]
+    rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(len(sizes))]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(sizes) == 1:
+        chunks = [chunk_function(rng, size, *args) for rng, size in zip(rngs, sizes)]
+    else:
+        # NumPy 的陣列運算會釋放 GIL，以執行緒平行即可，不需複製資料到子行程
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            chunks = list(executor.map(lambda pair: chunk_function(pair[0], pair[1], *args), zip(rngs, sizes)))
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+
+def percentile_intervals(replicates, ci=95):
+    """各參數的百分位數信賴區間 (忽略無法擬合或結果非有限值的樣本)，回傳 {參數: (下限, 上限)}"""
+    tail = (100 - ci) / 2
+    intervals = {}
+    for key, values in replicates.items():
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            intervals[key] = (np.nan, np.nan)
+        else:
+            low, high = np.percentile(values, [tail, 100 - tail])
+            intervals[key] = (round(float(low), 4), round(float(high), 4))
+    return intervals
+
+
+def bootstrap_one_compartment(time, cp, dose, n_boot=1000, method="case", seed=None, ci=95, n_jobs=1):
+    """一室模型參數的 bootstrap 信賴區間
+
+    回傳 {'method', 'n_boot', 'n_valid', 'ci', 'intervals': {參數: (下限, 上限)}}；
+    n_jobs 為平行的執行緒數，None 或小於 1 時使用所有核心。
+    """
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"未知的 bootstrap 方法: {method}")
+    time = np.asarray(time, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    ln_cp = np.log(cp)
+    slope, intercept = models.ols_fit(time, ln_cp)
+    ln_fitted = intercept + slope * time
+    residuals = ln_cp - ln_fitted
+
+    replicates = _run_chunks(_one_compartment_chunk, n_boot, seed, n_jobs, time, cp, dose, method, ln_fitted,
+                             residuals)
+    return _summary(replicates, method, n_boot, ci, np.isfinite(replicates['slope']))
+
+
+def bootstrap_two_compartment(time, cp, dose, inflection_point, n_boot=1000, method="case", seed=None, ci=95,
+                              n_jobs=1):
+    """二室模型參數的 bootstrap 信賴區間 (inflection_point 為點估計採用的轉折點時間)
+
+    回傳格式與 bootstrap_one_compartment 相同；無法以殘差法拆分的樣本不列入區間。
+    """
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"未知的 bootstrap 方法: {method}")
+    time = np.asarray(time, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    point = models.strip_two_compartment_cohort(time[np.newaxis], cp[np.newaxis], inflection_point)
+    if not point['valid'][0]:
+        raise ValueError("此資料集不適用於二室模型，無法進行 bootstrap")
+    ln_fitted = np.log(point['a'][0] * np.exp(-point['alpha'][0] * time)
+                       + point['b'][0] * np.exp(-point['beta'][0] * time))
+    residuals = np.log(cp) - ln_fitted
+    residuals = residuals - residuals.mean()  # 非線性擬合的殘差平均不為零，先置中
+
+    replicates = _run_chunks(_two_compartment_chunk, n_boot, seed, n_jobs, time, cp, dose, inflection_point,
+                             method, ln_fitted, residuals)
+    if method == "residual":
+        _center_on_estimate(replicates, time, cp, dose, inflection_point, point, np.exp(ln_fitted))
+    return _summary(replicates, method, n_boot, ci, np.isfinite(replicates['alpha']))
+
+
+def _center_on_estimate(replicates, time, cp, dose, inflection_point, point, fitted_cp):
+    """將 residual 樣本平移至以點估計為中心
+
+    殘差法的前段以 ln(Cp) 回歸，並非雙指數曲線的最小平方擬合，重新拆分擬合曲線本身得到的參數與點估計不同，
+    residual 樣本會集中在前者附近；以兩者的差值平移所有樣本 (擬合曲線無法拆分時不平移)。
+    """
+    reference = models.strip_two_compartment_cohort(time[np.newaxis], fitted_cp[np.newaxis], inflection_point)
+    if not reference['valid'][0]:
+        return
+    estimate = _two_compartment_parameters(time[np.newaxis], cp[np.newaxis], dose, point)
+    reference = _two_compartment_parameters(time[np.newaxis], fitted_cp[np.newaxis], dose, reference)
+    for key in replicates:
+        replicates[key] = replicates[key] + (estimate[key][0] - reference[key][0])
+
+
+def _summary(replicates, method, n_boot, ci, valid):
+    return {'method': method, 'n_boot': n_boot, 'n_valid': int(valid.sum()), 'ci': ci,
+            'intervals': percentile_intervals(replicates, ci)}
+
+
+def interval_fields(summary):
+    """將信賴區間攤平成 {參數_ci_low, 參數_ci_high} 欄位，可直接併入結果字典"""
+    fields = {}
+    for key, (low, high) in summary['intervals'].items():
+        fields[f'{key}_ci_low'] = low
+        fields[f'{key}_ci_high'] = high
+    return fields
+
+
+def format_summary(summary):
+    """提示訊息用的信賴區間摘要"""
+    lines = [f"Bootstrap ({summary['method']}, {summary['n_valid']}/{summary['n_boot']} 個樣本有效) "
+             f"{summary['ci']}% 信賴區間："]
+    for key, (low, high) in summary['intervals'].items():
+        lines.append(f"  {key}: [{low}, {high}]")
+    return "\n".join(lines) + "\n"
+
+
+def bootstrap_model(model_type, time, cp, dose, inflection_point=None, n_boot=1000, method="case", seed=None, ci=95,
+                    n_jobs=1):
+    """依模型類型 ("一室模型" / "二室模型") 計算 bootstrap 信賴區間"""
+    if model_type == "一室模型":
+        return bootstrap_one_compartment(time, cp, dose, n_boot, method, seed, ci, n_jobs)
+    return bootstrap_two_compartment(time, cp, dose, inflection_point, n_boot, method, seed, ci, n_jobs)
@@ -0,0 +1,369 @@
+"""族群資料庫：將大量活頁簿 (每個工作表一位受試者) 轉換為磁碟上的欄式資料，之後的分析不再讀取 Excel
+
+資料夾結構：
+    manifest.json         版本、單位、受試者數與各陣列長度
+    subjects.csv          每位受試者一列：來源檔案、工作表、劑量 (原始 / 平均值資料)、單位、點數
+    raw_time.f64 / raw_cp.f64 / raw_offsets.npy   原始數據 (已刪除 cp 空值並依時間排序) 串接成連續陣列
+    avg_time.f64 / avg_cp.f64 / avg_offsets.npy   相同時間點取平均後的數據
+
+第 i 位受試者的資料為 time[offsets[i]:offsets[i + 1]]，以 np.memmap 開啟，切片不複製資料，
+可直接傳給 models 的擬合函數。
+
+用法範例：
+    python src/cohort_store.py build dataset/ -o cohort_store/
+    python src/cohort_store.py analyse cohort_store/ -o results.csv --workers 8
+    python src/cohort_store.py nca cohort_store/ -o nca.csv --auc-method linear-up/log-down
+    python src/cohort_store.py plot cohort_store/ -o cohort.png --model two --band 5,95
+"""
+import argparse
+import json
+import os
+import sys
+import time as time_module
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import batch_cli
+import exporter
+import file_processor
+import models
+import nca
+
+STORE_VERSION = 1
+SUBJECT_COLUMNS = ['subject', 'file', 'sheet', 'dose', 'avg_dose', 'x_unit', 'y_unit', 'dose_unit', 'raw_points',
+                   'avg_points']
+ARRAY_DTYPE = np.float64
+# plot 子命令的 --model 選項
+MODEL_TYPES = {'one': "一室模型", 'two': "二室模型"}
+
+
+def _first_dose(dose):
+    """與 process_file 相同：取第一個非零、非空值的劑量，沒有時為 NaN"""
+    valid = dose[~np.isnan(dose) & (dose != 0)]
+    return float(valid[0]) if len(valid) else np.nan
+
+
+def build_store(paths, store_dir, x_unit="Minute", y_unit="mg/L", dose_unit="mg", progress=None):
+    """讀取活頁簿 (及 CSV / Parquet) 中所有含 time、cp 欄位的工作表，寫入族群資料庫
+
+    陣列逐位受試者附加寫入檔案，記憶體中只保留一位受試者的資料與 subjects 表格。
+    回傳 (受試者數, 略過的工作表列表)。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    subjects = []
+    skipped = []
+    offsets = {'raw': [0], 'avg': [0]}
+    files = {name: open(os.path.join(store_dir, f'{name}.f64'), 'wb')
+             for name in ('raw_time', 'raw_cp', 'avg_time', 'avg_cp')}
+    try:
+        for file_path in batch_cli.find_workbooks(paths, exclude=[store_dir]):
+            try:
+                sheet_names = file_processor.get_sheet_names(file_path)
+            except Exception as e:
+                skipped.append((file_path, '', f'{type(e).__name__}: {e}'))
+                continue
+            for sheet_name in sheet_names:
+                try:
+                    entry = file_processor.parse_sheet(file_path, sheet_name)
+                except Exception as e:
+                    skipped.append((file_path, sheet_name, f'{type(e).__name__}: {e}'))
+                    continue
+                if not entry['has_columns']:
+                    skipped.append((file_path, sheet_name, "'time' 或 'cp' 欄位不存在"))
+                    continue
+                for kind in ('raw', 'avg'):
+                    data = entry[kind]
+                    data['time'].astype(ARRAY_DTYPE).tofile(files[f'{kind}_time'])
+                    data['cp'].astype(ARRAY_DTYPE).tofile(files[f'{kind}_cp'])
+                    offsets[kind].append(offsets[kind][-1] + len(data['time']))
+                subjects.append({
+                    'subject': len(subjects), 'file': file_path, 'sheet': sheet_name,
+                    'dose': _first_dose(entry['raw']['dose']), 'avg_dose': _first_dose(entry['avg']['dose']),
+                    'x_unit': x_unit, 'y_unit': y_unit,
+                    'dose_unit': dose_unit, 'raw_points': len(entry['raw']['time']),
+                    'avg_points': len(entry['avg']['time']),
+                })
+                if progress:
+                    progress(len(subjects), file_path, sheet_name)
+    finally:
+        for f in files.values():
+            f.close()
+
+    for kind in ('raw', 'avg'):
+        np.save(os.path.join(store_dir, f'{kind}_offsets.npy'), np.asarray(offsets[kind], dtype=np.int64))
+    pd.DataFrame(subjects, columns=SUBJECT_COLUMNS).to_csv(os.path.join(store_dir, 'subjects.csv'), index=False)
+    manifest = {
+        'version': STORE_VERSION, 'created': time_module.strftime('%Y-%m-%dT%H:%M:%S'),
+        'subjects': len(subjects), 'raw_points': offsets['raw'][-1], 'avg_points': offsets['avg'][-1],
+        'dtype': np.dtype(ARRAY_DTYPE).str, 'units': {'x': x_unit, 'y': y_unit, 'dose': dose_unit},
+    }
+    with open(os.path.join(store_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return len(subjects), skipped
+
+
+class CohortStore:
+    """以唯讀 memmap 開啟的族群資料庫"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != STORE_VERSION:
+            raise ValueError(f"不支援的族群資料庫版本: {self.manifest['version']}")
+        self.subjects = pd.read_csv(os.path.join(store_dir, 'subjects.csv'), dtype={'sheet': str})
+        self._doses = {'raw': self.subjects['dose'].to_numpy(dtype=float),
+                       'avg': self.subjects['avg_dose'].to_numpy(dtype=float)}
+        self._arrays = {}
+        for kind in ('raw', 'avg'):
+            length = self.manifest[f'{kind}_points']
+            self._arrays[kind] = {
+                'time': self._memmap(f'{kind}_time.f64', length),
+                'cp': self._memmap(f'{kind}_cp.f64', length),
+                'offsets': np.load(os.path.join(store_dir, f'{kind}_offsets.npy'), mmap_mode='r'),
+            }
+
+    def _memmap(self, name, length):
+        if length == 0:
+            return np.empty(0, dtype=self.manifest['dtype'])
+        return np.memmap(os.path.join(self.store_dir, name), dtype=self.manifest['dtype'], mode='r',
+                         shape=(length,))
+
+    def __len__(self):
+        return self.manifest['subjects']
+
+    def profile(self, index, average=False):
+        """第 index 位受試者的 (time, cp) 唯讀切片 (不複製資料)"""
+        arrays = self._arrays['avg' if average else 'raw']
+        start, stop = arrays['offsets'][index], arrays['offsets'][index + 1]
+        return arrays['time'][start:stop], arrays['cp'][start:stop]
+
+    def arrays(self, average=False):
+        """整個資料庫的串接陣列 (time, cp, offsets)，供 nca 等分段運算使用 (唯讀 memmap，不複製資料)"""
+        arrays = self._arrays['avg' if average else 'raw']
+        return arrays['time'], arrays['cp'], arrays['offsets']
+
+    def dose(self, index, average=False):
+        """第 index 位受試者的劑量 (第一個非零、非空值，沒有時為 NaN；index 可為切片或陣列)"""
+        return self._doses['avg' if average else 'raw'][index]
+
+    def padded(self, indices, average=False):
+        """多位受試者的資料排成 (受試者數, 最大點數) 的矩陣 (長度不足處為 NaN)，供族群批次運算使用"""
+        arrays = self._arrays['avg' if average else 'raw']
+        indices = np.asarray(indices)
+        starts = np.asarray(arrays['offsets'][indices])
+        lengths = np.asarray(arrays['offsets'][indices + 1]) - starts
+        width = int(lengths.max()) if len(lengths) else 0
+        columns = np.arange(width)
+        valid = columns < lengths[:, np.newaxis]
+        positions = np.where(valid, starts[:, np.newaxis] + columns, 0)
+        time = np.where(valid, arrays['time'][positions] if width else np.empty(valid.shape), np.nan)
+        cp = np.where(valid, arrays['cp'][positions] if width else np.empty(valid.shape), np.nan)
+        return time, cp
+
+    def find(self, file_path, sheet_name):
+        """依來源檔案與工作表名稱找到受試者編號，找不到時回傳 None"""
+        match = self.subjects[(self.subjects['file'] == os.path.abspath(file_path))
+                              & (self.subjects['sheet'] == str(sheet_name))]
+        return int(match['subject'].iloc[0]) if len(match) else None
+
+
+def fit_subject(store, index, model_type, average=False, inflection_point=models.AUTO_INFLECTION,
+                inflection_criterion="adj_r2"):
+    """以資料庫中的資料擬合單一受試者 (與 process_file 相同的檢查與錯誤訊息，只計算不繪圖)"""
+    time, c_p = store.profile(index, average)
+    dose = store.dose(index, average)
+    if np.isnan(dose):
+        return {"Error": "無有效劑量數據。"}
+    if len(time) < 2:
+        return {"Error": "清理後數據不足以進行分析。"}
+    try:
+        if model_type == "一室模型":
+            fit = models.fit_one_compartment(time, c_p, dose, average)
+        else:
+            fit = models.fit_two_compartment(time, c_p, dose, inflection_point, average,
+                                             criterion=inflection_criterion)
+    except Exception as e:
+        return {"Error": f"模型計算出現錯誤: {e}"}
+    if fit is None:
+        return {"Error": "模型未返回有效結果。"}
+    return dict(fit.results)
+
+
+_worker_store = None
+
+
+def _analyse_chunk(store_dir, indices, options):
+    """在子行程中分析一段受試者 (每個子行程只開啟一次資料庫)"""
+    global _worker_store
+    if _worker_store is None or _worker_store.store_dir != store_dir:
+        _worker_store = CohortStore(store_dir)
+    store = _worker_store
+    rows = []
+    for index in indices:
+        subject = store.subjects.iloc[index]
+        row = {'file': subject['file'], 'sheet': subject['sheet'], 'status': 'ok', 'error': ''}
+        start = time_module.perf_counter()
+        for prefix, model_type, average in batch_cli.PANELS:
+            result = fit_subject(store, index, model_type, average, options['inflection_point'],
+                                 options['inflection_criterion'])
+            row[f'{prefix}_error'] = result.get('Error', '')
+            for key, value in result.items():
+                if key != 'Error':
+                    row[f'{prefix}_{key}'] = value
+        if all(row[f'{prefix}_error'] for prefix, _, _ in batch_cli.PANELS):
+            row['status'] = 'failed'
+            row['error'] = '所有模型皆未成功'
+        row['elapsed_s'] = round(time_module.perf_counter() - start, 4)
+        rows.append(row)
+    return rows
+
+
+def _write_rows(writer, results):
+    """依完成順序寫入每段受試者的結果列，回傳失敗的受試者數"""
+    failed = 0
+    for rows in results:
+        for row in rows:
+            failed += row['status'] != 'ok'
+            writer.write(row)
+    return failed
+
+
+def analyse_store(store_dir, output, workers=1, inflection_point=models.AUTO_INFLECTION,
+                  inflection_criterion="adj_r2", chunk_size=1000, resume=True):
+    """分析資料庫中的所有受試者，結果以 batch_cli 相同的欄位寫入 CSV / Parquet，回傳 (失敗數, 略過數)
+
+    與 batch_cli 相同，續跑時略過輸出檔中已完成 (ok / failed) 的受試者，輸出檔的欄位或選項不同時結束程式；
+    resume=False 時清除舊的輸出後重新分析。
+    """
+    store = CohortStore(store_dir)
+    options = {'inflection_point': inflection_point, 'inflection_criterion': inflection_criterion}
+    writer = batch_cli.open_output(output, batch_cli.result_columns(),
+                                   dict(options, store=os.path.abspath(store_dir)), resume)
+    try:
+        done = batch_cli.completed_jobs(writer)
+        pending = [index for index, job in enumerate(zip(store.subjects['file'], store.subjects['sheet']))
+                   if job not in done]
+        chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+        if workers <= 1:
+            failed = _write_rows(writer, (_analyse_chunk(store_dir, chunk, options) for chunk in chunks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                failed = _write_rows(writer, executor.map(_analyse_chunk, [store_dir] * len(chunks), chunks,
+                                                          [options] * len(chunks)))
+    finally:
+        writer.close()
+    return failed, len(store) - len(pending)
+
+
+def nca_to_file(store_dir, output, average=False, method="linear", lambda_z_points=None):
+    """以 nca 一次計算資料庫中所有受試者的非房室分析指標，寫入 CSV / Parquet，回傳受試者數"""
+    store = CohortStore(store_dir)
+    results = nca.nca_store(store, average, method, lambda_z_points)
+    columns = ['subject', 'file', 'sheet'] + list(nca.NCA_KEYS)
+    writer = exporter.open_writer(output, columns)
+    try:
+        for index, subject in enumerate(store.subjects.itertuples(index=False)):
+            row = {'subject': subject.subject, 'file': subject.file, 'sheet': subject.sheet}
+            row.update({key: values[index].item() for key, values in results.items()})
+            writer.write(row)
+    finally:
+        writer.close()
+    return len(store)
+
+
+def plot_store(store_dir, output, model_type, average=False, inflection_point=models.AUTO_INFLECTION,
+               inflection_criterion="adj_r2", band=None, custom_title="", profile="export"):
+    """將資料庫中所有受試者的觀測值與預測曲線畫在同一張圖 (圖檔格式由副檔名決定)，回傳 (受試者數, 成功擬合數)"""
+    from image_processor import plot_cohort
+
+    store = CohortStore(store_dir)
+    time, cp = store.padded(np.arange(len(store)), average)
+    fitted = models.fit_cohort_curves(model_type, time, cp, inflection_point, inflection_criterion)
+    units = store.manifest['units']
+    title = f"{model_type}{' (平均值)' if average else ''}" + (f" - {custom_title}" if custom_title else "")
+    plot_cohort(time, cp, fitted['time'], fitted['curves'], units['x'], units['y'], output, title, band,
+                profile=profile)
+    return len(store), int(fitted['valid'].sum())
+
+
+def parse_band(text):
+    low, high = (float(value) for value in text.split(','))
+    return low, high
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="建立族群資料庫，或分析資料庫中的所有受試者")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="由活頁簿建立族群資料庫")
+    build.add_argument('paths', nargs='+', help="活頁簿 / CSV / Parquet 檔案或資料夾 (資料夾會遞迴搜尋)")
+    build.add_argument('-o', '--output', required=True, help="資料庫資料夾")
+    build.add_argument('--x-unit', default="Minute")
+    build.add_argument('--y-unit', default="mg/L")
+    build.add_argument('--dose-unit', default="mg")
+
+    analyse = subparsers.add_parser('analyse', help="分析資料庫中的所有受試者")
+    analyse.add_argument('store', help="資料庫資料夾")
+    analyse.add_argument('-o', '--output', required=True, help="輸出檔案 (.csv 或 .parquet)")
+    analyse.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help="平行處理的行程數")
+    analyse.add_argument('--inflection-point', default=models.AUTO_INFLECTION,
+                         help="二室模型轉折點時間，預設為自動搜尋")
+    analyse.add_argument('--inflection-criterion', default="adj_r2", choices=models.INFLECTION_CRITERIA)
+    analyse.add_argument('--no-resume', action='store_true', help="不略過輸出檔中已完成的受試者 (會覆寫輸出檔)")
+
+    nca_parser = subparsers.add_parser('nca', help="對資料庫中的所有受試者進行非房室分析")
+    nca_parser.add_argument('store', help="資料庫資料夾")
+    nca_parser.add_argument('-o', '--output', required=True, help="輸出檔案 (.csv 或 .parquet)")
+    nca_parser.add_argument('--average', action='store_true', help="使用相同時間點取平均後的數據")
+    nca_parser.add_argument('--auc-method', default="linear", choices=nca.AUC_METHODS)
+    nca_parser.add_argument('--lambda-z-points', type=int, default=None, help="λz 固定使用最後幾點，預設為自動選點")
+
+    plot = subparsers.add_parser('plot', help="將所有受試者的觀測值與預測曲線畫在同一張圖")
+    plot.add_argument('store', help="資料庫資料夾")
+    plot.add_argument('-o', '--output', required=True, help="圖檔 (.png、.svg 或 .webp)")
+    plot.add_argument('--model', choices=tuple(MODEL_TYPES), default='two', help="預測曲線的模型")
+    plot.add_argument('--average', action='store_true', help="使用相同時間點取平均後的數據")
+    plot.add_argument('--inflection-point', default=models.AUTO_INFLECTION, help="二室模型轉折點時間，預設為自動搜尋")
+    plot.add_argument('--inflection-criterion', default="adj_r2", choices=models.INFLECTION_CRITERIA)
+    plot.add_argument('--band', type=parse_band, default=None, help="預測曲線的百分位數帶，例如 5,95")
+    plot.add_argument('--title', default="", help="圖表標題")
+    plot.add_argument('--preview', action='store_true', help="以低解析度輸出 (較快)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'build':
+        count, skipped = build_store(args.paths, args.output, args.x_unit, args.y_unit, args.dose_unit)
+        for file_path, sheet_name, reason in skipped:
+            print(f"略過 {os.path.basename(file_path)} / {sheet_name}: {reason}", file=sys.stderr)
+        print(f"完成：{count} 位受試者已寫入 {args.output}", file=sys.stderr)
+        return 0
+    if args.command == 'nca':
+        try:
+            count = nca_to_file(args.store, args.output, args.average, args.auc_method, args.lambda_z_points)
+        except ImportError as e:
+            raise SystemExit(str(e))
+        print(f"完成：{count} 位受試者的非房室分析已寫入 {args.output}", file=sys.stderr)
+        return 0
+
+    inflection_point = args.inflection_point
+    if inflection_point != models.AUTO_INFLECTION:
+        inflection_point = float(inflection_point)
+    if args.command == 'plot':
+        count, fitted = plot_store(args.store, args.output, MODEL_TYPES[args.model], args.average, inflection_point,
+                                   args.inflection_criterion, args.band, args.title,
+                                   "preview" if args.preview else "export")
+        print(f"完成：{fitted}/{count} 位受試者擬合成功，圖表已寫入 {args.output}", file=sys.stderr)
+        return 0
+    failed, skipped = analyse_store(args.store, args.output, args.workers, inflection_point,
+                                    args.inflection_criterion, resume=not args.no_resume)
+    print(f"完成：{failed} 位受試者失敗，略過 {skipped} 位已完成的受試者，結果已寫入 {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
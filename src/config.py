@@ -14,8 +14,77 @@ def get_base_path():
 # 設定 TEMP_FOLDER_PATH 指向與可執行檔相同的目錄
 TEMP_FOLDER_PATH = os.path.join(get_base_path(), "PharmacokineticAnalysis_temp")
 
-# 檢查並創建資料夾
-if not os.path.exists(TEMP_FOLDER_PATH):
-    os.makedirs(TEMP_FOLDER_PATH)
 
-print(f"TEMP_FOLDER_PATH: {TEMP_FOLDER_PATH}")
+def ensure_temp_folder():
+    """檢查並創建暫存資料夾，回傳其路徑 (第一次寫入檔案時才建立，匯入 config 不會產生任何副作用)"""
+    os.makedirs(TEMP_FOLDER_PATH, exist_ok=True)
+    return TEMP_FOLDER_PATH
+
+
+# 繪圖結果的內容定址儲存區 (artifact_store)：相同圖檔只存一份，總容量超過上限時依 LRU 順序淘汰
+# 上限可由環境變數 PK_ARTIFACT_MAX_MB 設定 (單位 MB)
+ARTIFACT_DIR = os.path.join(TEMP_FOLDER_PATH, ".artifacts")
+ARTIFACT_STORE_MAX_BYTES = int(float(os.environ.get("PK_ARTIFACT_MAX_MB", "512")) * 1024 * 1024)
+
+# 儲存時可選的圖檔格式 (圖表繪製於 image_processor，此處只列出格式以免匯入 matplotlib)
+IMAGE_FORMATS = ("png", "svg", "webp")
+
+# 工作表解析快取的記憶體上限 (位元組)，超過時依 LRU 順序淘汰最久未使用的項目
+SHEET_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 模型擬合結果快取的項目上限，超過時依 LRU 順序淘汰 (只改單位或標題時不需重新擬合)
+FIT_CACHE_MAX_ENTRIES = 256
+
+# 分析流程的計時與記憶體量測 (環境變數 PK_PROFILE=1 開啟)，結果以 JSON Lines 附加到 PROFILE_LOG_PATH
+PROFILING_ENABLED = os.environ.get("PK_PROFILE", "") == "1"
+PROFILE_LOG_PATH = os.path.join(TEMP_FOLDER_PATH, "profile_log.jsonl")
+# 設定 PK_PROFILE_DUMP=<資料夾> 時，每次分析另輸出 cProfile 的 .prof 檔
+PROFILE_DUMP_DIR = os.environ.get("PK_PROFILE_DUMP") or None
+
+# 多使用者伺服器模式 (環境變數 PK_SERVING_MODE=1)：每個連線的匯出各自獨立，離線時移除分析紀錄
+SERVING_MODE = os.environ.get("PK_SERVING_MODE", "") == "1"
+
+# 分析工作執行緒池大小 (所有連線共用)；伺服器模式依 CPU 核心數擴展
+ANALYSIS_WORKERS = max(4, os.cpu_count() or 1) if SERVING_MODE else min(4, os.cpu_count() or 1)
+
+# Gradio 佇列設定：可同時執行的分析 / 儲存事件數與佇列上限
+ANALYZE_CONCURRENCY_LIMIT = max(1, os.cpu_count() or 1) if SERVING_MODE else 1
+SAVE_CONCURRENCY_LIMIT = 2
+QUEUE_MAX_SIZE = 8 * ANALYZE_CONCURRENCY_LIMIT if SERVING_MODE else None
+
+
+def _safe_component(name):
+    """將 session id 等外部字串轉為安全的資料夾名稱"""
+    return "".join(char for char in str(name) if char.isalnum() or char in "-_") or "anonymous"
+
+
+def safe_title(title_name):
+    """將使用者輸入的標題轉為安全的資料夾 / 檔名：只保留文字、數字、空白與 - _ . ( )，並去除首尾的空白與句點
+
+    路徑分隔符號與開頭的句點 (例如 ../ 或 .artifacts) 都會被移除，清理後可能為空字串，由呼叫端拒絕。
+    """
+    return "".join(char for char in str(title_name) if char.isalnum() or char in " -_.()").strip(" .")
+
+
+def export_dir(title_name, session_id=None):
+    """儲存 (圖片與 .xlsx) 的目標資料夾；伺服器模式下依連線分開，且不會在離線時清除
+
+    title_name 一律經過 safe_title 清理，不會跳出該連線的資料夾；清理後為空時拋出 ValueError。
+    """
+    safe_name = safe_title(title_name)
+    if not safe_name:
+        raise ValueError(f"標題無法作為資料夾名稱: {title_name!r}")
+    if SERVING_MODE and session_id:
+        return os.path.join(TEMP_FOLDER_PATH, "exports", _safe_component(session_id), safe_name)
+    return os.path.join(TEMP_FOLDER_PATH, safe_name)
+
+
+def cohort_export_path(session_id=None, cohort_format="csv"):
+    """彙整檔路徑 (所有標題共用)；伺服器模式下依連線分開"""
+    if SERVING_MODE and session_id:
+        base = os.path.join(TEMP_FOLDER_PATH, "exports", _safe_component(session_id))
+    else:
+        base = TEMP_FOLDER_PATH
+    os.makedirs(base, exist_ok=True)
+    return os.path.join(base, f"cohort_results.{cohort_format}")
+
@@ -0,0 +1,241 @@
+"""結果匯出：逐列附加的欄式檔案 (CSV / Parquet) 與 Excel 報表
+
+CSV 每列寫入後立即 flush；Parquet 以 part 檔案形式累積寫出，記憶體中最多保留 batch_size 列。
+"""
+import csv
+import glob
+import importlib.util
+import os
+
+import models
+import result_store
+
+# 每個面板一列的彙整欄位：來源資訊 (檔案、工作表、模型、是否取平均值、轉折點) + 兩種模型結果的所有參數
+PROVENANCE_COLUMNS = ['run_id', 'file', 'sheet', 'model', 'average', 'inflection_point', 'inflection_criterion',
+                      'error']
+
+
+def panel_columns():
+    """彙整檔的固定欄位順序"""
+    keys = list(models.ONE_COMPARTMENT_KEYS)
+    keys += [key for key in models.TWO_COMPARTMENT_KEYS if key not in keys]
+    return PROVENANCE_COLUMNS + keys
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def panel_rows(run):
+    """將一次分析紀錄的四個面板轉為彙整檔的列"""
+    options = run.options or {}
+    for panel in run.panels:
+        row = {'run_id': run.run_id, 'file': run.file_path, 'sheet': run.sheet_name, 'model': panel.model_type,
+               'average': panel.average, 'inflection_point': None, 'inflection_criterion': '',
+               'error': panel.results.get('Error', '')}
+        if panel.model_type == "二室模型":
+            # 自動轉折點時記錄實際選用的時間點 (自動搜尋失敗時為空值)
+            row['inflection_point'] = _as_float(panel.results.get('inflection_point', options.get('inflection_point')))
+            row['inflection_criterion'] = options.get('inflection_criterion', '')
+        for key, value in panel.results.items():
+            if key not in ('Error', 'inflection_point'):
+                row[key] = value
+        yield row
+
+
+def parquet_available():
+    """是否已安裝寫入 Parquet 所需的 pyarrow"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class CsvResultWriter:
+    """逐列寫入 CSV，每列寫入後立即 flush，中斷時最多遺失正在寫的一列"""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self._truncate_partial_line()
+            exists = os.path.getsize(path) > 0  # 只有寫到一半的標題列時重新寫入標題列
+        self._resumed = exists
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=columns, extrasaction='ignore')
+        if not exists:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _truncate_partial_line(self, block_size=4096):
+        """移除上次中斷時寫到一半的最後一列 (由檔尾往前逐塊尋找換行，不讀入整個檔案)"""
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    if start + newline + 1 < end:
+                        f.truncate(start + newline + 1)
+                    return
+                position = start
+            f.truncate(0)
+
+    def existing_columns(self):
+        """開啟前已存在的輸出檔的欄位 (標題列)；新檔案回傳 None"""
+        if not self._resumed:
+            return None
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return next(csv.reader(f), [])
+
+    def read_rows(self, columns):
+        """讀回已寫入的列 (只取指定欄位)"""
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return [tuple(row.get(column) for column in columns) for row in csv.DictReader(f)]
+
+    def drop_rows(self, keep):
+        """重寫輸出檔，只保留 keep(row) 為真的列 (row 為 {欄位: 字串})，回傳移除的列數"""
+        self._file.close()
+        removed = 0
+        temp_path = self.path + '.tmp'
+        with open(self.path, newline='', encoding='utf-8') as src, \
+                open(temp_path, 'w', newline='', encoding='utf-8') as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            header = next(reader, None)
+            if header is not None:
+                writer.writerow(header)
+            for values in reader:
+                if keep(dict(zip(header, values))):
+                    writer.writerow(values)
+                else:
+                    removed += 1
+        if removed:
+            os.replace(temp_path, self.path)
+        else:
+            os.remove(temp_path)
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+        return removed
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """以 part 檔案形式寫入 Parquet 資料夾，每累積 batch_size 列寫出一個檔案"""
+
+    def __init__(self, path, columns, batch_size=200):
+        import pandas as pd  # noqa: F401  (確認 pandas 可用)
+        if not parquet_available():
+            raise ImportError("輸出 Parquet 需要安裝 pyarrow：pip install pyarrow")
+        self.path = path
+        self.columns = columns
+        self.batch_size = batch_size
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        self._part = len(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+    def existing_columns(self):
+        """開啟前已寫出的 part 檔案的欄位；尚無 part 檔案時回傳 None"""
+        import pyarrow.parquet as pq
+        if self._part == 0:
+            return None
+        return pq.read_schema(os.path.join(self.path, 'part-00000.parquet')).names
+
+    def read_rows(self, columns):
+        """讀回已寫出的列 (只取指定欄位)"""
+        import pandas as pd
+        if self._part == 0:
+            return []
+        return list(pd.read_parquet(self.path, columns=list(columns)).itertuples(index=False, name=None))
+
+    def drop_rows(self, keep):
+        """重寫已寫出的 part 檔案，只保留 keep(row) 為真的列，回傳移除的列數"""
+        import pandas as pd
+        self.flush()
+        removed = 0
+        for part in sorted(glob.glob(os.path.join(self.path, 'part-*.parquet'))):
+            frame = pd.read_parquet(part)
+            mask = [bool(keep(row)) for row in frame.to_dict('records')]
+            if all(mask):
+                continue
+            removed += len(mask) - sum(mask)
+            # 移除後沒有任何列的 part 檔案仍保留 (只有欄位)，part 編號才不會重複
+            frame[mask].to_parquet(part + '.tmp', index=False)
+            os.replace(part + '.tmp', part)
+        return removed
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        import pandas as pd
+        if not self._rows:
+            return
+        frame = pd.DataFrame(self._rows, columns=self.columns)
+        # 整欄皆為空值時 (例如這批資料的模型都失敗) 以浮點數欄位寫出，各 part 檔案的欄位型別才會一致
+        for column in frame.columns[frame.isna().all()]:
+            frame[column] = frame[column].astype(float)
+        # 先寫入暫存檔再改名，避免中斷時留下損毀的 part 檔案
+        target = os.path.join(self.path, f'part-{self._part:05d}.parquet')
+        frame.to_parquet(target + '.tmp', index=False)
+        os.replace(target + '.tmp', target)
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def open_writer(path, columns):
+    """依副檔名選擇寫入器：.parquet 為 Parquet 資料夾，其餘為 CSV"""
+    if path.endswith('.parquet'):
+        return ParquetResultWriter(path, columns)
+    return CsvResultWriter(path, columns)
+
+
+def append_run(path, run):
+    """將一次分析紀錄的四個面板附加到彙整檔，回傳寫入的列數"""
+    writer = open_writer(path, panel_columns())
+    count = 0
+    try:
+        for row in panel_rows(run):
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def parameter_table(run, model_type):
+    """由分析紀錄建立 [參數][原始資料][平均值] 表格"""
+    import pandas as pd
+
+    original = run.panel(model_type, average=False)
+    average = run.panel(model_type, average=True)
+    return pd.DataFrame({
+        'Parameter': [name for name, _ in result_store.model_parameters(model_type)],
+        'Original Value': original.values(),
+        'Average Value': average.values(),
+    })
+
+
+def write_excel(run, excel_path):
+    """Excel 報表：一室和二室模型寫入不同的工作表"""
+    import pandas as pd
+
+    with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
+        parameter_table(run, "一室模型").to_excel(writer, sheet_name='One Compartment Model', index=False)
+        parameter_table(run, "二室模型").to_excel(writer, sheet_name='Two Compartment Model', index=False)
+    return excel_path
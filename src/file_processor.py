@@ -1,10 +1,19 @@
+import hashlib
 import os
-import pandas as pd
 import numpy as np
+import artifact_store
+import bootstrap
+import exporter
+import ingestion
+import instrumentation
 import models
+import result_store
 import sys
-import shutil
-from config import TEMP_FOLDER_PATH
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (SHEET_CACHE_MAX_BYTES, FIT_CACHE_MAX_ENTRIES, ANALYSIS_WORKERS, export_dir, cohort_export_path,
+                    safe_title)
 
 
 def resource_path(relative_path):
@@ -22,60 +31,297 @@ def resource_path(relative_path):
 PLACEHOLDER_IMAGE = resource_path("image/placeholder_image.png")
 
 
+# 工作表解析快取：key 為 (檔案路徑, 修改時間, 檔案大小, 工作表名稱)，依 LRU 順序淘汰
+_sheet_cache = OrderedDict()
+_sheet_cache_lock = threading.Lock()
+_sheet_cache_loading = {}  # 正在解析中的 key -> threading.Event
+_sheet_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _file_signature(file_path):
+    """以絕對路徑、修改時間與檔案大小識別檔案版本，檔案被覆寫後快取自動失效"""
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+
+
+def _entry_nbytes(entry):
+    """估算快取項目佔用的記憶體大小"""
+    if isinstance(entry, list):
+        return sum(len(str(name)) for name in entry) + 64
+    total = 0
+    for key in ("raw", "avg"):
+        if entry[key] is not None:
+            total += sum(array.nbytes for array in entry[key].values())
+    if entry["unique_times"] is not None:
+        total += entry["unique_times"].nbytes
+    return total
+
+
+def _cache_lookup(key, loader):
+    """自快取取得項目，未命中時呼叫 loader 解析並依記憶體上限淘汰舊項目
+
+    多個執行緒同時查詢同一個未快取的工作表時，只有第一個執行緒解析，其餘等待其結果。
+    """
+    while True:
+        with _sheet_cache_lock:
+            if key in _sheet_cache:
+                _sheet_cache.move_to_end(key)
+                _sheet_cache_stats["hits"] += 1
+                return _sheet_cache[key][0]
+            loading = _sheet_cache_loading.get(key)
+            if loading is None:
+                _sheet_cache_stats["misses"] += 1
+                loading = _sheet_cache_loading[key] = threading.Event()
+                break
+        # 等待其他執行緒解析完成後重新查詢 (解析失敗時改由本執行緒重試)
+        loading.wait()
+
+    try:
+        # 解析在鎖外進行，避免大型檔案阻塞其他工作表的讀取
+        entry = loader()
+        nbytes = _entry_nbytes(entry)
+        with _sheet_cache_lock:
+            _sheet_cache[key] = (entry, nbytes)
+            _sheet_cache_stats["bytes"] += nbytes
+            # 超過上限時淘汰最久未使用的項目，但至少保留剛放入的項目
+            while _sheet_cache_stats["bytes"] > SHEET_CACHE_MAX_BYTES and len(_sheet_cache) > 1:
+                _, (_, evicted_bytes) = _sheet_cache.popitem(last=False)
+                _sheet_cache_stats["bytes"] -= evicted_bytes
+                _sheet_cache_stats["evictions"] += 1
+    finally:
+        with _sheet_cache_lock:
+            del _sheet_cache_loading[key]
+        loading.set()
+    return entry
+
+
+def _frame_to_arrays(data):
+    """將清理後的 DataFrame 轉為 time / cp / dose 的 NumPy 陣列 (唯讀，避免共用的快取被修改)"""
+    arrays = {
+        "time": data['time'].to_numpy(copy=True),
+        "cp": data['cp'].to_numpy(copy=True),
+        "dose": data['dose'].to_numpy(dtype=float, copy=True),
+    }
+    for array in arrays.values():
+        array.setflags(write=False)
+    return arrays
+
+
+def parse_sheet(file_path, sheet_name):
+    """解析一次工作表 (不經快取)，同時產生原始與平均值兩種已清理、排序的資料"""
+    # 只讀取 time / cp / dose 欄位 (欄位名稱已轉為小寫、數值為浮點數)
+    with instrumentation.span("read_sheet"):
+        data = ingestion.read_sheet(file_path, sheet_name)
+
+    entry = {"has_columns": 'time' in data.columns and 'cp' in data.columns,
+             "unique_times": None, "raw": None, "avg": None}
+    if 'time' in data.columns:
+        # 轉折點下拉選單使用的時間點 (包含 cp 為空值的列)
+        entry["unique_times"] = ingestion.unique_times(data)
+    if not entry["has_columns"]:
+        return entry
+
+    if 'dose' not in data.columns:
+        data['dose'] = np.nan  # 缺少劑量欄位時視為無有效劑量
+
+    # 刪除 'cp' 欄位中為 N/A 的行，並按照 'time' 欄位進行排序
+    with instrumentation.span("dropna_sort"):
+        data = data.dropna(subset=['cp'])
+        data = data.sort_values(by='time').reset_index(drop=True)
+        entry["raw"] = _frame_to_arrays(data)
+
+    # 相同 time 的 cp 值取平均
+    with instrumentation.span("groupby_mean"):
+        data = data.groupby('time', as_index=False).agg({'cp': 'mean', 'dose': 'first'})
+        entry["avg"] = _frame_to_arrays(data)
+    return entry
+
+
+def load_sheet(file_path, sheet_name):
+    """取得工作表的解析結果，相同檔案版本與工作表只會解析一次"""
+    key = _file_signature(file_path) + (sheet_name,)
+    return _cache_lookup(key, lambda: parse_sheet(file_path, sheet_name))
+
+
+def get_sheet_cache_stats():
+    """回傳工作表快取的命中、未命中、淘汰次數與目前佔用的記憶體"""
+    with _sheet_cache_lock:
+        stats = dict(_sheet_cache_stats)
+        stats["entries"] = len(_sheet_cache)
+    return stats
+
+
+def clear_sheet_cache():
+    """清空工作表快取 (統計數據一併歸零)"""
+    with _sheet_cache_lock:
+        _sheet_cache.clear()
+        for key in _sheet_cache_stats:
+            _sheet_cache_stats[key] = 0
+
+
 def get_sheet_names(file_path):
-    """讀取 Excel 檔案中的工作表名稱"""
-    excel_data = pd.ExcelFile(file_path)
-    return_sheet_name = excel_data.sheet_names
-    return return_sheet_name  # 回傳工作表名稱列表
+    """讀取 Excel 檔案中的工作表名稱 (由活頁簿 metadata 取得；CSV / Parquet 只有一個工作表)"""
+    key = _file_signature(file_path) + (None,)
+    return list(_cache_lookup(key, lambda: ingestion.sheet_names(file_path)))  # 回傳工作表名稱列表
 
 
 def get_time_columns(file_path, sheet_name):
     """讀取 Excel 檔案中的工作表內的time欄位"""
-    # 加載工作表
-    data = pd.read_excel(file_path, sheet_name=sheet_name)
-    # 將所有欄位名稱轉為小寫，確保可以正確提取 'time' 欄位
-    data.columns = data.columns.str.lower()
-    # 獲取 'time' 欄位中的所有值，去除重複項並排序
-    unique_times = sorted(data['time'].drop_duplicates())
-    return unique_times
+    unique_times = load_sheet(file_path, sheet_name)["unique_times"]
+    if unique_times is None:
+        raise KeyError('time')
+    # 'time' 欄位中的所有值，已去除重複項並排序
+    return unique_times.tolist()
+
+
+# 模型擬合結果快取：key 為資料內容與擬合參數的雜湊，value 為 (擬合結果, 附加提示訊息)，依 LRU 順序淘汰
+_fit_cache = OrderedDict()
+_fit_cache_lock = threading.Lock()
+_fit_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def fit_cache_key(time, c_p, dose, model_type, average, inflection_point=None, inflection_criterion=None):
+    """以資料內容 (而非檔案路徑) 與擬合參數計算快取 key；單位與標題只影響圖表標示，不納入 key"""
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (time, c_p):
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    # 一室模型的結果與轉折點設定無關；評分標準只在自動搜尋轉折點時使用
+    if model_type != "二室模型":
+        inflection_point = inflection_criterion = None
+    elif inflection_point != models.AUTO_INFLECTION:
+        inflection_criterion = None
+    digest.update(repr((float(dose), model_type, bool(average), inflection_point, inflection_criterion)).encode())
+    return digest.hexdigest()
+
+
+def _fit_models(time, c_p, dose, model_type, average, inflection_point, inflection_criterion):
+    """擬合模型 (不繪圖)，回傳 (擬合結果或 None, 附加提示訊息)"""
+    note = ""
+    if model_type == "一室模型":
+        fit = models.fit_one_compartment(time, c_p, dose, average)
+    elif model_type == "二室模型":
+        fit = models.fit_two_compartment(time, c_p, dose, inflection_point, average, criterion=inflection_criterion)
+        if fit is not None and inflection_point == models.AUTO_INFLECTION:
+            note = format_inflection_ranking(time, c_p, inflection_criterion, fit.results['inflection_point'])
+    else:
+        fit = ""
+    return fit, note
+
+
+def cached_fit(time, c_p, dose, model_type, average, inflection_point, inflection_criterion):
+    """取得模型擬合結果，相同資料與擬合參數只計算一次 (擬合失敗的 None 也會快取)"""
+    key = fit_cache_key(time, c_p, dose, model_type, average, inflection_point, inflection_criterion)
+    with _fit_cache_lock:
+        if key in _fit_cache:
+            _fit_cache.move_to_end(key)
+            _fit_cache_stats["hits"] += 1
+            return _fit_cache[key]
+        _fit_cache_stats["misses"] += 1
+
+    # 擬合在鎖外進行；同時計算相同 key 時結果相同，後寫入者覆蓋即可
+    with instrumentation.span("fit_compute"):
+        value = _fit_models(time, c_p, dose, model_type, average, inflection_point, inflection_criterion)
+    with _fit_cache_lock:
+        _fit_cache[key] = value
+        _fit_cache.move_to_end(key)
+        while len(_fit_cache) > FIT_CACHE_MAX_ENTRIES:
+            _fit_cache.popitem(last=False)
+            _fit_cache_stats["evictions"] += 1
+    return value
+
+
+def get_fit_cache_stats():
+    """回傳擬合結果快取的命中、未命中、淘汰次數與目前項目數"""
+    with _fit_cache_lock:
+        stats = dict(_fit_cache_stats)
+        stats["entries"] = len(_fit_cache)
+    return stats
+
+
+def clear_fit_cache():
+    """清空擬合結果快取 (統計數據一併歸零)"""
+    with _fit_cache_lock:
+        _fit_cache.clear()
+        for key in _fit_cache_stats:
+            _fit_cache_stats[key] = 0
+
+
+def format_inflection_ranking(time, c_p, criterion, chosen_point, top=3):
+    """將自動轉折點的選擇結果與前幾名候選點整理為提示訊息"""
+    _, ranking = models.find_inflection_point(time, c_p, criterion)
+    candidates = ", ".join(f"{row['inflection_point']}({row['score']})" for row in ranking[:top])
+    return f"自動轉折點 ({criterion}): {chosen_point}\n候選排名: {candidates}\n"
 
 
 def process_file(file_path, sheet_name, model_type, x_unit, y_unit, dose_unit, inflection_point, custom_title,
-                 average=False):
+                 average=False, inflection_criterion="adj_r2", render=True, output_dir=None, bootstrap=None,
+                 profile="export", image_format="png"):
+    """分析單一工作表；render=False 時只計算參數，不繪圖 (file_paths 為空列表，也不會載入 matplotlib)
+
+    output_dir 為圖檔的存放資料夾，預設存入內容定址的 artifact_store (檔名為內容雜湊，相同圖檔只存一份)。
+    profile 為繪圖的輸出設定 (介面顯示用 "preview"，存檔用 "export")，image_format 為 png / svg / webp。
+    bootstrap 為 bootstrap.bootstrap_model 的參數字典 (n_boot、method、seed、ci、n_jobs) 時，
+    另將各參數的信賴區間以 <參數>_ci_low / <參數>_ci_high 併入結果字典。
+    啟用量測 (instrumentation) 時，各階段的耗時與峰值記憶體會附加到提示訊息並寫入紀錄檔。
+    """
+    label = f"{model_type} ({'平均值' if average else '原始數據'})"
+    with instrumentation.trace(label, file=file_path, sheet=sheet_name, model=model_type, average=average,
+                               inflection_point=inflection_point) as trace:
+        result, file_paths, prompt_msg = _process_file(file_path, sheet_name, model_type, x_unit, y_unit, dose_unit,
+                                                       inflection_point, custom_title, average, inflection_criterion,
+                                                       render, output_dir, bootstrap, profile, image_format)
+    if trace is not None:
+        prompt_msg += trace.summary()
+    return result, file_paths, prompt_msg
+
+
+def _add_bootstrap_intervals(result, time, c_p, dose, model_type, inflection_point, options):
+    """計算 bootstrap 信賴區間並併入結果字典，回傳提示訊息 (失敗時不影響點估計)"""
+    try:
+        with instrumentation.span("bootstrap"):
+            summary = bootstrap.bootstrap_model(model_type, time, c_p, dose, inflection_point, **options)
+    except Exception as e:
+        return f"Bootstrap 信賴區間計算失敗: {e}\n"
+    result.update(bootstrap.interval_fields(summary))
+    return bootstrap.format_summary(summary)
+
+
+def _process_file(file_path, sheet_name, model_type, x_unit, y_unit, dose_unit, inflection_point, custom_title,
+                  average, inflection_criterion, render, output_dir, bootstrap_options=None, profile="export",
+                  image_format="png"):
     prompt_msg = ""  # 初始化提示訊息
     result = ""
     file_paths = ""
+    fit = ""
 
     try:
-        # 讀取 Excel 資料，並將欄位名稱轉為小寫
-        data = pd.read_excel(file_path, sheet_name=sheet_name)
-        data.columns = data.columns.str.lower()  # 將所有欄位名稱轉為小寫
+        # 讀取 Excel 資料 (經由快取，同一工作表只解析一次)
+        with instrumentation.span("load_sheet"):
+            sheet = load_sheet(file_path, sheet_name)
         prompt_msg += f"讀取{model_type}資料成功\n"  # 記錄資料讀取成功
 
         # 確認是否存在 'time' 和 'cp' 欄位
-        if 'time' not in data.columns or 'cp' not in data.columns:
+        if not sheet["has_columns"]:
             return {"Error": "'time' 或 'cp' 欄位不存在，請檢查檔案格式。"}, [
                 PLACEHOLDER_IMAGE], prompt_msg + '輸入資料格式錯誤\n請確認資料表為[Time][Cp][Dose]\n'
 
         prompt_msg += "確認欄位成功\n"  # 記錄確認欄位成功
 
-        # 刪除 'cp' 欄位中為 N/A 的行
-        data = data.dropna(subset=['cp'])
+        # 快取中的資料已刪除 'cp' 為 N/A 的行，並按照 'time' 排序
         prompt_msg += "清理 'cp' 欄位中的 N/A 值成功\n"  # 記錄清理成功
-
-        # 按照 'time' 欄位進行排序，保持 time 和 cp 對應
-        data = data.sort_values(by='time').reset_index(drop=True)
         prompt_msg += "按照時間順序排序成功\n"  # 記錄排序成功
 
-        # 如果需要平均值的分析，将相同 time 的 cp 值取平均
+        # 如果需要平均值的分析，使用相同 time 的 cp 已取平均的資料
+        data = sheet["avg"] if average else sheet["raw"]
         if average:
-            data = data.groupby('time', as_index=False).agg({'cp': 'mean', 'dose': 'first'})
             prompt_msg += "相同時間點的 'cp' 已取平均值\n"  # 記錄取平均值成功
 
-        # 將資料轉換為 NumPy 陣列
-        time = data['time'].to_numpy()  # 確保 "時間" 是 1D 陣列
-        c_p = data['cp'].to_numpy()  # 確保 "藥物濃度 Cp" 是 1D 陣列
-        dose = data['dose'].to_numpy()  # 讀取整個劑量數據
+        # 取得 NumPy 陣列
+        time = data['time']  # 確保 "時間" 是 1D 陣列
+        c_p = data['cp']  # 確保 "藥物濃度 Cp" 是 1D 陣列
+        dose = data['dose']  # 讀取整個劑量數據
 
         # 刪除 Dose 為零或空值的行
         valid_indices = ~np.isnan(dose) & (dose != 0)
@@ -92,244 +338,261 @@ def process_file(file_path, sheet_name, model_type, x_unit, y_unit, dose_unit, i
 
         prompt_msg += "數據清理成功\n"  # 記錄數據清理成功
 
-        # 根據選擇的模型類型調用不同的模型函數
-        if model_type == "一室模型":
-            result, file_paths = models.one_compartment_model(time, c_p, dose, x_unit, y_unit, dose_unit, custom_title,
-                                                              average)
-            prompt_msg += "一室模型運算成功\n"
-        elif model_type == "二室模型":
-            result, file_paths = models.two_compartment_model(time, c_p, dose, x_unit, y_unit, dose_unit,
-                                                              inflection_point, custom_title, average)
-            prompt_msg += "二室模型運算成功\n"
+        # 根據選擇的模型類型調用不同的模型擬合函數 (經由快取，只改單位或標題時沿用先前的擬合結果，只重新繪圖)
+        with instrumentation.span("fit"):
+            fit, fit_note = cached_fit(time, c_p, dose, model_type, average, inflection_point, inflection_criterion)
 
         # 如果模型返回 None，處理為錯誤
-        if result is None or file_paths is None:
+        if fit is None:
             return {"Error": "模型未返回有效結果。"}, [PLACEHOLDER_IMAGE], prompt_msg + '模型未回傳有效結果\n'
 
+        if fit:
+            result = dict(fit.results)  # 複製一份，避免呼叫端修改到快取中的結果
+            # 只有需要顯示或匯出圖表時才繪圖
+            if render:
+                with instrumentation.span("render"):
+                    file_paths = [fit.render(x_unit, y_unit, dose_unit, custom_title, output_dir, profile,
+                                             image_format)]
+            else:
+                file_paths = []
+            prompt_msg += f"{model_type}運算成功\n" + fit_note
+            if bootstrap_options:
+                prompt_msg += _add_bootstrap_intervals(result, time, c_p, dose, model_type,
+                                                       result.get('inflection_point', inflection_point),
+                                                       bootstrap_options)
+
         return result, file_paths, prompt_msg + '模型分析成功\n'  # 返回結果和對應的圖表文件路徑，記錄最終成功訊息
 
     except Exception as e:
         return {"Error": f"模型計算出現錯誤: {e}"}, [PLACEHOLDER_IMAGE], prompt_msg + f"模型計算出現錯誤: {e}\n"
 
 
-def run_interface(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point, custom_title):
-    # 呼叫處理函數並將結果格式化為輸出 (原始數據)
-    results_one, image_paths_one, message_one = process_file(file_path, sheet_name, "一室模型", x_unit, y_unit,
-                                                             dose_unit, inflection_point, custom_title, average=False)
-    prompt_message = message_one
-    results_two, image_paths_two, message_two = process_file(file_path, sheet_name, "二室模型", x_unit, y_unit,
-                                                             dose_unit, inflection_point, custom_title, average=False)
-    prompt_message += message_two
-
-    # 呼叫處理函數並將結果格式化為輸出 (平均值)
-    results_one_avg, image_paths_one_avg, message_one_avg = process_file(file_path, sheet_name, "一室模型", x_unit,
-                                                                         y_unit, dose_unit, inflection_point,
-                                                                         custom_title, average=True)
-    prompt_message += message_one_avg
-    results_two_avg, image_paths_two_avg, message_two_avg = process_file(file_path, sheet_name, "二室模型", x_unit,
-                                                                         y_unit, dose_unit, inflection_point,
-                                                                         custom_title, average=True)
-    prompt_message += message_two_avg
-
-    # 一室模型參數名稱模板
-    one_model_names_template = f"""
-        Slope:
-        k_e:
-        Half-life:
-        Intercept:
-        Initial Concentration:
-        Clearance:
-        Volume of Distribution (V_d):
-        AUC(0-t):
-        AUC(0-finity):
-        """
-
-    # 分別賦值給原始數據和平均數據
-    one_model_names = one_model_names_template
-    one_model_names_avg = one_model_names_template
-
-    # 一室模型數值
-    one_model_values = f"""
-    {results_one.get('slope', 'N/A')}
-    {results_one.get('k_e', 'N/A')}
-    {results_one.get('half_life', 'N/A')}
-    {results_one.get('intercept', 'N/A')}
-    {results_one.get('initial_concentration', 'N/A')}
-    {results_one.get('clearance', 'N/A')}
-    {results_one.get('VD', 'N/A')}
-    {results_one.get('AUC(0-t)', 'N/A')}
-    {results_one.get('AUC(0-finity)', 'N/A')}
-    """
+# 畫面上的四個結果面板 (依輸出順序)：名稱、模型類型、是否取平均值
+PANELS = (
+    ("一室模型 (平均值)", "一室模型", True),
+    ("一室模型 (原始數據)", "一室模型", False),
+    ("二室模型 (平均值)", "二室模型", True),
+    ("二室模型 (原始數據)", "二室模型", False),
+)
 
-    # 一室模型平均值數據
-    one_model_values_avg = f"""
-    {results_one_avg.get('slope', 'N/A')}
-    {results_one_avg.get('k_e', 'N/A')}
-    {results_one_avg.get('half_life', 'N/A')}
-    {results_one_avg.get('intercept', 'N/A')}
-    {results_one_avg.get('initial_concentration', 'N/A')}
-    {results_one_avg.get('clearance', 'N/A')}
-    {results_one_avg.get('VD', 'N/A')}
-    {results_one_avg.get('AUC(0-t)', 'N/A')}
-    {results_one_avg.get('AUC(0-finity)', 'N/A')}
-    """
+# 四個分析共用的工作執行緒池
+_analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
 
-    # 二室模型參數名稱模板
-    two_model_names_template = f"""
-        a:
-        Alpha:
-        b:
-        Beta:
-        k_21:
-        k_10:
-        k_12:
-        Half-life Alpha:
-        Half-life Beta:
-        Half-life k_21:
-        Half-life k_10:
-        Half-life k_12:
-        VDss:
-        Clearance:
-        AUC(0-t):
-        AUC(0-finity):
-        """
-
-    # 分別賦值給原始數據和平均數據
-    two_model_names = two_model_names_template
-    two_model_names_avg = two_model_names_template
-
-    # 二室模型數值
-    two_model_values = f"""
-    {results_two.get('a', 'N/A')}
-    {results_two.get('alpha', 'N/A')}
-    {results_two.get('b', 'N/A')}
-    {results_two.get('beta', 'N/A')}
-    {results_two.get('k_21', 'N/A')}
-    {results_two.get('k_10', 'N/A')}
-    {results_two.get('k_12', 'N/A')}
-    {results_two.get('half_life_alpha', 'N/A')}
-    {results_two.get('half_life_beta', 'N/A')}
-    {results_two.get('half_life_k21', 'N/A')}
-    {results_two.get('half_life_k10', 'N/A')}
-    {results_two.get('half_life_k12', 'N/A')}
-    {results_two.get('VDss', 'N/A')}
-    {results_two.get('clearance', 'N/A')}
-    {results_two.get('AUC(0-t)', 'N/A')}
-    {results_two.get('AUC(0-finity)', 'N/A')}
-    """
 
-    # 二室模型平均值數據
-    two_model_values_avg = f"""
-    {results_two_avg.get('a', 'N/A')}
-    {results_two_avg.get('alpha', 'N/A')}
-    {results_two_avg.get('b', 'N/A')}
-    {results_two_avg.get('beta', 'N/A')}
-    {results_two_avg.get('k_21', 'N/A')}
-    {results_two_avg.get('k_10', 'N/A')}
-    {results_two_avg.get('k_12', 'N/A')}
-    {results_two_avg.get('half_life_alpha', 'N/A')}
-    {results_two_avg.get('half_life_beta', 'N/A')}
-    {results_two_avg.get('half_life_k21', 'N/A')}
-    {results_two_avg.get('half_life_k10', 'N/A')}
-    {results_two_avg.get('half_life_k12', 'N/A')}
-    {results_two_avg.get('VDss', 'N/A')}
-    {results_two_avg.get('clearance', 'N/A')}
-    {results_two_avg.get('AUC(0-t)', 'N/A')}
-    {results_two_avg.get('AUC(0-finity)', 'N/A')}
-    """
+def panel_outputs(panel):
+    """將單一面板的結果紀錄轉為 (參數名稱, 數值, 圖檔) 三個文字框 / 圖片輸出"""
+    return panel.names_text(), panel.values_text(), panel.image_path
+
 
-    # 根據模型結果的錯誤狀況來決定提示訊息
+def summary_message(results_one, results_two):
+    """根據模型結果的錯誤狀況來決定提示訊息"""
     if "Error" in results_one and "Error" in results_two:
-        prompt_message += "一室模型和二室模型均出現錯誤。"
+        return "一室模型和二室模型均出現錯誤。"
     elif "Error" in results_one:
-        prompt_message += "一室模型出現錯誤，但二室模型成功。"
+        return "一室模型出現錯誤，但二室模型成功。"
     elif "Error" in results_two:
-        prompt_message += "二室模型出現錯誤，但一室模型成功。"
-    else:
-        prompt_message += "一室模型和二室模型均成功完成。"
+        return "二室模型出現錯誤，但一室模型成功。"
+    return "一室模型和二室模型均成功完成。"
+
 
-    return (one_model_names_avg, one_model_values_avg, image_paths_one_avg[0],
-            one_model_names, one_model_values, image_paths_one[0],
-            two_model_names_avg, two_model_values_avg, image_paths_two_avg[0],
-            two_model_names, two_model_values, image_paths_two[0],
-            prompt_message)
+# 各面板依賴的輸入：只有依賴的輸入改變時才需要重新計算與繪圖 (例如只改轉折點時，一室模型面板沿用上次的結果)；
+# 評分標準只在自動搜尋轉折點時使用，指定轉折點時不列入依賴
+PANEL_DEPENDENCIES = {
+    "一室模型": ("file", "sheet_name", "x_unit", "y_unit", "dose_unit", "custom_title"),
+    "二室模型": ("file", "sheet_name", "x_unit", "y_unit", "dose_unit", "custom_title", "inflection_point",
+              "inflection_criterion"),
+}
 
 
-def save_file(title_name, one_names, two_names, one_values, two_values, one_values_avg, two_values_avg):
+def panel_dependencies(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point, custom_title,
+                       inflection_criterion):
+    """計算四個面板各自依賴的輸入值；檔案以版本識別 (被覆寫後視為不同輸入)，無法讀取時回傳 None"""
+    try:
+        file_signature = _file_signature(file_path)
+    except (OSError, TypeError):
+        return None
+    if inflection_point != models.AUTO_INFLECTION:
+        inflection_criterion = None
+    inputs = {"file": file_signature, "sheet_name": sheet_name, "x_unit": x_unit, "y_unit": y_unit,
+              "dose_unit": dose_unit, "custom_title": custom_title, "inflection_point": inflection_point,
+              "inflection_criterion": inflection_criterion}
+    return [tuple(inputs[name] for name in PANEL_DEPENDENCIES[model_type]) for _, model_type, _ in PANELS]
+
+
+def _reusable_panels(session_id, dependencies):
+    """找出依賴輸入與該連線上一次分析相同、且圖檔仍存在的面板，回傳 {面板索引: PanelResult}"""
+    previous = result_store.get_run(session_id)
+    if dependencies is None or previous is None or previous.dependencies is None:
+        return {}
+    reusable = {}
+    for index, (old, new) in enumerate(zip(previous.dependencies, dependencies)):
+        panel = previous.panels[index]
+        if old == new and all(os.path.exists(path) for path in panel.image_paths):
+            for path in panel.image_paths:
+                artifact_store.touch(path)
+            reusable[index] = panel
+    return reusable
+
+
+def forget_session(session_id):
+    """連線結束時移除該連線的分析紀錄 (其圖檔不再被引用，可依 LRU 淘汰)"""
+    result_store.forget_session(session_id)
+
+
+def run_interface_stream(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point, custom_title,
+                         inflection_criterion="adj_r2", session_id=None, run_id=None):
+    """四個分析同時在工作執行緒池中執行，每完成一個面板就產出一次目前的全部輸出 (供 Gradio 串流更新)
+
+    依賴輸入與上次分析相同的面板直接沿用上次的結果與圖檔，只重新計算、繪製受影響的面板。
+    全部完成後，結果以 run_id (未提供時自動產生) 記錄於該連線的分析紀錄 (result_store)，文字框只是紀錄的顯示。
+    畫面上的圖檔以 preview 設定 (低解析度) 繪製，儲存時再由 save_file 以 export 設定重新繪製。
+    """
+    run_id = run_id or result_store.new_run_id()
+    dependencies = panel_dependencies(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point,
+                                      custom_title, inflection_criterion)
+    reused = _reusable_panels(session_id, dependencies)
+
+    outputs = ["", "", None] * len(PANELS)
+    panels = [None] * len(PANELS)
+    for index, panel in reused.items():
+        panels[index] = panel
+        outputs[index * 3:index * 3 + 3] = panel_outputs(panel)
+
+    # 圖檔存入 artifact_store，以內容雜湊命名，同時進行的分析不會互相覆寫圖檔
+    pending = [index for index in range(len(PANELS)) if index not in reused]
+
+    futures = {}
+    for index in pending:
+        _, model_type, average = PANELS[index]
+        future = _analysis_executor.submit(process_file, file_path, sheet_name, model_type, x_unit, y_unit, dose_unit,
+                                           inflection_point, custom_title, average=average,
+                                           inflection_criterion=inflection_criterion, profile="preview")
+        futures[future] = index
+
+    reused_note = f" (沿用 {len(reused)} 個未變更的面板)" if reused else ""
+    if pending:
+        yield tuple(outputs) + (f"分析中... 0/{len(pending)}{reused_note}\n",)
+
+    for count, future in enumerate(as_completed(futures), start=1):
+        index = futures[future]
+        panel_name, model_type, average = PANELS[index]
+        results, image_paths, message = future.result()
+        panels[index] = result_store.PanelResult(panel_name, model_type, average, results, list(image_paths), message)
+        outputs[index * 3:index * 3 + 3] = panel_outputs(panels[index])
+        if count < len(pending):
+            yield tuple(outputs) + (f"分析中... {count}/{len(pending)} ({panel_name} 完成){reused_note}\n",)
+
+    options = {"x_unit": x_unit, "y_unit": y_unit, "dose_unit": dose_unit, "custom_title": custom_title,
+               "inflection_point": inflection_point, "inflection_criterion": inflection_criterion}
+    result_store.register_run(session_id, result_store.AnalysisRun(run_id, file_path, sheet_name, tuple(panels),
+                                                                   options, dependencies))
+
+    # 提示訊息依原始數據一室、二室，平均值一室、二室的順序排列
+    panel_one_avg, panel_one, panel_two_avg, panel_two = panels
+    prompt_message = panel_one.message + panel_two.message + panel_one_avg.message + panel_two_avg.message
+    prompt_message += summary_message(panel_one.results, panel_two.results)
+    yield tuple(outputs) + (prompt_message,)
+
+
+def run_interface(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point, custom_title,
+                  inflection_criterion="adj_r2", session_id=None, run_id=None):
+    """一次回傳全部結果 (run_interface_stream 的最後一次輸出)"""
+    outputs = None
+    for outputs in run_interface_stream(file_path, sheet_name, x_unit, y_unit, dose_unit, inflection_point,
+                                        custom_title, inflection_criterion, session_id, run_id):
+        pass
+    return outputs
+
+
+def warm_up():
+    """預先載入第一次分析才會用到的繪圖模組 (matplotlib)；介面啟動後於背景執行緒呼叫，縮短第一次分析的等待時間"""
+    import image_processor  # noqa: F401
+
+
+def _export_image(run, panel, new_path, image_format):
+    """以 export 設定 (高解析度) 重新繪製面板圖表並匯出為 new_path，回傳路徑；無法重新繪製時回傳 None
+
+    擬合結果與工作表都經由快取取得，只需重新繪圖。檔案在分析後被修改時不重新繪製，以免圖表與紀錄的參數不一致。
+    圖檔先存入 artifact_store，再以 reflink / 硬連結匯出 (不支援時才複製)，相同圖表重複儲存不會多佔空間。
+    匯出期間引用該圖檔；繪製後、引用前就被其他連線的圖檔淘汰時重新繪製一次。
+    """
+    options = run.options or {}
+    if run.dependencies is None or panel_dependencies(run.file_path, run.sheet_name, **options) != run.dependencies:
+        return None
+    for _ in range(2):
+        result, file_paths, _ = process_file(run.file_path, run.sheet_name, panel.model_type, options['x_unit'],
+                                             options['y_unit'], options['dose_unit'], options['inflection_point'],
+                                             options['custom_title'], average=panel.average,
+                                             inflection_criterion=options['inflection_criterion'], profile="export",
+                                             image_format=image_format)
+        if 'Error' in result or not file_paths:
+            return None
+        with artifact_store.pinned(file_paths[:1]):
+            if os.path.exists(file_paths[0]):
+                artifact_store.export(file_paths[0], new_path)
+                return new_path
+    return None
+
+
+def save_file(title_name, run_id=None, session_id=None, excel=True, cohort_format=None, image_formats=("png",)):
+    """由分析紀錄 (result_store) 儲存圖表與參數；未指定 run_id 時儲存該連線最新的分析
+
+    excel 為是否輸出 Excel 報表；cohort_format 為 "csv" 或 "parquet" 時，另將四個面板的結果各一列附加到彙整檔。
+    image_formats 為圖檔格式 (png / svg / webp) 的列表，圖表以 export 設定 (高解析度) 重新繪製；
+    無法重新繪製時 (例如檔案已被修改) 改為匯出畫面上的 PNG 預覽圖。
+    """
     if not title_name:
         title_name = 'test'
+    # 標題同時作為資料夾與檔名，去除路徑分隔符號等字元，避免寫到該連線的資料夾之外
+    title_name = safe_title(title_name)
+    if not title_name:
+        print("標題只能包含文字、數字、空白與 - _ . ( )，請重新輸入")
+        return None
+
+    run = result_store.get_run(session_id, run_id)
+    if run is None:
+        print("尚無可儲存的分析結果，請先執行分析")
+        return None
 
     # 設定儲存的目標資料夾
-    saving_path = os.path.join(TEMP_FOLDER_PATH, title_name)
+    saving_path = export_dir(title_name, session_id)
 
     # 檢查並創建儲存資料夾
     if not os.path.exists(saving_path):
         os.makedirs(saving_path)
 
-    # 定義暫存檔案路徑
-    temp_one_compartment_path = os.path.join(TEMP_FOLDER_PATH, 'one_compartment_model_ln.png')
-    temp_two_compartment_path = os.path.join(TEMP_FOLDER_PATH, 'two_compartment_model.png')
-    temp_one_compartment_avg_path = os.path.join(TEMP_FOLDER_PATH, 'one_compartment_model_ln_avg.png')
-    temp_two_compartment_avg_path = os.path.join(TEMP_FOLDER_PATH, 'two_compartment_model_avg.png')
-
-    # 定義新的檔名和儲存路徑
-    new_one_compartment_path = os.path.join(saving_path, f'one_compartment_{title_name}.png')
-    new_two_compartment_path = os.path.join(saving_path, f'two_compartment_{title_name}.png')
-    new_one_compartment_avg_path = os.path.join(saving_path, f'one_compartment_avg_{title_name}.png')
-    new_two_compartment_avg_path = os.path.join(saving_path, f'two_compartment_avg_{title_name}.png')
-
-    # 檢查暫存圖片是否存在，並進行複製和重命名
-    if os.path.exists(temp_one_compartment_path):
-        shutil.copy(temp_one_compartment_path, new_one_compartment_path)
-        print(f"一室模型圖片已儲存至: {new_one_compartment_path}")
-    else:
-        print(f"未找到暫存的一室模型圖片: {temp_one_compartment_path}")
-
-    if os.path.exists(temp_two_compartment_path):
-        shutil.copy(temp_two_compartment_path, new_two_compartment_path)
-        print(f"二室模型圖片已儲存至: {new_two_compartment_path}")
-    else:
-        print(f"未找到暫存的二室模型圖片: {temp_two_compartment_path}")
-
-    if os.path.exists(temp_one_compartment_avg_path):
-        shutil.copy(temp_one_compartment_avg_path, new_one_compartment_avg_path)
-        print(f"平均值一室模型圖片已儲存至: {new_one_compartment_avg_path}")
-    else:
-        print(f"未找到暫存的平均值一室模型圖片: {temp_one_compartment_avg_path}")
-
-    if os.path.exists(temp_two_compartment_avg_path):
-        shutil.copy(temp_two_compartment_avg_path, new_two_compartment_avg_path)
-        print(f"平均值二室模型圖片已儲存至: {new_two_compartment_avg_path}")
-    else:
-        print(f"未找到暫存的平均值二室模型圖片: {temp_two_compartment_avg_path}")
-
-    # 分割名稱和值，並去除多餘的空格
-    one_names_list = [name.strip() for name in one_names.strip().split('\n')]
-    one_values_list = [value.strip() for value in one_values.strip().split('\n')]
-    one_values_avg_list = [value.strip() for value in one_values_avg.strip().split('\n')]
-    two_names_list = [name.strip() for name in two_names.strip().split('\n')]
-    two_values_list = [value.strip() for value in two_values.strip().split('\n')]
-    two_values_avg_list = [value.strip() for value in two_values_avg.strip().split('\n')]
-
-    # 構建 DataFrame，格式為 [變數名][原始資料][平均值]
-    one_compartment_data = pd.DataFrame({
-        'Parameter': one_names_list,
-        'Original Value': one_values_list,
-        'Average Value': one_values_avg_list
-    })
-
-    two_compartment_data = pd.DataFrame({
-        'Parameter': two_names_list,
-        'Original Value': two_values_list,
-        'Average Value': two_values_avg_list
-    })
-
-    # 定義 Excel 檔案路徑
-    excel_path = os.path.join(saving_path, f'{title_name}.xlsx')
-
-    # 使用 ExcelWriter 將一室和二室模型寫入不同的工作表
-    with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
-        one_compartment_data.to_excel(writer, sheet_name='One Compartment Model', index=False)
-        two_compartment_data.to_excel(writer, sheet_name='Two Compartment Model', index=False)
-
-    print(f"數據已儲存至: {excel_path}")
+    # 各面板的圖檔重新繪製並命名：(模型類型, 是否取平均值, 新檔名前綴)
+    for model_type, average, prefix in (("一室模型", False, "one_compartment"), ("二室模型", False, "two_compartment"),
+                                        ("一室模型", True, "one_compartment_avg"),
+                                        ("二室模型", True, "two_compartment_avg")):
+        panel = run.panel(model_type, average)
+        label = f"{'平均值' if average else ''}{model_type}"
+        # 分析失敗的面板只有佔位圖片，不需要儲存
+        if not panel.ok:
+            print(f"{label}分析失敗，未儲存圖片")
+            continue
+        for image_format in image_formats:
+            new_path = os.path.join(saving_path, f'{prefix}_{title_name}.{image_format}')
+            if _export_image(run, panel, new_path, image_format):
+                print(f"{label}圖片已儲存至: {new_path}")
+            elif image_format == "png" and panel.image_path and os.path.exists(panel.image_path):
+                artifact_store.export(panel.image_path, new_path)
+                print(f"{label}圖片已儲存至 (預覽解析度): {new_path}")
+            else:
+                print(f"未找到{label}圖片 ({image_format}): {panel.image_path}")
+
+    excel_path = None
+    if excel:
+        # 定義 Excel 檔案路徑，一室和二室模型寫入不同的工作表
+        excel_path = exporter.write_excel(run, os.path.join(saving_path, f'{title_name}.xlsx'))
+        print(f"數據已儲存至: {excel_path}")
+
+    if cohort_format:
+        # 所有分析附加到同一個欄式彙整檔，不必逐一開啟 Excel 檔案合併
+        cohort_path = cohort_export_path(session_id, cohort_format)
+        try:
+            exporter.append_run(cohort_path, run)
+            print(f"數據已附加至彙整檔: {cohort_path}")
+        except ImportError as e:
+            print(f"未儲存彙整檔: {e}")
+    return excel_path
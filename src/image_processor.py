@@ -1,70 +1,291 @@
-import matplotlib.pyplot as plt
-import numpy as np
+import io
+import os
 import platform
-from config import TEMP_FOLDER_PATH
+import threading
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from config import IMAGE_FORMATS
+import artifact_store
+import instrumentation
 
 # 根據操作系統設置字體
 if platform.system() == 'Darwin':  # macOS
-    plt.rcParams['font.sans-serif'] = ['PingFang HK']  # 使用 PingFang HK 字體來顯示中文
+    matplotlib.rcParams['font.sans-serif'] = ['PingFang HK']  # 使用 PingFang HK 字體來顯示中文
 elif platform.system() == 'Windows':  # Windows
-    plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']  # 使用微軟雅黑字體顯示中文
+    matplotlib.rcParams['font.sans-serif'] = ['Microsoft YaHei']  # 使用微軟雅黑字體顯示中文
 else:
-    plt.rcParams['font.sans-serif'] = ['DejaVu Sans']  # Linux 或其他系統的默認字體
+    matplotlib.rcParams['font.sans-serif'] = ['DejaVu Sans']  # Linux 或其他系統的默認字體
 
-plt.rcParams['axes.unicode_minus'] = False  # 正常顯示負號
+matplotlib.rcParams['axes.unicode_minus'] = False  # 正常顯示負號
 
+# 所有圖表共用的樣式模板
+FIGURE_STYLE = {'figsize': (10, 6)}
+SCATTER_STYLE = {'s': 50}
+TWO_COMPARTMENT_TICKS = [0.1, 0.5, 1, 5, 10, 50, 100]  # 二室模型 y 軸刻度
+# 族群疊圖：每位受試者一種顏色 (依受試者編號取色)，受試者越多線條越透明
+COHORT_COLORMAP = 'viridis'
+COHORT_SCATTER_STYLE = {'s': 12}
+COHORT_LINE_STYLE = {'linewidths': 1.0}
+# 疊圖最多畫出的預測曲線數：超過時等間隔挑選受試者 (百分位數帶仍以全部受試者計算)，繪圖時間不隨受試者數增加
+MAX_COHORT_CURVES = 400
 
-def plot_one_compartment(time, cp, dose, new_time_range, predicted_cp, x_unit, y_unit, dose_unit, custom_title="", average=False):
-    title = f'One Compartment Model(dose : {dose} {dose_unit}) - {custom_title}' if custom_title else f'One Compartment Model(dose : {dose} {dose_unit})'
-    # 根據 average 參數設置不同的檔案名稱
-    filename = f'{TEMP_FOLDER_PATH}/one_compartment_model_ln{"_avg" if average else ""}.png'
+# 輸出設定：preview 供介面顯示 (低解析度、繪製快)，export 供儲存 (高解析度)
+RENDER_PROFILES = {
+    'preview': {'dpi': 100},
+    'export': {'dpi': 300},
+}
+DEFAULT_PROFILE = 'export'
+# 觀測點超過此數量時，散佈圖以點陣方式嵌入 (SVG 不會為每個點產生一個向量物件)
+RASTERIZE_THRESHOLD = 1000
+
+
+def decimate_indices(x, y, bins):
+    """保留極值的降採樣：將 x 範圍等分為 bins 格，每格只保留 y 最小與最大的點，回傳保留點的索引 (依原始順序)
+
+    每格對應圖上約一個像素寬，降採樣後的散佈圖外觀 (包絡線與離群值) 與原始資料相同，點數不超過 2 * bins。
+    非有限值 (例如 log(0)) 不會被繪製，一併捨棄。
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(finite) <= 2 * bins:
+        return finite
+    fx, fy = x[finite], y[finite]
+    low, high = fx.min(), fx.max()
+    width = (high - low) / bins if high > low else 1.0
+    column = np.minimum(((fx - low) / width).astype(np.int64), bins - 1)
+    # 依 (格子, y) 排序後，每格的第一個點為最小值、最後一個點為最大值
+    order = np.lexsort((fy, column))
+    sorted_column = column[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_column[1:] != sorted_column[:-1])))
+    ends = np.concatenate((starts[1:], [len(order)])) - 1
+    return finite[np.unique(np.concatenate((order[starts], order[ends])))]
+
+
+def decimate_grid_indices(x, y, x_bins, y_bins):
+    """格點降採樣：將 (x, y) 範圍分成 x_bins * y_bins 格，每格只保留第一個點，回傳保留點的索引 (依原始順序)
+
+    格子大小約為一個散佈點的直徑時，被其他點完全覆蓋的點才會被捨棄，適用於多條數列共用取樣時間的族群疊圖。
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(finite) <= x_bins * y_bins:
+        return finite
+    cells = np.zeros(len(finite), dtype=np.int64)
+    for values, bins in ((x[finite], x_bins), (y[finite], y_bins)):
+        low, high = values.min(), values.max()
+        width = (high - low) / bins if high > low else 1.0
+        cells = cells * bins + np.minimum(((values - low) / width).astype(np.int64), bins - 1)
+    _, first = np.unique(cells, return_index=True)
+    return finite[np.sort(first)]
+
+
+def decimate_minmax(x, y, bins):
+    """保留極值的降採樣，回傳降採樣後的 (x, y) (點數不超過 2 * bins 時只捨棄非有限值)"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 2 * bins:
+        return x, y
+    keep = decimate_indices(x, y, bins)
+    return x[keep], y[keep]
+
+
+# 不使用 pyplot 的全域狀態，每次繪圖建立獨立的 Figure 與 Agg 畫布，可安全地在多個執行緒中同時繪圖
+def _new_axes():
+    figure = Figure(figsize=FIGURE_STYLE['figsize'])
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot()
+
+
+def _scatter_observations(ax, x, y, profile, label):
+    """繪製觀測點：依輸出解析度降採樣 (每個像素欄最多兩點)，點數多時以點陣方式嵌入"""
+    bins = int(FIGURE_STYLE['figsize'][0] * RENDER_PROFILES[profile]['dpi'])
+    with instrumentation.span("decimate"):
+        x, y = decimate_minmax(x, y, bins)
+    ax.scatter(x, y, label=label, rasterized=len(x) > RASTERIZE_THRESHOLD, **SCATTER_STYLE)
+
+
+def _encode(figure, profile, image_format):
+    """將圖表依輸出設定編碼為記憶體中的圖檔位元組 (png / svg / webp)"""
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不支援的圖檔格式: {image_format}")
+    buffer = io.BytesIO()
+    with instrumentation.span(f"encode_{image_format}"):
+        figure.savefig(buffer, format=image_format, dpi=RENDER_PROFILES[profile]['dpi'])
+    return buffer.getvalue()
+
+
+def _write_file(data, filename):
+    """先寫入暫存檔再改名，避免其他執行緒讀到寫到一半的圖檔"""
+    temp_filename = f'{filename}.{os.getpid()}-{threading.get_ident()}.tmp'
+    with instrumentation.span("write_image"):
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, filename)
+    return filename
+
+
+def _save(data, output_dir, name, image_format):
+    """output_dir 為 None 時存入內容定址的 artifact_store (相同圖檔只存一份)，否則以 name 寫入 output_dir"""
+    if output_dir is None:
+        with instrumentation.span("write_image"):
+            return artifact_store.put(data, image_format)
+    return _write_file(data, os.path.join(output_dir, f'{name}.{image_format}'))
+
+
+def render_one_compartment(time, cp, dose, new_time_range, predicted_cp, x_unit, y_unit, dose_unit, custom_title="",
+                           profile=DEFAULT_PROFILE, image_format='png'):
+    """繪製一室模型圖表，回傳圖檔位元組 (profile 為 RENDER_PROFILES 的名稱，image_format 見 IMAGE_FORMATS)"""
+    title = f'One Compartment Model(dose : {dose} {dose_unit})' + (f' - {custom_title}' if custom_title else '')
 
     # 繪製實際藥物濃度(自然對數)與預測藥物濃度
-    plt.figure(figsize=(10, 6))
-    plt.scatter(time, np.log(cp), label='實際藥物濃度(Actual Drug Concentration)\n(自然對數)', s=50)
-    plt.plot(new_time_range, predicted_cp, 'r--', label='預測藥物濃度')  # 保留預測的回歸線
-    plt.xlabel(f'時間 ({x_unit})')
-    plt.ylabel(f'藥物濃度 Cp ({y_unit})')
-    plt.title(title)
-    plt.legend()
-    plt.savefig(filename, dpi=300)
-    plt.close()
+    figure, ax = _new_axes()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ln_cp = np.log(cp)
+    _scatter_observations(ax, time, ln_cp, profile, '實際藥物濃度(Actual Drug Concentration)\n(自然對數)')
+    ax.plot(new_time_range, predicted_cp, 'r--', label='預測藥物濃度')  # 保留預測的回歸線
+    ax.set_xlabel(f'時間 ({x_unit})')
+    ax.set_ylabel(f'藥物濃度 Cp ({y_unit})')
+    ax.set_title(title)
+    ax.legend()
+    return _encode(figure, profile, image_format)
 
 
-def plot_two_compartment(time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b, predicted_cp_b, a, b,
-                         x_unit, y_unit, dose_unit, custom_title="", average=False):
-    title = f'Two Compartment Model(dose : {dose} {dose_unit}) - {custom_title}' if custom_title else f'Two Compartment Model(dose : {dose} {dose_unit})'
-    # 根據 average 參數設置不同的檔案名稱
-    filename = f'{TEMP_FOLDER_PATH}/two_compartment_model{"_avg" if average else ""}.png'
+def render_two_compartment(time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b, predicted_cp_b, a, b,
+                           x_unit, y_unit, dose_unit, custom_title="", profile=DEFAULT_PROFILE, image_format='png'):
+    """繪製二室模型圖表，回傳圖檔位元組 (參數同 render_one_compartment)"""
+    title = f'Two Compartment Model(dose : {dose} {dose_unit})' + (f' - {custom_title}' if custom_title else '')
 
     min_predicted_cp_b = np.min(np.exp(predicted_cp_b))
     # 設定 y 軸範圍
     min_ln_cp = max(np.min(cp[cp > 0]), min_predicted_cp_b) / 2
-    max_ln_cp = max(cp) * 2
+    max_ln_cp = np.max(cp) * 2
 
     # 繪製二室模型圖表
-    plt.figure(figsize=(10, 6))
-    plt.scatter(time, cp, label='實際藥物濃度(Actual Drug Concentration)', s=50)
-    plt.plot(new_time_range_a, np.exp(predicted_cp_a), 'r--', label='前段預測藥物濃度')  # 保留前段預測線
-    plt.plot(new_time_range_b, np.exp(predicted_cp_b), 'g--', label='後段預測藥物濃度')  # 保留後段預測線
+    figure, ax = _new_axes()
+    _scatter_observations(ax, time, cp, profile, '實際藥物濃度(Actual Drug Concentration)')
+    ax.plot(new_time_range_a, np.exp(predicted_cp_a), 'r--', label='前段預測藥物濃度')  # 保留前段預測線
+    ax.plot(new_time_range_b, np.exp(predicted_cp_b), 'g--', label='後段預測藥物濃度')  # 保留後段預測線
+
+    ax.scatter(0, b, color='green', zorder=5, **SCATTER_STYLE)  # 標記 b
+    ax.scatter(0, a, color='red', zorder=5, **SCATTER_STYLE)  # 標記 a
+
+    ax.text(0, b, f'b 線 t=0 濃度: {b:.2f}', color='green', verticalalignment='bottom', horizontalalignment='center')
+    ax.text(0, a, f'a 線 t=0 濃度: {a:.2f}', color='red', verticalalignment='top', horizontalalignment='center')
+
+    ax.set_yscale('log')  # 使用對數刻度
+
+    ax.set_ylim(bottom=min_ln_cp, top=max_ln_cp)  # 設定 y 軸範圍
+
+    ticks = [tick for tick in TWO_COMPARTMENT_TICKS if min_ln_cp <= tick <= max_ln_cp]
+    ax.set_yticks(ticks, ['{:.2f}'.format(tick) for tick in ticks])
+
+    ax.set_xlabel(f'時間({x_unit})')
+    ax.set_ylabel(f'藥物濃度 Cp ({y_unit})')
+    ax.set_title(title)
+    ax.legend()
+    return _encode(figure, profile, image_format)
+
+
+def plot_one_compartment(time, cp, dose, new_time_range, predicted_cp, x_unit, y_unit, dose_unit, custom_title="",
+                         average=False, output_dir=None, profile=DEFAULT_PROFILE, image_format='png'):
+    """繪製一室模型圖表並存檔，回傳圖檔路徑 (output_dir 預設存入 artifact_store)"""
+    # 根據 average 參數設置不同的檔案名稱
+    name = f'one_compartment_model_ln{"_avg" if average else ""}'
+    data = render_one_compartment(time, cp, dose, new_time_range, predicted_cp, x_unit, y_unit, dose_unit,
+                                  custom_title, profile, image_format)
+    return _save(data, output_dir, name, image_format)
+
+
+def plot_two_compartment(time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b, predicted_cp_b, a, b,
+                         x_unit, y_unit, dose_unit, custom_title="", average=False, output_dir=None,
+                         profile=DEFAULT_PROFILE, image_format='png'):
+    """繪製二室模型圖表並存檔，回傳圖檔路徑 (output_dir 預設存入 artifact_store)"""
+    # 根據 average 參數設置不同的檔案名稱
+    name = f'two_compartment_model{"_avg" if average else ""}'
+    data = render_two_compartment(time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b, predicted_cp_b,
+                                  a, b, x_unit, y_unit, dose_unit, custom_title, profile, image_format)
+    return _save(data, output_dir, name, image_format)
+
+
+def render_cohort(time, cp, curve_time, curves, x_unit, y_unit, custom_title="", band=None, log_scale=True,
+                  profile=DEFAULT_PROFILE, image_format='png'):
+    """將整個族群的觀測值與預測曲線畫在同一張圖上，回傳圖檔位元組
+
+    time、cp 為 (受試者數, 點數) 的觀測值 (長度不足處為 NaN)；curve_time 為共同時間網格，curves 為
+    (受試者數, 網格點數) 的預測濃度 (例如 models.fit_cohort_curves 的結果)。所有受試者的觀測值為單一
+    PathCollection、預測曲線為單一 LineCollection；觀測值以格點降採樣，曲線最多畫出 MAX_COHORT_CURVES 條 (標題註明畫出的條數)，
+    繪圖時間幾乎與受試者數無關。band 為 (下百分位數, 上百分位數) 時，另畫出全部受試者預測曲線的百分位數帶與中位數。
+    """
+    cp = np.asarray(cp, dtype=float)
+    time = np.broadcast_to(np.asarray(time, dtype=float), cp.shape)
+    curve_time = np.asarray(curve_time, dtype=float)
+    curves = np.asarray(curves, dtype=float)
+    n_subjects = cp.shape[0]
+
+    figure, ax = _new_axes()
+    if log_scale:
+        ax.set_yscale('log')
+    colormap = matplotlib.colormaps[COHORT_COLORMAP]
+    colors = colormap(np.linspace(0, 1, max(n_subjects, 1)))
+    alpha = float(np.clip(20 / min(max(n_subjects, 1), MAX_COHORT_CURVES), 0.05, 0.8))
 
-    plt.scatter(0, b, color='green', s=50, zorder=5)  # 標記 b
-    plt.scatter(0, a, color='red', s=50, zorder=5)  # 標記 a
+    # 預測曲線：無法擬合 (NaN) 或對數刻度下非正值的受試者不畫
+    drawable = np.isfinite(curves).all(axis=1) & ((curves > 0).all(axis=1) if log_scale else True)
+    shown = np.flatnonzero(drawable)
+    if len(shown) > MAX_COHORT_CURVES:
+        shown = shown[np.linspace(0, len(shown) - 1, MAX_COHORT_CURVES).astype(np.int64)]
+    # 有曲線未畫出 (超過上限或無法擬合) 時在標題註明畫出的條數
+    curve_note = f', {len(shown)} of {n_subjects} curves shown' if len(shown) < n_subjects else ''
+    title = f'Cohort Overlay (n = {n_subjects}{curve_note})' + (f' - {custom_title}' if custom_title else '')
+    if len(shown):
+        segments = np.stack((np.broadcast_to(curve_time, curves[shown].shape), curves[shown]), axis=-1)
+        lines = LineCollection(segments, colors=colors[shown], alpha=alpha,
+                               rasterized=segments.shape[0] * segments.shape[1] > RASTERIZE_THRESHOLD,
+                               **COHORT_LINE_STYLE)
+        ax.add_collection(lines)
 
-    plt.text(0, b, f'b 線 t=0 濃度: {b:.2f}', color='green', verticalalignment='bottom', horizontalalignment='center')
-    plt.text(0, a, f'a 線 t=0 濃度: {a:.2f}', color='red', verticalalignment='top', horizontalalignment='center')
+    # 觀測值：全部受試者攤平後以散佈點大小的格子降採樣 (受試者常共用取樣時間，不能只保留每欄的極值)，以受試者編號取色
+    flat_time = time.ravel()
+    flat_cp = cp.ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flat_y = np.log(flat_cp) if log_scale else flat_cp
+    diameter = np.sqrt(COHORT_SCATTER_STYLE['s'])  # 散佈點直徑 (points，1 inch = 72 points)
+    with instrumentation.span("decimate"):
+        keep = decimate_grid_indices(flat_time, flat_y, int(FIGURE_STYLE['figsize'][0] * 72 / diameter),
+                                     int(FIGURE_STYLE['figsize'][1] * 72 / diameter))
+    subject = keep // cp.shape[1] if cp.shape[1] else keep
+    ax.scatter(flat_time[keep], flat_cp[keep], c=colors[subject], alpha=min(1.0, 2 * alpha),
+               label='實際藥物濃度(Actual Drug Concentration)', rasterized=len(keep) > RASTERIZE_THRESHOLD,
+               **COHORT_SCATTER_STYLE)
 
-    plt.yscale('log')  # 使用對數刻度
+    if band is not None and drawable.any():
+        low, median, high = np.percentile(curves[drawable], (band[0], 50, band[1]), axis=0)
+        ax.fill_between(curve_time, low, high, color='gray', alpha=0.3,
+                        label=f'預測藥物濃度 {band[0]:g}-{band[1]:g} 百分位數')
+        ax.plot(curve_time, median, 'k--', label='預測藥物濃度中位數')
 
-    plt.ylim(bottom=min_ln_cp, top=max_ln_cp)  # 設定 y 軸範圍
+    ax.autoscale_view()
+    # 對數刻度下 LineCollection 的自動範圍不可靠，依觀測值與畫出的曲線設定 y 軸範圍 (與二室模型圖相同，上下各留一倍)
+    shown_values = np.concatenate((flat_cp[keep], curves[shown].ravel()))
+    shown_values = shown_values[np.isfinite(shown_values) & ((shown_values > 0) if log_scale else True)]
+    if log_scale and len(shown_values):
+        ax.set_ylim(bottom=shown_values.min() / 2, top=shown_values.max() * 2)
+    ax.set_xlabel(f'時間 ({x_unit})')
+    ax.set_ylabel(f'藥物濃度 Cp ({y_unit})')
+    ax.set_title(title)
+    ax.legend()
+    return _encode(figure, profile, image_format)
 
-    ticks = [0.1, 0.5, 1, 5, 10, 50, 100]  # y 軸刻度
-    ticks = [tick for tick in ticks if min_ln_cp <= tick <= max_ln_cp]
-    plt.yticks(ticks, ['{:.2f}'.format(tick) for tick in ticks])
 
-    plt.xlabel(f'時間({x_unit})')
-    plt.ylabel(f'藥物濃度 Cp ({y_unit})')
-    plt.title(title)
-    plt.legend()
-    plt.savefig(filename, dpi=300)  # 保存圖像
-    plt.close()
+def plot_cohort(time, cp, curve_time, curves, x_unit, y_unit, filename, custom_title="", band=None, log_scale=True,
+                profile=DEFAULT_PROFILE):
+    """繪製族群疊圖並存檔 (圖檔格式由副檔名決定)，回傳圖檔路徑"""
+    image_format = os.path.splitext(filename)[1].lstrip('.').lower() or 'png'
+    data = render_cohort(time, cp, curve_time, curves, x_unit, y_unit, custom_title, band, log_scale, profile,
+                         image_format)
+    return _write_file(data, filename)
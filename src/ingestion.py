@@ -0,0 +1,130 @@
+"""資料讀取：只讀取 time / cp / dose 三個欄位並轉為浮點數
+
+支援 Excel (.xlsx / .xlsm / .xls)、CSV 與 Parquet。Excel 的工作表名稱直接由活頁簿的 metadata
+(xl/workbook.xml) 取得，不載入任何儲存格；讀取資料時以 openpyxl 唯讀串流模式逐列讀取，
+若已安裝 python-calamine 則改用較快的 calamine 引擎。CSV 與 Parquet 視為只有一個工作表的檔案。
+"""
+import os
+import zipfile
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+# 分析所需的欄位 (欄位名稱不分大小寫)
+COLUMNS = ('time', 'cp', 'dose')
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+CSV_EXTENSIONS = ('.csv',)
+PARQUET_EXTENSIONS = ('.parquet',)
+SUPPORTED_EXTENSIONS = EXCEL_EXTENSIONS + CSV_EXTENSIONS + PARQUET_EXTENSIONS
+
+_SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+
+def file_kind(file_path):
+    """依副檔名判斷檔案類型：'excel'、'csv' 或 'parquet'"""
+    extension = os.path.splitext(str(file_path))[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return 'csv'
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    return 'excel'
+
+
+def single_sheet_name(file_path):
+    """CSV / Parquet 只有一個「工作表」，以檔名 (不含副檔名) 表示"""
+    return os.path.splitext(os.path.basename(str(file_path)))[0]
+
+
+def _workbook_sheet_names(file_path):
+    """由 xl/workbook.xml 讀取工作表名稱 (依活頁簿中的順序)，不解析任何工作表"""
+    with zipfile.ZipFile(file_path) as archive:
+        root = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    return [sheet.get('name') for sheet in root.iter(f'{_SPREADSHEET_NS}sheet')]
+
+
+def sheet_names(file_path):
+    """讀取工作表名稱列表"""
+    kind = file_kind(file_path)
+    if kind != 'excel':
+        return [single_sheet_name(file_path)]
+    try:
+        return _workbook_sheet_names(file_path)
+    except (zipfile.BadZipFile, KeyError):
+        # 舊版 .xls 等非 OOXML 格式
+        return pd.ExcelFile(file_path).sheet_names
+
+
+def _wanted(name):
+    return str(name).lower() in COLUMNS
+
+
+def _to_float_frame(frame):
+    """欄位名稱轉為小寫，只保留所需欄位 (同名欄位取第一個) 並轉為浮點數 (無法轉換的值視為空值)"""
+    frame = frame.loc[:, [_wanted(name) for name in frame.columns]]
+    frame.columns = [str(name).lower() for name in frame.columns]
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    return frame.apply(pd.to_numeric, errors='coerce').astype(float)
+
+
+def _read_excel_openpyxl(file_path, sheet_name):
+    """以 openpyxl 唯讀模式逐列讀取，只保留所需欄位的儲存格"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, ())
+        indexes = {}
+        for index, name in enumerate(header):
+            if name is not None and _wanted(name):
+                indexes.setdefault(str(name).lower(), index)
+        if not indexes:
+            return pd.DataFrame()
+        # 只保留所需欄位的值，其他欄位不建立 DataFrame 也不轉換型別
+        columns = {name: [] for name in indexes}
+        for row in rows:
+            values = [row[index] if index < len(row) else None for index in indexes.values()]
+            if all(value is None for value in values):
+                continue  # 略過空白列
+            for name, value in zip(indexes, values):
+                columns[name].append(value)
+    finally:
+        workbook.close()
+    return pd.DataFrame(columns)
+
+
+def read_sheet(file_path, sheet_name):
+    """讀取單一工作表 (或 CSV / Parquet 檔案) 的 time / cp / dose 欄位
+
+    回傳欄位名稱為小寫、型別為 float64 的 DataFrame；缺少的欄位不會出現在結果中，
+    所需欄位皆為空值 (或非數值) 的列會被略過。
+    """
+    kind = file_kind(file_path)
+    if kind == 'csv':
+        frame = pd.read_csv(file_path, usecols=_wanted)
+    elif kind == 'parquet':
+        import pyarrow.parquet as pq
+
+        names = [name for name in pq.read_schema(file_path).names if _wanted(name)]
+        frame = pd.read_parquet(file_path, columns=names)
+    elif EXCEL_ENGINE == 'calamine':
+        frame = pd.read_excel(file_path, sheet_name=sheet_name, usecols=_wanted, engine='calamine')
+    elif os.path.splitext(str(file_path))[1].lower() == '.xls':
+        frame = pd.read_excel(file_path, sheet_name=sheet_name, usecols=_wanted)
+    else:
+        frame = _read_excel_openpyxl(file_path, sheet_name)
+    frame = _to_float_frame(frame)
+    return frame.dropna(how='all').reset_index(drop=True) if len(frame.columns) else frame
+
+
+def unique_times(frame):
+    """轉折點下拉選單使用的時間點 (已排序、去除重複與空值)"""
+    return np.unique(frame['time'].dropna().to_numpy())
@@ -0,0 +1,181 @@
+"""分析流程的計時與記憶體量測
+
+以 trace() 包住一次分析 (例如單一面板的 process_file)，其中以 span() 標記各階段；
+每個階段記錄經過時間與期間的峰值記憶體 (tracemalloc)。未啟用時 span() 回傳共用的空物件，
+幾乎沒有額外負擔。
+
+啟用方式：環境變數 PK_PROFILE=1 或呼叫 enable()。結果會附加到提示訊息，並以 JSON Lines
+寫入 PROFILE_LOG_PATH；設定 PK_PROFILE_DUMP=<資料夾> 時，另以 cProfile 將每次分析輸出為 .prof
+檔 (可用 `python -m pstats`、snakeviz 或 flameprof 產生火焰圖)。
+
+注意：tracemalloc 的峰值為整個行程的記憶體，四個面板同時分析時會互相包含。
+"""
+import cProfile
+import json
+import os
+import threading
+import time as time_module
+import tracemalloc
+
+from config import PROFILING_ENABLED, PROFILE_LOG_PATH, PROFILE_DUMP_DIR, ensure_temp_folder
+
+_enabled = False
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def enable(flag=True):
+    """開啟 / 關閉量測；開啟時一併開始追蹤記憶體配置"""
+    global _enabled
+    _enabled = flag
+    if flag and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def is_enabled():
+    return _enabled
+
+
+class _NullSpan:
+    """未啟用時使用的空 span"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'record', 'start', 'peak')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        stack = self.trace.stack
+        # 開始時就加入列表，紀錄依開始順序排列 (上層在子階段之前)
+        self.record = {'name': self.name, 'depth': len(stack), 'wall_ms': 0.0, 'peak_kb': 0.0}
+        self.trace.spans.append(self.record)
+        self.peak = 0
+        stack.append(self)
+        tracemalloc.reset_peak()
+        self.start = time_module.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time_module.perf_counter() - self.start
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        stack = self.trace.stack
+        stack.pop()
+        # 子階段重設過峰值，將子階段的峰值併入上層
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+        self.record['wall_ms'] = round(elapsed * 1e3, 3)
+        self.record['peak_kb'] = round(self.peak / 1024, 1)
+        return False
+
+
+def span(name):
+    """標記一個階段；不在 trace() 範圍內或未啟用時不做任何事"""
+    current = getattr(_local, 'trace', None) if _enabled else None
+    if current is None:
+        return _NULL_SPAN
+    return _Span(current, name)
+
+
+class Trace:
+    """一次分析的所有階段紀錄 (spans 依開始順序排列，depth 為巢狀層級，0 為整次分析)"""
+
+    def __init__(self, label, fields):
+        self.label = label
+        self.fields = fields
+        self.spans = []
+        self.stack = []
+
+    @property
+    def wall_ms(self):
+        return self.spans[0]['wall_ms'] if self.spans else 0.0
+
+    def summary(self):
+        """提示訊息用的摘要 (只列出前兩層階段)"""
+        lines = [f"[耗時] {self.label}: 共 {self.wall_ms:.1f} ms"]
+        for item in self.spans:
+            if 1 <= item['depth'] <= 2:
+                lines.append(f"{'  ' * item['depth']}{item['name']}: {item['wall_ms']:.1f} ms, "
+                             f"峰值記憶體 {item['peak_kb'] / 1024:.1f} MB")
+        return "\n".join(lines) + "\n"
+
+    def to_record(self):
+        record = {'timestamp': time_module.strftime('%Y-%m-%dT%H:%M:%S'), 'label': self.label,
+                  'wall_ms': self.wall_ms, 'thread': threading.current_thread().name}
+        record.update(self.fields)
+        record['spans'] = self.spans[1:]
+        return record
+
+
+class _TraceContext:
+    __slots__ = ('trace', 'profiler', 'root')
+
+    def __init__(self, label, fields):
+        self.trace = Trace(label, fields) if _enabled else None
+        self.profiler = None
+        self.root = None
+
+    def __enter__(self):
+        if self.trace is None:
+            return None
+        _local.trace = self.trace
+        if PROFILE_DUMP_DIR:
+            try:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            except ValueError:
+                # Python 3.12 起同一時間只能有一個 profiler，同時分析的其他面板不輸出 .prof
+                self.profiler = None
+        self.root = _Span(self.trace, 'total').__enter__()
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self.trace is None:
+            return False
+        self.root.__exit__(*exc)
+        if self.profiler is not None:
+            self.profiler.disable()
+            dump_profile(self.profiler, self.trace.label)
+        _local.trace = None
+        write_log(self.trace.to_record())
+        return False
+
+
+def trace(label, **fields):
+    """量測一次分析 (同一執行緒內的 span 都會記錄到這次分析)；未啟用時回傳 None"""
+    return _TraceContext(label, fields)
+
+
+def write_log(record):
+    """以 JSON Lines 格式附加一筆紀錄"""
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    ensure_temp_folder()
+    with _log_lock:
+        with open(PROFILE_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+def dump_profile(profiler, label):
+    """將 cProfile 結果存為 .prof 檔，回傳檔案路徑"""
+    os.makedirs(PROFILE_DUMP_DIR, exist_ok=True)
+    safe_label = "".join(char if char.isalnum() else "_" for char in label)
+    path = os.path.join(PROFILE_DUMP_DIR, f"{time_module.strftime('%Y%m%d-%H%M%S')}_{safe_label}_"
+                                          f"{threading.get_ident()}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+if PROFILING_ENABLED:
+    enable()
@@ -1,37 +1,150 @@
 import numpy as np
-import statsmodels.api as sm
-from image_processor import plot_one_compartment, plot_two_compartment
-from config import TEMP_FOLDER_PATH
+from dataclasses import dataclass
+
+
+# 一室、二室模型結果字典的欄位 (依輸出順序)
+ONE_COMPARTMENT_KEYS = ('slope', 'k_e', 'half_life', 'intercept', 'initial_concentration', 'clearance', 'VD',
+                        'AUC(0-t)', 'AUC(0-finity)')
+TWO_COMPARTMENT_KEYS = ('a', 'alpha', 'b', 'beta', 'k_21', 'k_10', 'k_12', 'half_life_alpha', 'half_life_beta',
+                        'half_life_k21', 'half_life_k10', 'half_life_k12', 'AUC(0-t)', 'AUC(0-finity)', 'Volume',
+                        'VDss', 'clearance', 'Cmax')
+
+
+# 最小平方法閉合解 (可批次運算)
+def ols_fit(time, cp, mask=None):
+    """以閉合解計算簡單線性回歸的斜率與截距
+
+    time、cp 可為 1D 陣列 (單一數列，回傳純量) 或 2D 陣列 (每列為一組數列，回傳向量)，
+    time 為 1D 時會自動廣播到每一組數列。mask 為布林陣列時只使用 True 的點，
+    讓長度不同的數列也能在同一個矩形陣列中批次回歸。
+    """
+    x = np.asarray(time, dtype=float)
+    y = np.asarray(cp, dtype=float)
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    x = np.broadcast_to(x, shape)
+    y = np.broadcast_to(y, shape)
+
+    if mask is None:
+        x_mean = x.mean(axis=-1, keepdims=True)
+        y_mean = y.mean(axis=-1, keepdims=True)
+        x_centered = x - x_mean
+        slope = (x_centered * (y - y_mean)).sum(axis=-1) / (x_centered ** 2).sum(axis=-1)  # 斜率
+        intercept = y_mean[..., 0] - slope * x_mean[..., 0]  # 截距
+        return slope, intercept
+
+    weight = np.broadcast_to(mask, shape).astype(float)
+    x = np.where(weight > 0, x, 0.0)  # 被遮罩的點可能是 NaN，先歸零避免污染總和
+    y = np.where(weight > 0, y, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count = weight.sum(axis=-1, keepdims=True)
+        x_mean = (weight * x).sum(axis=-1, keepdims=True) / count
+        y_mean = (weight * y).sum(axis=-1, keepdims=True) / count
+        x_centered = weight * (x - x_mean)
+        slope = (x_centered * (y - y_mean)).sum(axis=-1) / (x_centered * (x - x_mean)).sum(axis=-1)
+        intercept = y_mean[..., 0] - slope * x_mean[..., 0]
+    return slope, intercept
+
+
+def predict_line(slope, intercept, time_total, num=100):
+    """以廣播計算從 t=0 到 time_total 的預測網格，回傳 (預測值, 時間網格)"""
+    slope = np.asarray(slope, dtype=float)
+    intercept = np.asarray(intercept, dtype=float)
+    new_time_range = np.linspace(0, np.asarray(time_total, dtype=float), num=num, axis=-1)
+    predicted_cp = intercept[..., np.newaxis] + slope[..., np.newaxis] * new_time_range
+    return predicted_cp, new_time_range
 
 
 # 定義線性回歸函數
 def linear_regression(time, cp, time_total):
-    x = sm.add_constant(time)  # 添加常數項 (截距項)
-    y = cp  # 藥物濃度
-    model = sm.OLS(y, x)  # 使用普通最小平方法建立回歸模型
-    results = model.fit()  # 擬合模型
-
-    intercept = results.params[0]  # 截距
-    slope = results.params[1]  # 斜率
-
-    # 創建一個新的時間範圍，從 t=0 到最大時間值
-    new_time_range = np.linspace(0, time_total, num=100)  # 從 0 到最大時間值生成 100 個點
-    new_x = sm.add_constant(new_time_range)  # 添加常數項
-
-    predicted_cp = results.predict(new_x)  # 使用模型進行預測
-
-    return predicted_cp, round(intercept, 4), round(slope, 4), new_time_range  # 返回預測值、截距和斜率
+    slope, intercept = ols_fit(time, cp)  # 使用閉合解擬合模型
+
+    # 創建一個新的時間範圍，從 t=0 到最大時間值，生成 100 個點並進行預測
+    predicted_cp, new_time_range = predict_line(slope, intercept, time_total)
+
+    return predicted_cp, round(float(intercept), 4), round(float(slope), 4), new_time_range  # 返回預測值、截距和斜率
+
+
+def linear_regression_batch(time, cp, time_total):
+    """批次線性回歸：cp 為 (數列數, 點數) 的 2D 陣列，回傳預測網格、截距向量、斜率向量與時間網格"""
+    slope, intercept = ols_fit(time, cp)
+    predicted_cp, new_time_range = predict_line(slope, intercept, time_total)
+    return predicted_cp, intercept, slope, new_time_range
+
+
+def regression_summary(time, cp, alpha=0.05):
+    """完整的回歸診斷 (標準誤、R²、信賴區間)，僅在需要時才載入 statsmodels"""
+    import statsmodels.api as sm
+
+    results = sm.OLS(np.asarray(cp, dtype=float), sm.add_constant(np.asarray(time, dtype=float))).fit()
+    conf_int = results.conf_int(alpha=alpha)
+    return {
+        'intercept': results.params[0],
+        'slope': results.params[1],
+        'intercept_se': results.bse[0],
+        'slope_se': results.bse[1],
+        'intercept_ci': (conf_int[0][0], conf_int[0][1]),
+        'slope_ci': (conf_int[1][0], conf_int[1][1]),
+        'r_squared': results.rsquared,
+        'adj_r_squared': results.rsquared_adj,
+        'n_obs': int(results.nobs),
+        'summary': results.summary(),
+    }
 
 
-# 一室模型函數
-def one_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, custom_title="", average=False):
+@dataclass
+class OneCompartmentFit:
+    """一室模型的擬合結果：參數字典與繪圖所需的觀測值、預測曲線 (不含任何繪圖物件)"""
+    results: dict
+    time: np.ndarray
+    cp: np.ndarray
+    dose: float
+    new_time_range: np.ndarray
+    predicted_cp: np.ndarray
+    average: bool = False
+
+    def render(self, x_unit, y_unit, dose_unit, custom_title="", output_dir=None, profile="export", image_format="png"):
+        """繪製圖表並回傳圖檔路徑，只有在需要顯示或匯出時才呼叫 (此時才載入 matplotlib)
+
+        profile 為 image_processor.RENDER_PROFILES 的名稱 (preview / export)，image_format 為 png / svg / webp。
+        """
+        from image_processor import plot_one_compartment
+
+        return plot_one_compartment(self.time, self.cp, self.dose, self.new_time_range, self.predicted_cp, x_unit,
+                                    y_unit, dose_unit, custom_title=custom_title, average=self.average,
+                                    output_dir=output_dir, profile=profile, image_format=image_format)
+
+
+@dataclass
+class TwoCompartmentFit:
+    """二室模型的擬合結果：參數字典與前後段預測曲線 (不含任何繪圖物件)"""
+    results: dict
+    time: np.ndarray
+    cp: np.ndarray
+    dose: float
+    new_time_range_a: np.ndarray
+    predicted_cp_a: np.ndarray
+    new_time_range_b: np.ndarray
+    predicted_cp_b: np.ndarray
+    a: float
+    b: float
+    average: bool = False
+
+    def render(self, x_unit, y_unit, dose_unit, custom_title="", output_dir=None, profile="export", image_format="png"):
+        """繪製圖表並回傳圖檔路徑，只有在需要顯示或匯出時才呼叫 (參數同 OneCompartmentFit.render)"""
+        from image_processor import plot_two_compartment
+
+        return plot_two_compartment(self.time, self.cp, self.dose, self.new_time_range_a, self.predicted_cp_a,
+                                    self.new_time_range_b, self.predicted_cp_b, self.a, self.b, x_unit, y_unit,
+                                    dose_unit, custom_title=custom_title, average=self.average,
+                                    output_dir=output_dir, profile=profile, image_format=image_format)
+
+
+# 一室模型擬合 (只計算，不繪圖)
+def fit_one_compartment(time, cp, dose, average=False):
     ln_cp = np.log(cp)  # 計算藥物濃度的自然對數
     time_total = max(time)  # 獲取最大時間
     predicted_cp, k_e, slope, new_time_range = linear_regression(time, ln_cp, time_total)  # 進行線性回歸，取得預測結果
 
-    plot_one_compartment(time, cp, dose, new_time_range, predicted_cp, x_unit, y_unit, dose_unit,
-                         custom_title=custom_title, average=average)
-
     # 計算 AUC (區域下面積)
     auc_observed = np.trapz(cp, time)  # 使用梯形法則計算觀察到的 AUC
     auc_extrapolated = cp[-1] / (-slope)  # 計算外推的 AUC
@@ -56,17 +169,250 @@ def one_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, custom_titl
         'AUC(0-finity)': round(auc_total, 4)
     }
 
-    # 修改 return 部分，根據 average 參數選擇不同的圖像名稱
-    filename = f'{TEMP_FOLDER_PATH}/one_compartment_model_ln_avg.png' if average else (
-        f'{TEMP_FOLDER_PATH}/one_compartment_model_ln.png')
+    return OneCompartmentFit(results, time, cp, dose, new_time_range, predicted_cp, average)
 
-    return results, [filename]  # 返回計算結果和圖像
 
+# 一室模型函數
+def one_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, custom_title="", average=False):
+    fit = fit_one_compartment(time, cp, dose, average)
+    filename = fit.render(x_unit, y_unit, dose_unit, custom_title)
+    return fit.results, [filename]  # 返回計算結果和圖像
+
+
+# 自動轉折點搜尋所使用的評分標準
+AUTO_INFLECTION = "auto"
+INFLECTION_CRITERIA = ("adj_r2", "aic", "workbook")
+
+
+def _segment_regressions(time, ln_cp, start, stop):
+    """以累積和在 O(1) 時間內計算 [start, stop) 區段的線性回歸 (start、stop 可為陣列)
+
+    回傳 (點數, 斜率, 截距, 殘差平方和, 總平方和)
+    """
+    # 先平移至平均值附近以降低累積和的數值誤差
+    x_shift = time.mean()
+    y_shift = ln_cp.mean()
+    x = time - x_shift
+    y = ln_cp - y_shift
+    sums = [np.concatenate(([0.0], np.cumsum(values))) for values in (np.ones_like(x), x, y, x * x, x * y, y * y)]
+    n, sx, sy, sxx, sxy, syy = (total[stop] - total[start] for total in sums)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx_c = sxx - sx * sx / n
+        sxy_c = sxy - sx * sy / n
+        syy_c = syy - sy * sy / n
+        slope = sxy_c / sxx_c
+        intercept = (sy - slope * sx) / n + y_shift - slope * x_shift
+        sse = np.maximum(syy_c - slope * sxy_c, 0.0)
+    return n, slope, intercept, sse, syy_c
+
+
+def find_inflection_point(time, cp, criterion="adj_r2"):
+    """一次掃描所有可行的轉折點並依評分標準排序
+
+    每個候選點將資料分成前段 (分布相) 與後段 (排除相) 兩條對數線性回歸，
+    各段回歸由累積和求得，整體掃描為 O(n)。評分標準：
+    - adj_r2：兩段合併擬合的調整後 R² (越大越好)
+    - aic：兩段合併擬合的 AIC (越小越好)
+    - workbook：dataset/轉折點判斷標準.xlsx 的做法，不搜尋：後段固定為最後 3 點 (LINEST 的範圍)，
+      其餘點以殘差法拆分；最後 3 點含重複時間時，從該時間值第一次出現處切分。排名只有這一個候選點，
+      分數為後段 R²
+
+    回傳 (最佳轉折點時間, 排名列表)，無可行候選點時回傳 (None, [])
+    """
+    if criterion not in INFLECTION_CRITERIA:
+        raise ValueError(f"未知的轉折點評分標準: {criterion}")
+
+    time = np.asarray(time, dtype=float)
+    ln_cp = np.log(np.asarray(cp, dtype=float))
+    total = len(time)
+
+    # 候選點為每個時間值第一次出現的索引 (與 two_compartment_model 的切分方式一致)
+    first_occurrence = np.r_[True, time[1:] != time[:-1]]
+    candidates = np.flatnonzero(first_occurrence)
+    candidates = candidates[candidates > 0]
+    if total < 5 or len(candidates) == 0:
+        return None, []
+
+    _, slope_a, _, sse_a, sst_a = _segment_regressions(time, ln_cp, 0, candidates)
+    n_b, slope_b, _, sse_b, sst_b = _segment_regressions(time, ln_cp, candidates, total)
+    _, _, _, _, sst_total = _segment_regressions(time, ln_cp, 0, total)
+
+    # 兩段皆需至少兩個不同的時間點才能回歸 (時間全部相同時累積和的捨入誤差會算出有限但無意義的斜率)
+    distinct = np.concatenate(([0], np.cumsum(first_occurrence)))
+    valid = (np.isfinite(slope_a) & np.isfinite(slope_b) & (distinct[candidates] >= 2)
+             & (distinct[total] - distinct[candidates] >= 2))
+    sse = sse_a + sse_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2_a = 1 - sse_a / sst_a
+        r2_b = 1 - sse_b / sst_b
+        if criterion == "adj_r2":
+            score = 1 - (sse / (total - 4)) / (sst_total / (total - 1))
+        elif criterion == "aic":
+            score = total * np.log(sse / total) + 2 * 4
+        else:
+            # 後段至少 3 點的候選點中最靠後的一個
+            valid &= np.arange(len(candidates)) == np.flatnonzero(n_b >= 3).max(initial=-1)
+            score = r2_b
+
+    valid &= ~np.isnan(score)
+    order = np.flatnonzero(valid)
+    order = order[np.argsort(score[order], kind='stable')]
+    if criterion != "aic":
+        order = order[::-1]
+
+    ranking = [{
+        'inflection_point': time[candidates[i]].item(),
+        'score': round(float(score[i]), 4),
+        'alpha': round(float(-slope_a[i]), 4),
+        'beta': round(float(-slope_b[i]), 4),
+        'r2_alpha': round(float(r2_a[i]), 4),
+        'r2_beta': round(float(r2_b[i]), 4),
+    } for i in order]
+
+    if not ranking:
+        return None, []
+    return ranking[0]['inflection_point'], ranking
+
+
+def find_inflection_points_cohort(time, cp, criterion="adj_r2"):
+    """整個族群一次掃描轉折點 (候選點、評分標準與排序方式皆與 find_inflection_point 相同)
+
+    time、cp 為 (受試者數, 點數) 的矩陣，時間或濃度的對數非有限值的點視為缺值 (與逐一呼叫前先移除這些點相同)。
+    回傳 (受試者數, 點數) 的候選轉折點時間，每列依排名由佳到差排列，不足處為 NaN。
+    """
+    if criterion not in INFLECTION_CRITERIA:
+        raise ValueError(f"未知的轉折點評分標準: {criterion}")
+
+    cp = np.asarray(cp, dtype=float)
+    time = np.broadcast_to(np.asarray(time, dtype=float), cp.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ln_cp = np.log(cp)
+    # 將每位受試者的有效點移到每列前段 (保持原順序)
+    observed = np.isfinite(time) & np.isfinite(ln_cp)
+    compact = np.argsort(~observed, axis=-1, kind='stable')
+    total = observed.sum(axis=-1, keepdims=True)
+    columns = np.arange(cp.shape[-1])
+    present = columns < total
+    time = np.where(present, np.take_along_axis(time, compact, axis=-1), 0.0)
+    ln_cp = np.where(present, np.take_along_axis(ln_cp, compact, axis=-1), 0.0)
+
+    # 與 _segment_regressions 相同，先平移至各受試者的平均值附近再累積
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(present, time - np.nan_to_num(time.sum(axis=-1, keepdims=True) / total), 0.0)
+        y = np.where(present, ln_cp - np.nan_to_num(ln_cp.sum(axis=-1, keepdims=True) / total), 0.0)
+    sums = [np.concatenate((np.zeros((cp.shape[0], 1)), np.cumsum(values, axis=-1)), axis=-1)
+            for values in (present.astype(float), x, y, x * x, x * y, y * y)]
+
+    def segment(start, stop):
+        n, sx, sy, sxx, sxy, syy = (np.take_along_axis(values, stop, axis=-1)
+                                    - np.take_along_axis(values, start, axis=-1) for values in sums)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sxx_c = sxx - sx * sx / n
+            sxy_c = sxy - sx * sy / n
+            syy_c = syy - sy * sy / n
+            slope = sxy_c / sxx_c
+            sse = np.maximum(syy_c - slope * sxy_c, 0.0)
+        return n, slope, sse, syy_c
+
+    # 候選點為每個時間值第一次出現的索引 (不含第一點)
+    index = np.broadcast_to(columns, cp.shape)
+    first_occurrence = present & np.concatenate(
+        (np.ones((cp.shape[0], 1), dtype=bool), time[:, 1:] != time[:, :-1]), axis=-1)
+    candidates = first_occurrence & (index > 0) & (total >= 5)
+    zero = np.zeros_like(index)
+    end = np.broadcast_to(total, cp.shape)
+    _, slope_a, sse_a, _ = segment(zero, index)
+    n_b, slope_b, sse_b, sst_b = segment(index, end)
+    _, _, _, sst_total = segment(zero, end)
+
+    # 與 find_inflection_point 相同，兩段皆需至少兩個不同的時間點
+    distinct = np.concatenate((np.zeros((cp.shape[0], 1), dtype=int), np.cumsum(first_occurrence, axis=-1)), axis=-1)
+    distinct_a = np.take_along_axis(distinct, index, axis=-1)
+    distinct_b = np.take_along_axis(distinct, end, axis=-1) - distinct_a
+    valid = candidates & np.isfinite(slope_a) & np.isfinite(slope_b) & (distinct_a >= 2) & (distinct_b >= 2)
+    sse = sse_a + sse_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if criterion == "adj_r2":
+            score = 1 - (sse / (total - 4)) / (sst_total / (total - 1))
+        elif criterion == "aic":
+            score = total * np.log(sse / total) + 2 * 4
+        else:
+            last = np.where(candidates & (n_b >= 3), index, -1).max(axis=-1, keepdims=True)
+            valid &= index == last
+            score = 1 - sse_b / sst_b
+    valid &= ~np.isnan(score)
+
+    # find_inflection_point 以穩定排序後反轉 (aic 除外)，同分時索引較大者在前
+    if criterion == "aic":
+        order = np.lexsort((index, np.where(valid, score, np.inf)), axis=-1)
+    else:
+        order = np.lexsort((-index, np.where(valid, -score, np.inf)), axis=-1)
+    ranked = np.where(np.take_along_axis(valid, order, axis=-1), np.take_along_axis(time, order, axis=-1), np.nan)
+    return ranked
+
+
+def residual_mask(time, cp, b, b_slope):
+    """殘差法：回傳前段 (alpha 相) 資料點的布林遮罩
+
+    以後段回歸線 b * exp(b_slope * t) 外推至各時間點，保留濃度高於外推值的點，
+    並在第一個 ln(Cp - Cp') < 0 的點之後截斷。time、cp 可為 (點數,) 或 (受試者數, 點數)，
+    此時 b、b_slope 為每位受試者一個值。
+    """
+    time = np.asarray(time, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    b = np.asarray(b, dtype=float)[..., np.newaxis]
+    b_slope = np.asarray(b_slope, dtype=float)[..., np.newaxis]
+
+    cp_i = b * np.exp(b_slope * time)  # 後段回歸線外推的濃度
+    residual = cp - cp_i
+    above = residual > 0  # NaN (填補值) 比較結果為 False，自然被排除
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stop = above & (np.log(np.where(above, residual, 1.0)) < 0)
+    before_stop = np.logical_and.accumulate(~stop, axis=-1)  # 第一個截斷點 (含) 之後全部排除
+    return above & before_stop
+
+
+def strip_two_compartment_cohort(time, cp, inflection_point):
+    """整個族群一次以殘差法拆分前後段並回歸
+
+    time 為 (點數,) 或 (受試者數, 點數)，cp 為 (受試者數, 點數)，長度不足的受試者以 NaN 填補；
+    inflection_point 為共同的轉折時間或每位受試者一個值。回傳各參數向量與前後段遮罩，
+    valid 為 False 的受試者表示此資料不適用於二室模型 (對應單一受試者時回傳 None 的情況)。
+    """
+    cp = np.asarray(cp, dtype=float)
+    time = np.broadcast_to(np.asarray(time, dtype=float), cp.shape)
+    inflection_point = np.asarray(inflection_point, dtype=float)[..., np.newaxis]
+    observed = np.isfinite(cp) & np.isfinite(time)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ln_cp = np.log(cp)
+
+    # 後段：轉折點第一次出現之後的所有點
+    mask_b = np.logical_or.accumulate(time == inflection_point, axis=-1) & observed
+    b_slope, ln_b = ols_fit(time, ln_cp, mask_b)
+    # 與 linear_regression 相同，使用四捨五入後的截距與斜率外推
+    b_slope = np.round(b_slope, 4)
+    b = np.exp(np.round(ln_b, 4))
+
+    mask_a = residual_mask(time, cp, b, b_slope) & observed
+    a_slope, ln_a = ols_fit(time, ln_cp, mask_a)
+    a_slope = np.round(a_slope, 4)
+    a = np.exp(np.round(ln_a, 4))
+
+    valid = (mask_b.sum(axis=-1) >= 2) & (mask_a.sum(axis=-1) >= 2)
+    return {
+        'a': a,
+        'alpha': -a_slope,
+        'b': b,
+        'beta': -b_slope,
+        'mask_a': mask_a,
+        'mask_b': mask_b,
+        'valid': valid,
+    }
 
-# 二室模型函數
-def two_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, inflection_point, custom_title="", average=False):
-    ln_cp = np.log(cp)
 
+def _strip_two_compartment(time, cp, ln_cp, inflection_point):
+    """殘差法拆分前後段資料並回歸，資料不適用時回傳 None"""
     # 找到 inflection_point 在 time 數組中的索引
     inflection_index = np.where(time == inflection_point)[0][0]
     ln_cp_b_dataset = ln_cp[inflection_index:]
@@ -74,46 +420,55 @@ def two_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, inflection_
 
     # 如果後段資料不足，則回傳錯誤
     if len(time_b_dataset) < 2 or len(ln_cp_b_dataset) < 2:
-        print("Error: 此資料集不適用於model3")
-        return
+        return None
 
     time_total = time[-1]
 
     predicted_cp_b, ln_b, b_slope, new_time_range_b = linear_regression(time_b_dataset, ln_cp_b_dataset, time_total)
     b = np.exp(ln_b)
 
-    cp_i = [b * np.exp(b_slope * t) for t in time]
-    cp_i = np.array(cp_i).flatten()
+    mask_a = residual_mask(time, cp, b, b_slope)
+    ln_cp_a_dataset = ln_cp[mask_a]
+    time_a_dataset = time[mask_a]
 
-    ln_cp_a_dataset = []
-    time_a_dataset = []
+    if len(time_a_dataset) < 2 or len(ln_cp_a_dataset) < 2:
+        return None
 
-    for i in range(len(cp)):
-        if cp[i] > cp_i[i]:
-            x = np.log(cp[i] - cp_i[i])
-            if x < 0:
-                break
-            ln_cp_a_dataset.append(ln_cp[i])
-            time_a_dataset.append(time[i])
+    predicted_cp_a, ln_a, a_slope, new_time_range_a = linear_regression(time_a_dataset, ln_cp_a_dataset, time_total)
+    a = np.exp(ln_a)
+    return a, a_slope, predicted_cp_a, new_time_range_a, b, b_slope, predicted_cp_b, new_time_range_b
 
-    ln_cp_a_dataset = np.array(ln_cp_a_dataset).flatten()
-    time_a_dataset = np.array(time_a_dataset).flatten()
 
-    if len(time_a_dataset) < 2 or len(ln_cp_a_dataset) < 2:
+# 二室模型擬合 (只計算，不繪圖)，資料不適用時回傳 None
+def fit_two_compartment(time, cp, dose, inflection_point, average=False, criterion="adj_r2"):
+    ln_cp = np.log(cp)
+
+    # inflection_point 為 "auto" 時，依評分排名逐一嘗試，採用第一個可成功拆分的轉折點
+    auto_inflection = inflection_point == AUTO_INFLECTION
+    if auto_inflection:
+        _, ranking = find_inflection_point(time, cp, criterion)
+        candidates = [row['inflection_point'] for row in ranking]
+    else:
+        candidates = [inflection_point]
+
+    stripped = None
+    for candidate in candidates:
+        stripped = _strip_two_compartment(time, cp, ln_cp, candidate)
+        if stripped is not None:
+            inflection_point = candidate
+            break
+
+    if stripped is None:
         print("Error: 此資料集不適用於model3")
         return
 
-    predicted_cp_a, ln_a, a_slope, new_time_range_a = linear_regression(time_a_dataset, ln_cp_a_dataset, time_total)
-    a = np.exp(ln_a)
+    a, a_slope, predicted_cp_a, new_time_range_a, b, b_slope, predicted_cp_b, new_time_range_b = stripped
 
     min_predicted_cp_b = np.min(np.exp(predicted_cp_b))
     valid_indices_a = np.exp(predicted_cp_a) >= min_predicted_cp_b
     new_time_range_a = new_time_range_a[valid_indices_a]
     predicted_cp_a = predicted_cp_a[valid_indices_a]
 
-    plot_two_compartment(time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b, predicted_cp_b, a, b,
-                         x_unit, y_unit, dose_unit, custom_title=custom_title, average=average)
-
     alpha = -a_slope
     beta = -b_slope
 
@@ -153,8 +508,69 @@ def two_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, inflection_
         'clearance': round(c_l, 4),
         'Cmax': round(max(cp), 4)
     }
+    if auto_inflection:
+        results['inflection_point'] = inflection_point  # 自動選出的轉折點
+
+    return TwoCompartmentFit(results, time, cp, dose, new_time_range_a, predicted_cp_a, new_time_range_b,
+                             predicted_cp_b, a, b, average)
 
-    filename = f'{TEMP_FOLDER_PATH}/two_compartment_model_avg.png' if average else (
-        f'{TEMP_FOLDER_PATH}/two_compartment_model.png')
 
-    return results, [filename]
+# 二室模型函數
+def two_compartment_model(time, cp, dose, x_unit, y_unit, dose_unit, inflection_point, custom_title="", average=False,
+                          criterion="adj_r2"):
+    fit = fit_two_compartment(time, cp, dose, inflection_point, average, criterion)
+    if fit is None:
+        return
+    filename = fit.render(x_unit, y_unit, dose_unit, custom_title)
+    return fit.results, [filename]
+
+
+# 族群疊圖用的批次擬合 (只計算預測曲線，不計算其他參數)
+def fit_cohort_curves(model_type, time, cp, inflection_point=AUTO_INFLECTION, criterion="adj_r2", num=200):
+    """整個族群一次擬合，回傳共同時間網格 (0 到最後一個觀測時間) 上每位受試者的預測濃度
+
+    time、cp 為 (受試者數, 點數) 的矩陣 (長度不足處為 NaN，即 cohort_store.CohortStore.padded 的格式)，
+    time 也可為所有受試者共用的 (點數,)。一室模型為 exp(截距 + 斜率 * t)，二室模型為 a * exp(-alpha * t) +
+    b * exp(-beta * t)。inflection_point 為 "auto" 時與 fit_two_compartment 相同，依評分排名逐一嘗試，
+    採用每位受試者第一個可成功拆分的轉折點。
+    回傳 {'time', 'curves' (受試者數, num), 'valid'}，無法擬合的受試者曲線為 NaN。
+    """
+    cp = np.asarray(cp, dtype=float)
+    time = np.broadcast_to(np.asarray(time, dtype=float), cp.shape)
+    n_subjects = cp.shape[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ln_cp = np.log(cp)
+    observed = np.isfinite(time) & np.isfinite(ln_cp)
+    time_total = np.nanmax(time) if observed.any() else 0.0
+    new_time_range = np.linspace(0, time_total, num=num)
+
+    if model_type == "一室模型":
+        slope, intercept = ols_fit(time, ln_cp, observed)
+        slope = np.round(slope, 4)
+        intercept = np.round(intercept, 4)
+        valid = (observed.sum(axis=-1) >= 2) & np.isfinite(slope) & np.isfinite(intercept)
+        with np.errstate(over='ignore', invalid='ignore'):
+            curves = np.exp(intercept[:, np.newaxis] + slope[:, np.newaxis] * new_time_range)
+    else:
+        if inflection_point == AUTO_INFLECTION:
+            candidates = find_inflection_points_cohort(time, cp, criterion)
+        else:
+            candidates = np.broadcast_to(np.asarray(inflection_point, dtype=float), (n_subjects,))[:, np.newaxis]
+        a, alpha, b, beta = (np.full(n_subjects, np.nan) for _ in range(4))
+        valid = np.zeros(n_subjects, dtype=bool)
+        # 第 rank 輪：尚未成功的受試者改用排名第 rank 的轉折點，一次拆分
+        for rank in range(candidates.shape[1]):
+            pending = np.flatnonzero(~valid & np.isfinite(candidates[:, rank]))
+            if len(pending) == 0:
+                break
+            stripped = strip_two_compartment_cohort(time[pending], cp[pending], candidates[pending, rank])
+            done = pending[stripped['valid']]
+            for name, values in (('a', a), ('alpha', alpha), ('b', b), ('beta', beta)):
+                values[done] = stripped[name][stripped['valid']]
+            valid[done] = True
+        with np.errstate(over='ignore', invalid='ignore'):
+            curves = (a[:, np.newaxis] * np.exp(-alpha[:, np.newaxis] * new_time_range)
+                      + b[:, np.newaxis] * np.exp(-beta[:, np.newaxis] * new_time_range))
+
+    curves[~valid] = np.nan
+    return {'time': new_time_range, 'curves': curves, 'valid': valid}
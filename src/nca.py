@@ -0,0 +1,181 @@
+"""非房室分析 (NCA)：一次計算整個族群的 Cmax、Tmax、AUC、AUMC、MRT 與 λz
+
+輸入為串接的 time / cp 陣列與每位受試者的起點 offsets (長度為受試者數 + 1，與 cohort_store 的格式相同)，
+每位受試者的資料須已依時間排序。所有統計量以分段歸約 (np.add.reduceat 等) 與前綴和計算，
+不需要逐一處理每位受試者。
+
+AUC 計算方式：
+- linear：線性梯形法 (與 models 中的 np.trapz 相同)
+- linear-up/log-down：濃度上升或持平時用線性梯形，下降時用對數梯形
+
+λz 自動選點：由最後 3 點起逐一往前加入 (不含 Cmax 點)，取調整後 R² 最大者；
+與最大值相差不到 LAMBDA_Z_TOLERANCE 時選用點數較多者。
+"""
+import numpy as np
+
+AUC_METHODS = ("linear", "linear-up/log-down")
+LAMBDA_Z_TOLERANCE = 1e-4
+# 結果欄位 (AUC 欄位名稱與 models 的結果字典相同)
+NCA_KEYS = ('Cmax', 'Tmax', 'Clast', 'Tlast', 'AUC(0-t)', 'AUC(0-finity)', 'AUMC(0-t)', 'AUMC(0-finity)', 'MRT',
+            'lambda_z', 'half_life', 'lambda_z_points', 'lambda_z_r2_adj', 'clearance', 'Vz', 'Vss')
+
+
+def _segment_reduce(ufunc, values, starts, has_data, fill):
+    """各受試者的分段歸約 (ufunc.reduceat)，沒有資料的受試者為 fill
+
+    只以有資料的受試者起點歸約再填回：沒有資料的受試者起點與下一位相同 (或等於陣列長度)，
+    直接放入 reduceat 會截短前一位受試者的區段。
+    """
+    result = np.full(len(starts), fill, dtype=np.result_type(values, np.asarray(fill)))
+    if has_data.any():
+        result[has_data] = ufunc.reduceat(values, starts[has_data])
+    return result
+
+
+def _interval_areas(time, cp, subject_end, method):
+    """每個資料點與下一點之間的 AUC、AUMC 面積 (各受試者最後一點為 0)"""
+    t1, t2 = time[:-1], time[1:]
+    c1, c2 = cp[:-1], cp[1:]
+    dt = t2 - t1
+    auc = (c1 + c2) / 2 * dt
+    aumc = (t1 * c1 + t2 * c2) / 2 * dt
+    if method == "linear-up/log-down":
+        log_down = (c2 < c1) & (c2 > 0) & (dt > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = np.log(c1 / c2) / dt  # 此區間的消除速率
+            auc_log = (c1 - c2) / k
+            aumc_log = (t1 * c1 - t2 * c2) / k + (c1 - c2) / (k * k)
+        auc = np.where(log_down, auc_log, auc)
+        aumc = np.where(log_down, aumc_log, aumc)
+    # 跨越兩位受試者的區間不計入
+    auc = np.append(np.where(subject_end[:-1], 0.0, auc), 0.0)
+    aumc = np.append(np.where(subject_end[:-1], 0.0, aumc), 0.0)
+    return auc, aumc
+
+
+def _select_lambda_z(time, cp, starts, ends, subject, peak_index, lambda_z_points):
+    """以前綴和計算每個候選起點到受試者最後一點的對數線性回歸，選出各受試者的 λz
+
+    回傳 (λz, 截距, 點數, 調整後 R²)，無法估計的受試者為 NaN / 0。
+    """
+    positive = cp > 0
+    with np.errstate(divide='ignore'):
+        y = np.where(positive, np.log(np.where(positive, cp, 1.0)), 0.0)
+    # 先平移至各受試者的平均值附近以降低前綴和的數值誤差
+    lengths = ends - starts
+    has_data = lengths > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_shift = np.nan_to_num(_segment_reduce(np.add, time, starts, has_data, 0.0) / lengths)[subject]
+        y_shift = np.nan_to_num(_segment_reduce(np.add, y, starts, has_data, 0.0) / lengths)[subject]
+    x = time - x_shift
+    y = y - y_shift
+    columns = (np.ones_like(x), x, y, x * x, x * y, y * y, (~positive).astype(float))
+    prefix = [np.concatenate(([0.0], np.cumsum(values))) for values in columns]
+    end = ends[subject]
+    # 候選起點 i 的回歸範圍為 [i, 該受試者最後一點]
+    n, sx, sy, sxx, sxy, syy, non_positive = (total[end] - total[:-1] for total in prefix)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx_c = sxx - sx * sx / n
+        sxy_c = sxy - sx * sy / n
+        syy_c = syy - sy * sy / n
+        slope = sxy_c / sxx_c
+        intercept = (sy - slope * sx) / n + y_shift - slope * x_shift
+        r2 = np.where(syy_c > 0, sxy_c * sxy_c / (sxx_c * syy_c), 1.0)
+        r2_adj = 1 - (1 - r2) * (n - 1) / (n - 2)
+
+    index = np.arange(len(time))
+    valid = (index > peak_index[subject]) & (non_positive == 0) & (slope < 0) & np.isfinite(slope)
+    if lambda_z_points is None:
+        valid &= n >= 3
+        score = np.where(valid, r2_adj, -np.inf)
+        best = _segment_reduce(np.maximum, score, starts, has_data, -np.inf)
+        qualified = valid & (score >= best[subject] - LAMBDA_Z_TOLERANCE)
+    else:
+        qualified = valid & (n == lambda_z_points)
+    # 符合條件的候選點中取最前面的起點 (點數最多)
+    first = _segment_reduce(np.minimum, np.where(qualified, index, len(time)), starts, has_data, len(time))
+    found = first < len(time)
+    pick = np.where(found, first, 0)
+    return (np.where(found, -slope[pick], np.nan), np.where(found, intercept[pick], np.nan),
+            np.where(found, n[pick], 0).astype(int), np.where(found, r2_adj[pick], np.nan))
+
+
+def nca(time, cp, offsets, dose=None, method="linear", lambda_z_points=None):
+    """計算族群中每位受試者的 NCA 指標
+
+    time、cp 為串接的一維陣列，offsets 為每位受試者的起點 (長度為受試者數 + 1)；
+    dose 為純量或每位受試者一個值，提供時另計算 clearance、Vz 與 Vss。
+    lambda_z_points 為 None 時自動選點，否則固定使用最後 lambda_z_points 點。
+    回傳 {指標: 每位受試者一個值的陣列}，欄位見 NCA_KEYS。
+    """
+    if method not in AUC_METHODS:
+        raise ValueError(f"未知的 AUC 計算方式: {method}")
+    time = np.asarray(time, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    if len(time) == 0:
+        return {key: np.full(len(starts), np.nan) for key in NCA_KEYS}
+    lengths = ends - starts
+    has_data = lengths > 0
+    subject = np.repeat(np.arange(len(starts)), lengths)  # 每個資料點屬於哪位受試者
+    subject_end = np.zeros(len(time), dtype=bool)
+    subject_end[ends[has_data] - 1] = True
+    last = np.where(has_data, ends - 1, 0)
+
+    # Cmax / Tmax (最大濃度第一次出現的時間)
+    cmax = _segment_reduce(np.maximum, cp, starts, has_data, np.nan)
+    index = np.arange(len(time))
+    peak_index = _segment_reduce(np.minimum, np.where(cp == cmax[subject], index, len(time)), starts, has_data, 0)
+    tmax = np.where(has_data, time[peak_index], np.nan)
+    clast = np.where(has_data, cp[last], np.nan)
+    tlast = np.where(has_data, time[last], np.nan)
+
+    auc_areas, aumc_areas = _interval_areas(time, cp, subject_end, method)
+    auc = _segment_reduce(np.add, auc_areas, starts, has_data, np.nan)
+    aumc = _segment_reduce(np.add, aumc_areas, starts, has_data, np.nan)
+
+    lambda_z, _, lambda_points, r2_adj = _select_lambda_z(time, cp, starts, ends, subject, peak_index,
+                                                          lambda_z_points)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc_inf = auc + clast / lambda_z
+        aumc_inf = aumc + tlast * clast / lambda_z + clast / (lambda_z * lambda_z)
+        mrt = aumc_inf / auc_inf
+        results = {
+            'Cmax': cmax,
+            'Tmax': tmax,
+            'Clast': clast,
+            'Tlast': tlast,
+            'AUC(0-t)': auc,
+            'AUC(0-finity)': auc_inf,
+            'AUMC(0-t)': aumc,
+            'AUMC(0-finity)': aumc_inf,
+            'MRT': mrt,
+            'lambda_z': lambda_z,
+            'half_life': 0.693 / lambda_z,
+            'lambda_z_points': lambda_points,
+            'lambda_z_r2_adj': r2_adj,
+        }
+        if dose is None:
+            for key in ('clearance', 'Vz', 'Vss'):
+                results[key] = np.full(len(starts), np.nan)
+        else:
+            dose = np.broadcast_to(np.asarray(dose, dtype=float), auc.shape)
+            results['clearance'] = dose / auc_inf
+            results['Vz'] = dose / (lambda_z * auc_inf)
+            results['Vss'] = results['clearance'] * mrt
+    return results
+
+
+def nca_profile(time, cp, dose=None, method="linear", lambda_z_points=None):
+    """單一受試者的 NCA，回傳與 models 結果字典相同格式 (數值四捨五入至小數第 4 位) 的字典"""
+    results = nca(time, cp, [0, len(time)], dose, method, lambda_z_points)
+    return {key: (int(values[0]) if key == 'lambda_z_points' else round(float(values[0]), 4))
+            for key, values in results.items()}
+
+
+def nca_store(store, average=False, method="linear", lambda_z_points=None):
+    """對 cohort_store.CohortStore 中的所有受試者進行 NCA (直接使用 memmap 陣列，不複製資料)"""
+    time, cp, offsets = store.arrays(average)
+    return nca(time, cp, offsets, store.dose(slice(None), average), method, lambda_z_points)
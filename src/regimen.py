@@ -0,0 +1,130 @@
+"""給藥方案搜尋：以擬合的一室 / 二室模型評估 (劑量, 給藥間隔, 給藥次數) 網格，回傳符合目標的 Pareto 集合
+
+單次靜脈注射的濃度為指數項之和 C(t) = Dose * Σ c_j * exp(-λ_j * t) (見 simulation.disposition_terms)。
+每 τ 給藥一次、共 n 次時，以疊加原理可得閉合解 (r_j = exp(-λ_j * τ))：
+- 第 n 次給藥後的峰值：Dose * Σ c_j * (1 - r_j^n) / (1 - r_j)
+- 第 n 次給藥前的谷值：Dose * Σ c_j * r_j * (1 - r_j^(n-1)) / (1 - r_j)
+給藥次數為 np.inf 時即為穩定狀態。峰值與谷值都隨給藥次數遞增，因此以最後一次給藥的峰值、
+谷值判斷是否落在目標範圍內。整個網格以向量運算一次評估。
+
+Pareto 目標 (皆越小越好)：每單位時間劑量 (dose / τ)、給藥頻率 (1 / τ)、峰谷比 (peak / trough)。
+"""
+import numpy as np
+import pandas as pd
+
+import simulation
+
+RESULT_COLUMNS = ['dose', 'interval', 'n_doses', 'peak', 'trough', 'dose_rate', 'peak_trough_ratio',
+                  'average_steady_state']
+
+
+def regimen_grid(doses, intervals, n_doses=(np.inf,)):
+    """展開所有 (劑量, 給藥間隔, 給藥次數) 組合，回傳三個一維陣列"""
+    grid = np.meshgrid(np.asarray(doses, dtype=float), np.asarray(intervals, dtype=float),
+                       np.asarray(n_doses, dtype=float), indexing='ij')
+    return tuple(values.ravel() for values in grid)
+
+
+def peak_trough(terms, dose, interval, n_doses):
+    """以疊加原理計算最後一次給藥後的峰值與給藥前的谷值 (所有參數可為相同長度的陣列)"""
+    peak = np.zeros(np.broadcast(dose, interval, n_doses).shape)
+    trough = np.zeros_like(peak)
+    for coefficient, rate in terms:
+        ratio = np.exp(-rate * interval)
+        # r^inf = 0 (0 < r < 1)，給藥次數為 np.inf 時即為穩定狀態
+        with np.errstate(over='ignore', invalid='ignore'):
+            peak += coefficient * (1 - ratio ** n_doses) / (1 - ratio)
+            trough += coefficient * ratio * (1 - ratio ** (n_doses - 1)) / (1 - ratio)
+    return dose * peak, dose * trough
+
+
+def clearance(model_type, typical):
+    """總清除率 (一室模型 k * V，二室模型 k10 * V1)"""
+    if model_type == "一室模型":
+        return typical['k'] * typical['V']
+    return typical['k10'] * typical['V1']
+
+
+def pareto_mask(objectives, block_size=256):
+    """回傳未被支配的列 (三個目標皆越小越好)
+
+    去除重複列並依字典序排序後，第 i 列被支配若且唯若某個較前面的列在第二、三個目標上都不大於它
+    (第一個目標已由排序保證)。前面各塊以第二、三目標的「階梯」(第二目標遞增、第三目標遞減的最小集合)
+    表示，以二分搜尋一次比較整塊；塊內以下三角矩陣比較。計算量約為 列數 × block_size。
+    """
+    objectives = np.asarray(objectives, dtype=float)
+    order = np.lexsort(objectives.T[::-1])
+    ordered = objectives[order]
+    first = np.concatenate([[True], (ordered[1:] != ordered[:-1]).any(axis=1)])  # 重複列只保留第一列
+    unique = ordered[first]
+    keep = np.zeros(len(unique), dtype=bool)
+    stair_x = np.empty(0)
+    stair_y = np.empty(0)
+    earlier = np.tri(block_size, k=-1, dtype=bool)  # earlier[i, j]：塊內第 j 列排在第 i 列之前
+    for start in range(0, len(unique), block_size):
+        x = unique[start:start + block_size, 1]
+        y = unique[start:start + block_size, 2]
+        count = len(x)
+        # 與前面各塊比較：階梯中第二目標不大於 x 的最後一點，其第三目標為這些點中的最小值
+        position = np.searchsorted(stair_x, x, side='right') - 1
+        dominated = (position >= 0) & (stair_y[np.maximum(position, 0)] <= y) if len(stair_x) else np.zeros(
+            count, dtype=bool)
+        # 塊內比較
+        dominated |= ((x[np.newaxis] <= x[:, np.newaxis]) & (y[np.newaxis] <= y[:, np.newaxis])
+                      & earlier[:count, :count]).any(axis=1)
+        keep[start:start + count] = ~dominated
+
+        # 更新階梯：依第二目標排序後，只保留第三目標嚴格變小的點
+        xs = np.concatenate([stair_x, x])
+        ys = np.concatenate([stair_y, y])
+        by_x = np.lexsort((ys, xs))
+        xs, ys = xs[by_x], ys[by_x]
+        improves = ys < np.concatenate([[np.inf], np.minimum.accumulate(ys)[:-1]])
+        stair_x, stair_y = xs[improves], ys[improves]
+    mask = np.empty(len(objectives), dtype=bool)
+    mask[order] = keep[np.cumsum(first) - 1]  # 重複列與第一列的結果相同
+    return mask
+
+
+def evaluate_regimens(model_type, typical, doses, intervals, n_doses=(np.inf,)):
+    """評估整個網格，回傳每個方案的峰值、谷值與 Pareto 目標 (DataFrame，欄位見 RESULT_COLUMNS)"""
+    dose, interval, count = regimen_grid(doses, intervals, n_doses)
+    peak, trough = peak_trough(simulation.disposition_terms(model_type, typical), dose, interval, count)
+    with np.errstate(divide='ignore'):
+        ratio = peak / trough
+    return pd.DataFrame({
+        'dose': dose,
+        'interval': interval,
+        'n_doses': count,
+        'peak': peak,
+        'trough': trough,
+        'dose_rate': dose / interval,
+        'peak_trough_ratio': ratio,
+        'average_steady_state': dose / (clearance(model_type, typical) * interval),
+    }, columns=RESULT_COLUMNS)
+
+
+def optimize_regimen(model_type, typical, peak_window, trough_window, doses, intervals, n_doses=(np.inf,)):
+    """搜尋峰值、谷值皆落在目標範圍 (下限, 上限) 內的方案，回傳 Pareto 集合 (依每單位時間劑量排序)
+
+    typical 為 simulation.typical_parameters 取得的典型參數；範圍的任一端可為 None 表示不限制。
+    """
+    table = evaluate_regimens(model_type, typical, doses, intervals, n_doses)
+    feasible = np.ones(len(table), dtype=bool)
+    for column, (low, high) in (('peak', peak_window), ('trough', trough_window)):
+        if low is not None:
+            feasible &= table[column].to_numpy() >= low
+        if high is not None:
+            feasible &= table[column].to_numpy() <= high
+    table = table[feasible]
+    objectives = np.column_stack([table['dose_rate'], 1 / table['interval'], table['peak_trough_ratio']])
+    # 峰谷比理論上與劑量無關，先四捨五入以免浮點誤差讓較高劑量的方案被誤判為未被支配
+    objectives = np.round(objectives, 10)
+    pareto = table[pareto_mask(objectives)]
+    return pareto.sort_values(['dose_rate', 'interval']).reset_index(drop=True)
+
+
+def optimize_from_results(model_type, results, peak_window, trough_window, doses, intervals, n_doses=(np.inf,)):
+    """以擬合結果字典 (process_file 回傳的 result) 進行方案搜尋"""
+    return optimize_regimen(model_type, simulation.typical_parameters(model_type, results), peak_window,
+                            trough_window, doses, intervals, n_doses)
@@ -0,0 +1,151 @@
+import threading
+import time as time_module
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import artifact_store
+
+# 每個連線保留的分析紀錄數上限，超過時淘汰最舊的紀錄
+MAX_RUNS_PER_SESSION = 20
+
+# 一室模型參數 (顯示名稱, 結果字典的 key)，依畫面與匯出的順序排列
+ONE_MODEL_PARAMETERS = (
+    ("Slope", "slope"),
+    ("k_e", "k_e"),
+    ("Half-life", "half_life"),
+    ("Intercept", "intercept"),
+    ("Initial Concentration", "initial_concentration"),
+    ("Clearance", "clearance"),
+    ("Volume of Distribution (V_d)", "VD"),
+    ("AUC(0-t)", "AUC(0-t)"),
+    ("AUC(0-finity)", "AUC(0-finity)"),
+)
+
+# 二室模型參數 (顯示名稱, 結果字典的 key)
+TWO_MODEL_PARAMETERS = (
+    ("a", "a"),
+    ("Alpha", "alpha"),
+    ("b", "b"),
+    ("Beta", "beta"),
+    ("k_21", "k_21"),
+    ("k_10", "k_10"),
+    ("k_12", "k_12"),
+    ("Half-life Alpha", "half_life_alpha"),
+    ("Half-life Beta", "half_life_beta"),
+    ("Half-life k_21", "half_life_k21"),
+    ("Half-life k_10", "half_life_k10"),
+    ("Half-life k_12", "half_life_k12"),
+    ("VDss", "VDss"),
+    ("Clearance", "clearance"),
+    ("AUC(0-t)", "AUC(0-t)"),
+    ("AUC(0-finity)", "AUC(0-finity)"),
+)
+
+
+def model_parameters(model_type):
+    return ONE_MODEL_PARAMETERS if model_type == "一室模型" else TWO_MODEL_PARAMETERS
+
+
+@dataclass(slots=True)
+class PanelResult:
+    """單一面板 (模型類型 + 原始 / 平均值) 的分析結果"""
+    panel_name: str
+    model_type: str
+    average: bool
+    results: dict
+    image_paths: list
+    message: str
+
+    @property
+    def ok(self):
+        return "Error" not in self.results
+
+    @property
+    def image_path(self):
+        return self.image_paths[0] if self.image_paths else None
+
+    def values(self):
+        """依參數順序回傳數值 (缺少的參數為 'N/A')"""
+        return [self.results.get(key, 'N/A') for _, key in model_parameters(self.model_type)]
+
+    def names_text(self):
+        """參數名稱文字框的內容"""
+        return "\n" + "".join(f"        {name}:\n" for name, _ in model_parameters(self.model_type)) + "        "
+
+    def values_text(self):
+        """輸出數值文字框的內容 (與 names_text 逐行對應)"""
+        return "\n" + "".join(f"    {value}\n" for value in self.values()) + "    "
+
+
+@dataclass(slots=True)
+class AnalysisRun:
+    """一次分析 (四個面板) 的結果紀錄
+
+    options 為分析時的設定 (單位、標題、轉折點與評分標準)；dependencies 為各面板依賴的輸入值，供下次分析判斷可沿用的面板
+    """
+    run_id: str
+    file_path: str
+    sheet_name: str
+    panels: tuple
+    options: dict = None
+    dependencies: list = None
+    created: float = field(default_factory=time_module.time)
+
+    def image_paths(self):
+        """所有面板的圖檔路徑"""
+        return [path for panel in self.panels for path in panel.image_paths]
+
+    def panel(self, model_type, average):
+        for panel in self.panels:
+            if panel.model_type == model_type and panel.average == average:
+                return panel
+        raise KeyError((model_type, average))
+
+
+# 各連線的分析紀錄：session_id -> OrderedDict(run_id -> AnalysisRun)，依建立順序排列
+_runs = {}
+_runs_lock = threading.Lock()
+
+
+def new_run_id():
+    return uuid.uuid4().hex
+
+
+def register_run(session_id, run):
+    """記錄一次分析結果，超過上限時淘汰該連線最舊的紀錄
+
+    紀錄中的圖檔在 artifact_store 中保持引用 (不被淘汰)，直到紀錄被淘汰或連線結束。
+    """
+    artifact_store.pin(run.image_paths())
+    released = []
+    with _runs_lock:
+        runs = _runs.setdefault(session_id, OrderedDict())
+        if run.run_id in runs:
+            released.append(runs[run.run_id])
+        runs[run.run_id] = run
+        runs.move_to_end(run.run_id)
+        while len(runs) > MAX_RUNS_PER_SESSION:
+            released.append(runs.popitem(last=False)[1])
+    for old_run in released:
+        artifact_store.unpin(old_run.image_paths())
+    return run
+
+
+def get_run(session_id, run_id=None):
+    """取得指定的分析紀錄；未指定 run_id 時回傳該連線最新的紀錄，找不到時回傳 None"""
+    with _runs_lock:
+        runs = _runs.get(session_id)
+        if not runs:
+            return None
+        if run_id is None:
+            return next(reversed(runs.values()))
+        return runs.get(run_id)
+
+
+def forget_session(session_id):
+    """連線結束時移除該連線的所有分析紀錄，並釋放紀錄中圖檔的引用"""
+    with _runs_lock:
+        runs = _runs.pop(session_id, None)
+    for run in (runs or {}).values():
+        artifact_store.unpin(run.image_paths())
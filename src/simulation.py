@@ -0,0 +1,192 @@
+"""族群蒙地卡羅模擬：由擬合參數與個體間變異產生虛擬受試者的濃度-時間曲線
+
+結構模型 (單次靜脈注射)：
+- 一室模型：C(t) = Dose / V * exp(-k * t)，k 為對數線性回歸斜率的負值，V 為 VD
+- 二室模型：由微常數 (V1、k10、k12、k21) 求出 alpha、beta 與 A、B，
+  C(t) = A * exp(-alpha * t) + B * exp(-beta * t)；以擬合時的劑量模擬可還原 a、b、alpha、beta
+
+個體間變異為對數常態：theta_i = theta * exp(eta_i)，eta_i ~ N(0, omega²)；另可加入比例型殘差
+C_obs = C * exp(sigma * eps)。所有運算以 (受試者, 時間) 廣播，並依 max_chunk_bytes 分塊，
+只回傳百分位數帶時記憶體用量與受試者數無關 (百分位數由每個時間點的對數直方圖求得)。
+"""
+import numpy as np
+
+# 各模型的典型參數名稱
+ONE_COMPARTMENT_PARAMETERS = ('k', 'V')
+TWO_COMPARTMENT_PARAMETERS = ('V1', 'k10', 'k12', 'k21')
+DEFAULT_PERCENTILES = (5, 50, 95)
+MAX_CHUNK_BYTES = 64 * 1024 * 1024  # 每塊 (受試者, 時間) 矩陣的記憶體上限
+HISTOGRAM_BINS = 4096  # 每個時間點的對數直方圖格數 (百分位數的相對解析度約為範圍 / 格數)
+
+
+def typical_parameters(model_type, results):
+    """由 fit_one_compartment / fit_two_compartment 的結果字典取得模擬用的典型參數
+
+    注意一室模型結果中的 'k_e' 為截距 (ln C0)，排除速率常數取斜率的負值。
+    """
+    if model_type == "一室模型":
+        return {'k': -float(results['slope']), 'V': float(results['VD'])}
+    return {'V1': float(results['Volume']), 'k10': float(results['k_10']), 'k12': float(results['k_12']),
+            'k21': float(results['k_21'])}
+
+
+def one_compartment_curve(time, dose, k, V):
+    """一室模型濃度 (k、V 可為 (受試者數, 1) 的陣列，與時間網格廣播)"""
+    return dose / V * np.exp(-k * time)
+
+
+def two_compartment_terms(V1, k10, k12, k21):
+    """由微常數求出單位劑量的兩個指數項 ((A, alpha), (B, beta))，alpha、beta 為特徵方程式的兩根"""
+    total = k10 + k12 + k21
+    # 判別式 = (k10 - k21)² + k12² + 2 * k12 * (k10 + k21) >= 0，只需避免浮點誤差造成的極小負值
+    root = np.sqrt(np.maximum(total * total - 4 * k10 * k21, 0.0))
+    alpha = (total + root) / 2
+    beta = (total - root) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (alpha - k21) / (V1 * (alpha - beta))
+        b = (k21 - beta) / (V1 * (alpha - beta))
+    return (a, alpha), (b, beta)
+
+
+def disposition_terms(model_type, typical):
+    """單位劑量的指數項列表 [(係數, 速率), ...]，C(t) = Dose * Σ 係數 * exp(-速率 * t)"""
+    _validate(model_type, typical)
+    if model_type == "一室模型":
+        return [(1 / typical['V'], typical['k'])]
+    return list(two_compartment_terms(typical['V1'], typical['k10'], typical['k12'], typical['k21']))
+
+
+def two_compartment_curve(time, dose, V1, k10, k12, k21):
+    """二室模型濃度 C(t) = Dose * (A * exp(-alpha * t) + B * exp(-beta * t))"""
+    (a, alpha), (b, beta) = two_compartment_terms(V1, k10, k12, k21)
+    return dose * (a * np.exp(-alpha * time) + b * np.exp(-beta * time))
+
+
+def _validate(model_type, typical):
+    names = ONE_COMPARTMENT_PARAMETERS if model_type == "一室模型" else TWO_COMPARTMENT_PARAMETERS
+    missing = [name for name in names if name not in typical]
+    if missing:
+        raise ValueError(f"缺少典型參數: {', '.join(missing)}")
+    invalid = [name for name in names if not typical[name] > 0]
+    if invalid:
+        raise ValueError(f"典型參數須為正值，無法模擬: {', '.join(invalid)}")
+    return names
+
+
+def _subject_chunk(rng, model_type, names, typical, omega, sigma, dose, time, size):
+    """產生一塊受試者的濃度矩陣 (size, 時間點數)"""
+    parameters = {}
+    for name in names:
+        value = np.full((size, 1), typical[name])
+        if omega.get(name):
+            value = value * np.exp(rng.normal(0.0, omega[name], size=(size, 1)))
+        parameters[name] = value
+    if model_type == "一室模型":
+        concentration = one_compartment_curve(time, dose, parameters['k'], parameters['V'])
+    else:
+        concentration = two_compartment_curve(time, dose, parameters['V1'], parameters['k10'], parameters['k12'],
+                                              parameters['k21'])
+    if sigma:
+        # 就地運算，避免多配置兩個與濃度矩陣同大小的暫存陣列
+        noise = rng.standard_normal(size=concentration.shape)
+        noise *= sigma
+        concentration *= np.exp(noise, out=noise)
+    return concentration
+
+
+def iter_chunks(model_type, typical, dose, time, n_subjects, omega=None, sigma=0.0, seed=None,
+                max_chunk_bytes=MAX_CHUNK_BYTES):
+    """依序產生每塊虛擬受試者的濃度矩陣 (受試者數, 時間點數)
+
+    omega 為 {參數名稱: 對數常態標準差}，未列出的參數沒有個體間變異；sigma 為比例型殘差的標準差。
+    相同 seed、n_subjects 與分塊大小會得到相同的結果。
+    """
+    names = _validate(model_type, typical)
+    omega = omega or {}
+    unknown = set(omega) - set(names)
+    if unknown:
+        raise ValueError(f"未知的參數: {', '.join(sorted(unknown))}")
+    time = np.asarray(time, dtype=float)
+    # 計算過程約需 4 個相同大小的暫存矩陣
+    chunk_size = max(1, int(max_chunk_bytes // (4 * 8 * max(len(time), 1))))
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_subjects, chunk_size):
+        size = min(chunk_size, n_subjects - start)
+        yield _subject_chunk(rng, model_type, names, typical, omega, sigma, dose, time, size)
+
+
+class _LogHistogram:
+    """每個時間點一個對數間距的直方圖，逐塊累積以估計百分位數 (範圍由第一塊資料決定並向外擴展)"""
+
+    def __init__(self, first_chunk, bins=HISTOGRAM_BINS, margin=2.0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_values = np.log10(np.where(first_chunk > 0, first_chunk, np.nan))
+        low = np.nanmin(log_values, axis=0) - margin
+        high = np.nanmax(log_values, axis=0) + margin
+        low = np.where(np.isfinite(low), low, -300.0)
+        high = np.where(np.isfinite(high), high, low + 1.0)
+        self.low = low
+        self.width = (high - low) / bins
+        self.bins = bins
+        self.counts = np.zeros((first_chunk.shape[1], bins), dtype=np.int64)
+        self.offsets = np.arange(first_chunk.shape[1]) * bins
+
+    def add(self, chunk):
+        with np.errstate(divide='ignore'):
+            index = np.log10(chunk)
+        index -= self.low
+        index /= self.width
+        # 範圍外 (或濃度為零) 的值計入兩端的格子；截斷為整數即為向下取整
+        np.clip(index, 0, self.bins - 1, out=index)
+        flat = (index.astype(np.int64) + self.offsets).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def percentiles(self, percentiles):
+        """在格子內以對數線性內插求出各時間點的百分位數，回傳 (百分位數個數, 時間點數)"""
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        bands = np.empty((len(percentiles), len(total)))
+        rows = np.arange(len(total))
+        for i, q in enumerate(percentiles):
+            target = q / 100 * total
+            index = np.minimum((cumulative < target[:, np.newaxis]).sum(axis=1), self.bins - 1)
+            before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0)
+            count = self.counts[rows, index]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.clip(np.where(count > 0, (target - before) / count, 0.5), 0, 1)
+            bands[i] = 10 ** (self.low + (index + fraction) * self.width)
+        return bands
+
+
+def simulate(model_type, typical, dose, time, n_subjects, omega=None, sigma=0.0, seed=None, percentiles=None,
+             max_chunk_bytes=MAX_CHUNK_BYTES):
+    """模擬 n_subjects 位虛擬受試者在時間網格 time 上的濃度
+
+    percentiles 為 None 時回傳 {'time', 'concentrations'} (受試者數 × 時間點數的完整矩陣)；
+    指定百分位數 (例如 (5, 50, 95)) 時只回傳 {'time', 'percentiles', 'bands', 'mean', 'n_subjects'}，
+    bands 為 (百分位數個數, 時間點數)，記憶體用量只與分塊大小和時間點數有關。
+    """
+    time = np.asarray(time, dtype=float)
+    chunks = iter_chunks(model_type, typical, dose, time, n_subjects, omega, sigma, seed, max_chunk_bytes)
+    if percentiles is None:
+        concentrations = np.concatenate(list(chunks)) if n_subjects else np.empty((0, len(time)))
+        return {'time': time, 'concentrations': concentrations}
+
+    histogram = None
+    total = np.zeros(len(time))
+    for chunk in chunks:
+        if histogram is None:
+            histogram = _LogHistogram(chunk)
+        histogram.add(chunk)
+        total += chunk.sum(axis=0)
+    if histogram is None:
+        raise ValueError("n_subjects 須大於 0")
+    return {'time': time, 'percentiles': tuple(percentiles), 'bands': histogram.percentiles(percentiles),
+            'mean': total / n_subjects, 'n_subjects': n_subjects}
+
+
+def simulate_from_results(model_type, results, dose, time, n_subjects, omega=None, sigma=0.0, seed=None,
+                          percentiles=DEFAULT_PERCENTILES, max_chunk_bytes=MAX_CHUNK_BYTES):
+    """以擬合結果字典 (process_file 回傳的 result) 為典型參數進行模擬"""
+    return simulate(model_type, typical_parameters(model_type, results), dose, time, n_subjects, omega, sigma, seed,
+                    percentiles, max_chunk_bytes)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 原始碼為 src/ 下的平面模組 (import models)，測試時加入匯入路徑
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
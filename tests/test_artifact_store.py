@@ -0,0 +1,147 @@
+"""圖檔儲存區：依容量上限的 LRU 淘汰 (分析紀錄引用中的圖檔不淘汰)、匯出的 reflink → 硬連結 → 複製遞補、sweep 只清除過舊的暫存檔"""
+import os
+import time
+from collections import Counter
+
+import pytest
+
+import artifact_store
+import result_store
+
+
+@pytest.fixture()
+def store(tmp_path, monkeypatch):
+    """將儲存區指向 tmp_path，並清空行程內的索引"""
+    directory = tmp_path / "artifacts"
+    monkeypatch.setattr(artifact_store, 'ARTIFACT_DIR', str(directory))
+    monkeypatch.setattr(artifact_store, '_index', None)
+    monkeypatch.setattr(artifact_store, '_total_bytes', 0)
+    monkeypatch.setattr(artifact_store, '_pins', Counter())
+    return directory
+
+
+def payload(index, size=100):
+    return bytes([index]) * size
+
+
+def test_put_deduplicates(store):
+    first = artifact_store.put(payload(1), "png")
+    assert artifact_store.put(payload(1), "png") == first
+    assert os.path.basename(first) == artifact_store.artifact_name(payload(1), "png")
+    assert artifact_store.stats()['artifacts'] == 1 and artifact_store.stats()['bytes'] == 100
+
+
+def test_lru_eviction_under_byte_cap(store):
+    paths = [artifact_store.put(payload(index), "png", max_bytes=350) for index in range(3)]
+    artifact_store.touch(paths[0])  # 最近使用，不應被淘汰
+    newest = artifact_store.put(payload(3), "png", max_bytes=350)
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+    assert os.path.exists(newest)
+    assert artifact_store.stats()['bytes'] == 300
+
+    # 剛存入的圖檔即使超過上限也不淘汰
+    large = artifact_store.put(payload(4, 1000), "png", max_bytes=350)
+    assert os.path.exists(large) and not any(os.path.exists(path) for path in paths + [newest])
+
+
+def test_index_rebuilt_from_mtime(store, monkeypatch):
+    old = artifact_store.put(payload(1), "png")
+    new = artifact_store.put(payload(2), "png")
+    os.utime(old, (time.time() - 100, time.time() - 100))
+    monkeypatch.setattr(artifact_store, '_index', None)  # 模擬重新啟動
+    artifact_store.put(payload(3), "png", max_bytes=250)
+    assert not os.path.exists(old) and os.path.exists(new)
+
+
+def test_export_fallback_order(store, tmp_path, monkeypatch):
+    source = artifact_store.put(payload(1), "png")
+    destination = str(tmp_path / "export.png")
+
+    monkeypatch.setattr(artifact_store, 'fcntl', object())
+    monkeypatch.setattr(artifact_store, '_reflink', lambda src, dst: open(dst, 'wb').write(open(src, 'rb').read()))
+    assert artifact_store.export(source, destination) == "reflink"
+    assert open(destination, 'rb').read() == payload(1)
+
+    def no_reflink(src, dst):
+        open(dst, 'wb').close()  # 失敗時留下的空檔案應被移除
+        raise OSError("reflink not supported")
+
+    monkeypatch.setattr(artifact_store, '_reflink', no_reflink)
+    os.remove(destination)
+    assert artifact_store.export(source, destination) == "hardlink"
+    assert os.path.samefile(source, destination)
+    # 已是同一份內容的硬連結時不重複匯出
+    assert artifact_store.export(source, destination) == "unchanged"
+
+    def no_link(src, dst):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(artifact_store.os, 'link', no_link)
+    os.remove(destination)
+    assert artifact_store.export(source, destination) == "copy"
+    assert open(destination, 'rb').read() == payload(1) and not os.path.samefile(source, destination)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_sweep_only_removes_stale_temp_files(store):
+    artifact = artifact_store.put(payload(1), "png")
+    stale = store / "stale.png.1-1.tmp"
+    fresh = store / "fresh.png.2-2.tmp"
+    for path in (stale, fresh):
+        path.write_bytes(b"partial")
+    old = time.time() - artifact_store.STALE_TEMP_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    result = artifact_store.sweep()
+    assert not stale.exists() and fresh.exists() and os.path.exists(artifact)
+    assert result['removed_files'] == 1 and result['artifacts'] == 1
+
+
+def test_sweep_evicts_to_cap(store):
+    paths = [artifact_store.put(payload(index), "png") for index in range(4)]
+    for age, path in zip((40, 30, 20, 10), paths):
+        os.utime(path, (time.time() - age, time.time() - age))
+    result = artifact_store.sweep(max_bytes=250)
+    assert [os.path.exists(path) for path in paths] == [False, False, True, True]
+    assert result['bytes'] == 200
+
+
+def test_pinned_artifacts_are_not_evicted(store):
+    paths = [artifact_store.put(payload(index), "png") for index in range(3)]
+    artifact_store.pin([paths[0], paths[0], "/elsewhere/placeholder.png"])  # 儲存區外的路徑不影響
+    artifact_store.put(payload(3), "png", max_bytes=150)
+    assert [os.path.exists(path) for path in paths] == [True, False, False]
+    assert artifact_store.stats()['pinned'] == 1
+
+    artifact_store.unpin([paths[0]])
+    artifact_store.sweep(max_bytes=0)
+    assert os.path.exists(paths[0])  # 仍有一個引用
+    with artifact_store.pinned([paths[0]]):
+        artifact_store.unpin([paths[0]])
+        artifact_store.sweep(max_bytes=0)
+        assert os.path.exists(paths[0])
+    artifact_store.sweep(max_bytes=0)
+    assert not os.path.exists(paths[0]) and artifact_store.stats()['pinned'] == 0
+
+def make_run(run_id, image_path):
+    panel = result_store.PanelResult("panel", "一室模型", False, {}, [image_path], "")
+    return result_store.AnalysisRun(run_id, "file.xlsx", "Sheet1", (panel,))
+
+
+def test_result_store_pins_live_runs(store, monkeypatch):
+    monkeypatch.setattr(result_store, '_runs', {})
+    monkeypatch.setattr(result_store, 'MAX_RUNS_PER_SESSION', 2)
+    paths = [artifact_store.put(payload(index), "png") for index in range(3)]
+    for index, path in enumerate(paths):
+        result_store.register_run("session", make_run(f"run{index}", path))
+    # run0 超過每個連線的紀錄上限而被淘汰，其圖檔不再被引用
+    artifact_store.sweep(max_bytes=0)
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+
+    result_store.register_run("other", make_run("other", paths[2]))
+    result_store.forget_session("session")
+    artifact_store.sweep(max_bytes=0)
+    assert [os.path.exists(path) for path in paths] == [False, False, True]
+    result_store.forget_session("other")
+    artifact_store.sweep(max_bytes=0)
+    assert not os.path.exists(paths[2])
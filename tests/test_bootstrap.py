@@ -0,0 +1,68 @@
+"""bootstrap 信賴區間：結果只取決於 seed (與 n_jobs 無關)，乾淨資料的區間包含點估計"""
+import numpy as np
+import pytest
+
+import bootstrap
+import models
+
+TIME = np.array([0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0, 24.0])
+DOSE = 100.0
+INFLECTION_POINT = 4.0
+
+
+def profile(model_type, noise=0.0, seed=0):
+    """一室 / 二室模型的濃度曲線，noise 為對數常態雜訊的標準差"""
+    if model_type == "一室模型":
+        cp = 20 * np.exp(-0.15 * TIME)
+    else:
+        cp = 40 * np.exp(-1.2 * TIME) + 8 * np.exp(-0.08 * TIME)
+    return cp * np.random.default_rng(seed).lognormal(0, noise, len(TIME))
+
+
+def point_estimate(model_type, cp):
+    if model_type == "一室模型":
+        return models.fit_one_compartment(TIME, cp, DOSE).results
+    return models.fit_two_compartment(TIME, cp, DOSE, INFLECTION_POINT).results
+
+
+@pytest.mark.parametrize("model_type", ["一室模型", "二室模型"])
+@pytest.mark.parametrize("method", bootstrap.BOOTSTRAP_METHODS)
+def test_same_seed_independent_of_n_jobs(model_type, method):
+    cp = profile(model_type, noise=0.05)
+    # 超過 CHUNK_SIZE 個樣本，平行時各塊由不同執行緒計算
+    n_boot = bootstrap.CHUNK_SIZE * 2 + 137
+    serial = bootstrap.bootstrap_model(model_type, TIME, cp, DOSE, INFLECTION_POINT, n_boot, method, seed=42,
+                                       n_jobs=1)
+    parallel = bootstrap.bootstrap_model(model_type, TIME, cp, DOSE, INFLECTION_POINT, n_boot, method, seed=42,
+                                         n_jobs=4)
+    assert serial == parallel
+    other_seed = bootstrap.bootstrap_model(model_type, TIME, cp, DOSE, INFLECTION_POINT, n_boot, method, seed=43,
+                                           n_jobs=1)
+    assert other_seed['intervals'] != serial['intervals']
+
+
+@pytest.mark.parametrize("model_type", ["一室模型", "二室模型"])
+@pytest.mark.parametrize("method", bootstrap.BOOTSTRAP_METHODS)
+def test_intervals_contain_point_estimate(model_type, method):
+    cp = profile(model_type, noise=0.02, seed=1)
+    results = point_estimate(model_type, cp)
+    summary = bootstrap.bootstrap_model(model_type, TIME, cp, DOSE, INFLECTION_POINT, 2000, method, seed=0)
+    assert summary['n_valid'] > 0.95 * summary['n_boot']
+    assert set(summary['intervals']) == set(results)
+    for key, (low, high) in summary['intervals'].items():
+        # 區間與點估計都四捨五入至小數第 4 位
+        assert low - 1e-4 <= results[key] <= high + 1e-4, key
+
+
+def test_residual_bootstrap_of_exact_data_is_degenerate():
+    cp = profile("一室模型")
+    results = point_estimate("一室模型", cp)
+    summary = bootstrap.bootstrap_one_compartment(TIME, cp, DOSE, 200, "residual", seed=0)
+    for key in ('slope', 'k_e', 'half_life', 'VD'):
+        low, high = summary['intervals'][key]
+        assert low == pytest.approx(results[key], abs=1e-4) and high == pytest.approx(results[key], abs=1e-4)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        bootstrap.bootstrap_one_compartment(TIME, profile("一室模型"), DOSE, method="wild")
@@ -0,0 +1,103 @@
+"""族群資料庫：build_store → CohortStore 的資料與 parse_sheet 相同，analyse 續跑不產生重複列"""
+import csv
+
+import numpy as np
+import pytest
+
+import cohort_store
+import file_processor
+
+
+def write_subject(path, time, cp, dose):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'cp', 'dose'])
+        for index, (t, c) in enumerate(zip(time, cp)):
+            writer.writerow([t, '' if np.isnan(c) else c, dose if index == 0 else ''])
+
+
+@pytest.fixture()
+def source_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    source = tmp_path / "source"
+    source.mkdir()
+    for index in range(6):
+        time = np.array([0.25, 0.5, 1.0, 2.0, 4.0, 4.0, 8.0, 12.0, 24.0])[:6 + index % 4]
+        cp = (30 * np.exp(-1.0 * time) + 6 * np.exp(-0.08 * time)) * rng.lognormal(0, 0.05, len(time))
+        if index % 2:
+            cp[1] = np.nan  # 空值列在建立資料庫時刪除
+            time, cp = time[::-1], cp[::-1]  # 未依時間排序
+        write_subject(source / f"subject_{index}.csv", time, cp, 100.0 + index)
+    (source / "no_columns.csv").write_text("a,b\n1,2\n", encoding='utf-8')
+    return source
+
+
+def test_build_and_open_round_trip(source_dir, tmp_path):
+    store_dir = str(tmp_path / "store")
+    count, skipped = cohort_store.build_store([str(source_dir)], store_dir, x_unit="Hour")
+    assert count == 6
+    assert [sheet for _, sheet, _ in skipped] == ["no_columns"]
+
+    store = cohort_store.CohortStore(store_dir)
+    assert len(store) == 6 and store.manifest['units']['x'] == "Hour"
+    time_all, cp_all, offsets = store.arrays()
+    assert offsets[0] == 0 and offsets[-1] == len(time_all) == len(cp_all)
+    for index, subject in enumerate(store.subjects.itertuples(index=False)):
+        entry = file_processor.parse_sheet(subject.file, subject.sheet)
+        for average in (False, True):
+            data = entry['avg' if average else 'raw']
+            time, cp = store.profile(index, average)
+            np.testing.assert_array_equal(time, data['time'])
+            np.testing.assert_array_equal(cp, data['cp'])
+        assert store.dose(index) == 100.0 + int(subject.sheet.split('_')[1])
+        assert store.find(subject.file, subject.sheet) == index
+
+    time, cp = store.padded(np.arange(len(store)))
+    for index in range(len(store)):
+        profile_time, profile_cp = store.profile(index)
+        np.testing.assert_array_equal(time[index, :len(profile_time)], profile_time)
+        assert np.isnan(cp[index, len(profile_cp):]).all()
+    assert store.find(str(source_dir / "missing.csv"), "missing") is None
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_analyse_resume_without_duplicate_rows(source_dir, tmp_path):
+    store_dir = str(tmp_path / "store")
+    cohort_store.build_store([str(source_dir)], store_dir)
+    output = str(tmp_path / "results.csv")
+
+    failed, skipped = cohort_store.analyse_store(store_dir, output, workers=1, chunk_size=2)
+    rows = read_rows(output)
+    assert skipped == 0 and len(rows) == 6
+    first_run = {(row['file'], row['sheet']): row['two_alpha'] for row in rows}
+
+    # 再次執行：全部略過，不附加任何列
+    failed, skipped = cohort_store.analyse_store(store_dir, output, workers=1, chunk_size=2)
+    assert (failed, skipped) == (0, 6) and len(read_rows(output)) == 6
+
+    # 中斷後續跑：只分析尚未完成的受試者
+    with open(output, encoding='utf-8', newline='') as f:
+        lines = f.readlines()
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        f.writelines(lines[:3])
+    failed, skipped = cohort_store.analyse_store(store_dir, output, workers=1, chunk_size=2)
+    rows = read_rows(output)
+    assert skipped == 2 and len(rows) == 6
+    assert {(row['file'], row['sheet']): row['two_alpha'] for row in rows} == first_run
+
+    # 不續跑：清除舊的輸出後重新分析
+    cohort_store.analyse_store(store_dir, output, workers=1, resume=False)
+    assert len(read_rows(output)) == 6
+
+
+def test_analyse_refuses_other_options(source_dir, tmp_path):
+    store_dir = str(tmp_path / "store")
+    cohort_store.build_store([str(source_dir)], store_dir)
+    output = str(tmp_path / "results.csv")
+    cohort_store.analyse_store(store_dir, output, workers=1)
+    with pytest.raises(SystemExit):
+        cohort_store.analyse_store(store_dir, output, workers=1, inflection_criterion="aic")
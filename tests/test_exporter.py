@@ -0,0 +1,53 @@
+"""exporter 的 CSV 續寫：移除中斷時寫到一半的最後一列"""
+import pytest
+
+import exporter
+
+
+@pytest.mark.parametrize("content, expected", [
+    (b"a,b\r\n1,2\r\n3,", b"a,b\r\n1,2\r\n"),
+    (b"a,b\r\n1,2\r\n", b"a,b\r\n1,2\r\n"),
+    (b"a,b\r\n" + b"x" * 100, b"a,b\r\n"),  # 半列比讀取區塊長
+    (b"a,b\r\n" + b"1,2\r\n" * 50 + b"9", b"a,b\r\n" + b"1,2\r\n" * 50),
+    (b"a,", b"a,b\r\n"),  # 只有寫到一半的標題列時重新寫入標題列
+])
+def test_truncate_partial_line(tmp_path, content, expected):
+    path = tmp_path / "cohort.csv"
+    path.write_bytes(content)
+    writer = exporter.CsvResultWriter(str(path), ['a', 'b'])
+    writer.close()
+    assert path.read_bytes() == expected
+
+
+def test_truncate_reads_small_blocks(tmp_path, monkeypatch):
+    path = tmp_path / "cohort.csv"
+    path.write_bytes(b"a,b\r\n" + b"1,2\r\n" * 20 + b"3,")
+    writer = exporter.CsvResultWriter.__new__(exporter.CsvResultWriter)
+    writer.path = str(path)
+    writer._truncate_partial_line(block_size=3)
+    assert path.read_bytes() == b"a,b\r\n" + b"1,2\r\n" * 20
+
+
+def test_parquet_writer_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, 'parquet_available', lambda: False)
+    with pytest.raises(ImportError):
+        exporter.open_writer(str(tmp_path / "cohort.parquet"), ['a'])
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet"])
+def test_drop_rows(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"results{extension}")
+    columns = ['file', 'status']
+    writer = exporter.open_writer(path, columns)
+    for index, status in enumerate(['ok', 'crashed', 'failed', 'crashed']):
+        writer.write({'file': f'f{index}', 'status': status})
+    writer.close()
+
+    writer = exporter.open_writer(path, columns)
+    assert writer.drop_rows(lambda row: row['status'] != 'crashed') == 2
+    writer.write({'file': 'f1', 'status': 'ok'})
+    writer.close()
+    assert sorted(exporter.open_writer(path, columns).read_rows(columns)) == [('f0', 'ok'), ('f1', 'ok'),
+                                                                              ('f2', 'failed')]
@@ -0,0 +1,34 @@
+"""面板依賴與擬合快取 key：評分標準只在自動搜尋轉折點時影響結果"""
+import numpy as np
+
+import file_processor
+import models
+
+
+def dependencies(path, inflection_point, criterion):
+    return file_processor.panel_dependencies(str(path), "Sheet1", "Hour", "mg/L", "mg", inflection_point, "",
+                                             criterion)
+
+
+def test_criterion_only_matters_for_auto_inflection(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("time,cp,dose\n1,10,100\n2,5,\n", encoding='utf-8')
+    assert dependencies(path, 2.0, "adj_r2") == dependencies(path, 2.0, "aic")
+    auto_r2 = dependencies(path, models.AUTO_INFLECTION, "adj_r2")
+    auto_aic = dependencies(path, models.AUTO_INFLECTION, "aic")
+    changed = [index for index, (old, new) in enumerate(zip(auto_r2, auto_aic)) if old != new]
+    # 只有二室模型的面板需要重新計算
+    assert changed and all(file_processor.PANELS[index][1] == "二室模型" for index in changed)
+
+
+def test_fit_cache_key_ignores_criterion_for_fixed_inflection():
+    time = np.array([0.5, 1.0, 2.0, 4.0, 8.0])
+    cp = np.array([20.0, 12.0, 6.0, 3.0, 1.5])
+
+    def key(model_type, inflection_point, criterion):
+        return file_processor.fit_cache_key(time, cp, 100.0, model_type, False, inflection_point, criterion)
+
+    assert key("二室模型", 2.0, "adj_r2") == key("二室模型", 2.0, "aic")
+    assert key("二室模型", 2.0, "adj_r2") != key("二室模型", 4.0, "adj_r2")
+    assert key("二室模型", models.AUTO_INFLECTION, "adj_r2") != key("二室模型", models.AUTO_INFLECTION, "aic")
+    assert key("一室模型", models.AUTO_INFLECTION, "adj_r2") == key("一室模型", 2.0, "aic")
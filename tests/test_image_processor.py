@@ -0,0 +1,44 @@
+"""族群疊圖：曲線超過 MAX_COHORT_CURVES 時只畫出上限條數，並在標題註明畫出的條數"""
+import numpy as np
+import pytest
+
+import image_processor
+
+CURVE_TIME = np.linspace(0, 24, 50)
+
+
+def render(monkeypatch, n_subjects, unfit=0):
+    """繪製 n_subjects 位受試者的疊圖 (前 unfit 位無法擬合)，回傳 (標題, 畫出的曲線數)"""
+    captured = {}
+
+    def keep_figure(figure, profile, image_format):
+        captured['figure'] = figure
+
+    monkeypatch.setattr(image_processor, '_encode', keep_figure)
+    rates = np.linspace(0.1, 0.5, n_subjects)[:, np.newaxis]
+    curves = 10 * np.exp(-rates * CURVE_TIME)
+    curves[:unfit] = np.nan
+    time = np.array([0.5, 1.0, 4.0, 12.0])
+    image_processor.render_cohort(time, 10 * np.exp(-rates * time), CURVE_TIME, curves, "Hour", "mg/L")
+    ax = captured['figure'].axes[0]
+    lines = [collection for collection in ax.collections
+             if isinstance(collection, image_processor.LineCollection)]
+    return ax.get_title(), sum(len(collection.get_segments()) for collection in lines)
+
+
+@pytest.mark.parametrize("n_subjects, unfit, expected_title, expected_curves", [
+    (10, 0, 'Cohort Overlay (n = 10)', 10),
+    (10, 3, 'Cohort Overlay (n = 10, 7 of 10 curves shown)', 7),
+    (1000, 0, f'Cohort Overlay (n = 1000, {image_processor.MAX_COHORT_CURVES} of 1000 curves shown)',
+     image_processor.MAX_COHORT_CURVES),
+])
+def test_cohort_title_states_curves_shown(monkeypatch, n_subjects, unfit, expected_title, expected_curves):
+    title, n_curves = render(monkeypatch, n_subjects, unfit)
+    assert title == expected_title
+    assert n_curves == expected_curves
+
+
+def test_cohort_cap_follows_constant(monkeypatch):
+    monkeypatch.setattr(image_processor, 'MAX_COHORT_CURVES', 25)
+    title, n_curves = render(monkeypatch, 30)
+    assert n_curves == 25 and '25 of 30 curves shown' in title
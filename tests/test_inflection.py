@@ -0,0 +1,115 @@
+"""自動轉折點搜尋：find_inflection_point 的排名、族群版本與逐一計算一致、fit_two_compartment 的候選點遞補"""
+import numpy as np
+import pytest
+
+import models
+
+
+def random_profile(rng, duplicates=False):
+    """含雜訊的雙指數曲線；duplicates=True 時部分時間點重複 (同一時間點有多筆量測)"""
+    n_points = int(rng.integers(5, 14))
+    time = np.sort(rng.choice(np.arange(1, 120) * 0.25, n_points, replace=False))
+    if duplicates:
+        repeat = rng.random(n_points) < 0.3
+        time = np.sort(np.concatenate((time, time[repeat])))
+    a, alpha = rng.uniform(5, 60), rng.uniform(0.3, 3.0)
+    b, beta = rng.uniform(0.5, 15), rng.uniform(0.02, 0.3)
+    cp = (a * np.exp(-alpha * time) + b * np.exp(-beta * time)) * rng.lognormal(0, 0.1, len(time))
+    return time, cp
+
+
+def brute_force_ranking(time, cp, criterion):
+    """逐一以 np.polyfit 擬合每個候選點的前後兩段，回傳 [(轉折點時間, 分數)]，依評分標準由佳到差排列"""
+    ln_cp = np.log(cp)
+    total = len(time)
+    if total < 5:
+        return []
+
+    def fit(x, y):
+        slope, intercept = np.polyfit(x, y, 1)
+        return np.sum((y - (intercept + slope * x)) ** 2), np.sum((y - y.mean()) ** 2)
+
+    sst_total = np.sum((ln_cp - ln_cp.mean()) ** 2)
+    candidates = [index for index in range(1, total) if time[index] != time[index - 1]]
+    if criterion == "workbook":
+        candidates = [index for index in candidates if total - index >= 3][-1:]
+    scored = []
+    for index in candidates:
+        x_a, y_a, x_b, y_b = time[:index], ln_cp[:index], time[index:], ln_cp[index:]
+        if len(x_a) < 2 or len(x_b) < 2 or np.ptp(x_a) == 0 or np.ptp(x_b) == 0:
+            continue
+        (sse_a, _), (sse_b, sst_b) = fit(x_a, y_a), fit(x_b, y_b)
+        sse = sse_a + sse_b
+        if criterion == "adj_r2":
+            score = 1 - (sse / (total - 4)) / (sst_total / (total - 1))
+        elif criterion == "aic":
+            score = total * np.log(sse / total) + 2 * 4
+        else:
+            score = 1 - sse_b / sst_b
+        scored.append((time[index], score))
+    scored.sort(key=lambda item: item[1], reverse=criterion != "aic")
+    return scored
+
+
+@pytest.mark.parametrize("criterion", models.INFLECTION_CRITERIA)
+@pytest.mark.parametrize("duplicates", [False, True])
+def test_ranking_matches_brute_force(criterion, duplicates):
+    rng = np.random.default_rng(7)
+    for _ in range(50):
+        time, cp = random_profile(rng, duplicates)
+        best, ranking = models.find_inflection_point(time, cp, criterion)
+        expected = brute_force_ranking(time, cp, criterion)
+        assert [row['inflection_point'] for row in ranking] == [point for point, _ in expected]
+        np.testing.assert_allclose([row['score'] for row in ranking], [score for _, score in expected], atol=1e-4)
+        assert best == (expected[0][0] if expected else None)
+
+
+def test_unknown_criterion():
+    with pytest.raises(ValueError):
+        models.find_inflection_point(np.arange(6.0), np.exp(-np.arange(6.0)), "bic")
+
+
+@pytest.mark.parametrize("criterion", models.INFLECTION_CRITERIA)
+def test_cohort_matches_single_subjects(criterion):
+    rng = np.random.default_rng(11)
+    profiles = [random_profile(rng, duplicates=bool(index % 3 == 0)) for index in range(80)]
+    profiles.append((np.arange(4.0), np.exp(-np.arange(4.0))))  # 點數不足，沒有候選點
+    width = max(len(time) for time, _ in profiles) + 2
+    time = np.full((len(profiles), width), np.nan)
+    cp = np.full((len(profiles), width), np.nan)
+    for row, (subject_time, subject_cp) in enumerate(profiles):
+        subject_cp = subject_cp.copy()
+        if row % 4 == 1:
+            subject_cp[1] = 0.0  # 對數非有限值的點視為缺值
+        time[row, :len(subject_time)] = subject_time
+        cp[row, :len(subject_cp)] = subject_cp
+
+    ranked = models.find_inflection_points_cohort(time, cp, criterion)
+    for row in range(len(profiles)):
+        keep = np.isfinite(time[row]) & (cp[row] > 0)
+        _, ranking = models.find_inflection_point(time[row][keep], cp[row][keep], criterion)
+        expected = [item['inflection_point'] for item in ranking]
+        assert ranked[row][np.isfinite(ranked[row])].tolist() == expected
+
+
+def test_auto_falls_back_to_next_candidate(monkeypatch):
+    time = np.array([0.25, 0.5, 1.0, 1.5, 2.0, 4.0, 6.0, 8.0, 12.0])
+    cp = 40 * np.exp(-1.5 * time) + 5 * np.exp(-0.1 * time)
+    usable = time[4]
+    assert models._strip_two_compartment(time, cp, np.log(cp), usable) is not None
+    # 排名第一的候選點只留下一個後段資料點，無法拆分，應改用第二個候選點
+    ranking = [{'inflection_point': time[-1]}, {'inflection_point': usable}]
+    monkeypatch.setattr(models, 'find_inflection_point', lambda *args: (time[-1], ranking))
+    assert models._strip_two_compartment(time, cp, np.log(cp), time[-1]) is None
+
+    fit = models.fit_two_compartment(time, cp, 100.0, models.AUTO_INFLECTION)
+    fixed = models.fit_two_compartment(time, cp, 100.0, usable)
+    assert fit.results['inflection_point'] == usable
+    assert {key: value for key, value in fit.results.items() if key != 'inflection_point'} == fixed.results
+
+
+def test_auto_without_usable_candidate(monkeypatch):
+    time = np.arange(6.0)
+    cp = np.exp(-time)
+    monkeypatch.setattr(models, 'find_inflection_point', lambda *args: (time[-1], [{'inflection_point': time[-1]}]))
+    assert models.fit_two_compartment(time, cp, 100.0, models.AUTO_INFLECTION) is None
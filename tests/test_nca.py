@@ -0,0 +1,117 @@
+"""nca.nca 的族群計算與逐一計算單一受試者的結果一致 (包含沒有資料的受試者)"""
+import numpy as np
+import pytest
+
+import nca
+
+PROFILES = [
+    (np.array([0.0, 0.5, 1.0, 2.0, 4.0, 8.0, 12.0]), np.array([0.0, 8.0, 10.0, 7.0, 4.0, 1.5, 0.6])),
+    (np.array([0.0, 1.0, 2.0, 3.0, 6.0]), np.array([5.0, 9.0, 6.0, 3.5, 1.0])),
+    (np.arange(5.0), np.arange(1.0, 6.0)),
+]
+
+
+def concatenate(profiles):
+    """串接各受試者的資料 (None 表示沒有資料的受試者)，回傳 (time, cp, offsets)"""
+    lengths = [0 if profile is None else len(profile[0]) for profile in profiles]
+    present = [profile for profile in profiles if profile is not None]
+    time = np.concatenate([profile[0] for profile in present])
+    cp = np.concatenate([profile[1] for profile in present])
+    return time, cp, np.concatenate(([0], np.cumsum(lengths)))
+
+
+def test_trailing_empty_subject():
+    results = nca.nca(np.arange(5.0), np.arange(1.0, 6.0), [0, 5, 5])
+    assert results['Cmax'][0] == 5.0 and results['Tmax'][0] == 4.0
+    assert np.isnan(results['Cmax'][1]) and results['lambda_z_points'][1] == 0
+
+
+@pytest.mark.parametrize("method", nca.AUC_METHODS)
+@pytest.mark.parametrize("layout", [
+    [None, 0, 1, 2],  # 開頭
+    [0, None, None, 1, 2],  # 中間
+    [0, 1, 2, None],  # 結尾
+    [None, 0, None, 1, 2, None, None],
+])
+def test_empty_subjects_match_single_profiles(layout, method):
+    profiles = [None if i is None else PROFILES[i] for i in layout]
+    results = nca.nca(*concatenate(profiles), dose=100.0, method=method)
+    for position, profile in enumerate(profiles):
+        if profile is None:
+            assert np.isnan(results['Cmax'][position]) and np.isnan(results['AUC(0-t)'][position])
+            assert results['lambda_z_points'][position] == 0
+            continue
+        single = nca.nca(profile[0], profile[1], [0, len(profile[0])], dose=100.0, method=method)
+        for key in nca.NCA_KEYS:
+            np.testing.assert_allclose(results[key][position], single[key][0], rtol=1e-9, err_msg=key)
+
+
+# 小型曲線：0 → 1 上升 (線性梯形)，之後每段都是指數下降 (對數梯形)
+HAND_TIME = np.array([0.0, 1.0, 2.0, 4.0])
+HAND_CP = np.array([0.0, 10.0, 5.0, 1.25])
+LN2 = np.log(2)
+# 逐段手算：上升段 AUC = (0 + 10) / 2，AUMC = (0 * 0 + 1 * 10) / 2；
+# 下降段 k = ln(c1 / c2) / dt，AUC = (c1 - c2) / k，AUMC = (t1 * c1 - t2 * c2) / k + (c1 - c2) / k²
+HAND_AUC_LOG_DOWN = 5.0 + 5.0 / LN2 + 3.75 / LN2
+HAND_AUMC_LOG_DOWN = 5.0 + (10.0 - 10.0) / LN2 + 5.0 / LN2 ** 2 + (10.0 - 5.0) / LN2 + 3.75 / LN2 ** 2
+
+
+def test_linear_auc_matches_trapz():
+    rng = np.random.default_rng(0)
+    time = np.sort(rng.uniform(0, 24, 15))
+    cp = rng.uniform(0.1, 10, 15)
+    results = nca.nca(time, cp, [0, len(time)])
+    assert results['AUC(0-t)'][0] == pytest.approx(np.trapz(cp, time), rel=1e-12)
+    assert results['AUMC(0-t)'][0] == pytest.approx(np.trapz(time * cp, time), rel=1e-12)
+    assert results['Cmax'][0] == cp.max() and results['Tmax'][0] == time[np.argmax(cp)]
+    assert results['Clast'][0] == cp[-1] and results['Tlast'][0] == time[-1]
+
+
+def test_linear_up_log_down_by_hand():
+    results = nca.nca(HAND_TIME, HAND_CP, [0, 4], method="linear-up/log-down")
+    assert results['AUC(0-t)'][0] == pytest.approx(HAND_AUC_LOG_DOWN, rel=1e-12)
+    assert results['AUMC(0-t)'][0] == pytest.approx(HAND_AUMC_LOG_DOWN, rel=1e-12)
+
+
+def test_log_down_is_exact_for_exponential_decline():
+    c0, k = 20.0, 0.3
+    time = np.array([1.0, 2.0, 3.5, 6.0, 9.0])
+    cp = c0 * np.exp(-k * time)
+    results = nca.nca(time, cp, [0, len(time)], method="linear-up/log-down")
+    # 解析積分：∫ C0 e^(-kt) dt 與 ∫ t C0 e^(-kt) dt
+    t1, t2 = time[0], time[-1]
+    auc = c0 / k * (np.exp(-k * t1) - np.exp(-k * t2))
+    aumc = c0 * ((t1 / k + 1 / k ** 2) * np.exp(-k * t1) - (t2 / k + 1 / k ** 2) * np.exp(-k * t2))
+    assert results['AUC(0-t)'][0] == pytest.approx(auc, rel=1e-12)
+    assert results['AUMC(0-t)'][0] == pytest.approx(aumc, rel=1e-12)
+
+
+def test_lambda_z_of_exact_mono_exponential():
+    time = np.array([0.5, 1.0, 2.0, 4.0, 6.0, 8.0, 12.0])
+    cp = 20.0 * np.exp(-0.3 * time)
+    results = nca.nca(time, cp, [0, len(time)], dose=100.0)
+    assert results['lambda_z'][0] == pytest.approx(0.3, rel=1e-10)
+    assert results['half_life'][0] == pytest.approx(0.693 / 0.3, rel=1e-10)
+    # 調整後 R² 相同時選用點數最多者 (Cmax 點除外)
+    assert results['lambda_z_points'][0] == len(time) - 1
+    assert results['lambda_z_r2_adj'][0] == pytest.approx(1.0)
+    auc_inf = np.trapz(cp, time) + cp[-1] / 0.3
+    assert results['AUC(0-finity)'][0] == pytest.approx(auc_inf, rel=1e-10)
+    assert results['clearance'][0] == pytest.approx(100.0 / auc_inf, rel=1e-10)
+    assert results['Vz'][0] == pytest.approx(100.0 / (0.3 * auc_inf), rel=1e-10)
+
+    fixed = nca.nca(time, cp, [0, len(time)], lambda_z_points=3)
+    assert fixed['lambda_z_points'][0] == 3 and fixed['lambda_z'][0] == pytest.approx(0.3, rel=1e-10)
+
+
+@pytest.mark.parametrize("offsets, position", [([0, 0, 4], 1), ([0, 4, 4], 0), ([0, 0, 4, 4], 1)])
+def test_empty_subject_next_to_hand_profile(offsets, position):
+    results = nca.nca(HAND_TIME, HAND_CP, offsets, method="linear-up/log-down")
+    assert results['Cmax'][position] == 10.0 and results['Tmax'][position] == 1.0
+    assert results['Clast'][position] == 1.25 and results['Tlast'][position] == 4.0
+    assert results['AUC(0-t)'][position] == pytest.approx(HAND_AUC_LOG_DOWN, rel=1e-12)
+    assert results['AUMC(0-t)'][position] == pytest.approx(HAND_AUMC_LOG_DOWN, rel=1e-12)
+    # Cmax 之後只有兩點，不足以估計 λz (至少三點)
+    assert np.isnan(results['lambda_z'][position])
+    empty = [index for index in range(len(offsets) - 1) if index != position]
+    assert np.isnan(results['Cmax'][empty]).all() and np.isnan(results['AUC(0-t)'][empty]).all()
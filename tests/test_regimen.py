@@ -0,0 +1,71 @@
+"""給藥方案搜尋：pareto_mask 與逐對比較的支配判斷一致，疊加原理的峰谷值與逐次給藥的加總一致"""
+import numpy as np
+import pytest
+
+import regimen
+import simulation
+
+TYPICAL = {
+    "一室模型": {'k': 0.2, 'V': 10.0},
+    "二室模型": {'V1': 8.0, 'k10': 0.3, 'k12': 0.5, 'k21': 0.2},
+}
+
+
+def brute_force_pareto(objectives):
+    """O(n²)：第 i 列被支配若且唯若存在某列在所有目標上都不大於它且至少一個目標較小"""
+    keep = np.ones(len(objectives), dtype=bool)
+    for i, row in enumerate(objectives):
+        for other in objectives:
+            if np.all(other <= row) and np.any(other < row):
+                keep[i] = False
+                break
+    return keep
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("block_size", [1, 7, 256])
+def test_pareto_mask_matches_brute_force(seed, block_size):
+    rng = np.random.default_rng(seed)
+    # 小範圍的整數目標會產生許多同值與重複列
+    objectives = rng.integers(0, 6 if seed % 2 else 40, size=(int(rng.integers(1, 300)), 3)).astype(float)
+    np.testing.assert_array_equal(regimen.pareto_mask(objectives, block_size), brute_force_pareto(objectives))
+
+
+def explicit_peak_trough(terms, dose, interval, n_doses):
+    """逐次加總每一劑在最後一次給藥後 (峰值) 與給藥前 (谷值) 的濃度"""
+    def single_dose(t):
+        return dose * sum(coefficient * np.exp(-rate * t) for coefficient, rate in terms)
+
+    peak = sum(single_dose(k * interval) for k in range(n_doses))
+    trough = sum(single_dose(k * interval) for k in range(1, n_doses))
+    return peak, trough
+
+
+@pytest.mark.parametrize("model_type", ["一室模型", "二室模型"])
+@pytest.mark.parametrize("n_doses", [1, 2, 5, 17])
+def test_superposition_matches_explicit_sum(model_type, n_doses):
+    terms = simulation.disposition_terms(model_type, TYPICAL[model_type])
+    for dose, interval in ((100.0, 6.0), (250.0, 12.0), (50.0, 0.5)):
+        peak, trough = regimen.peak_trough(terms, dose, interval, n_doses)
+        expected_peak, expected_trough = explicit_peak_trough(terms, dose, interval, n_doses)
+        assert peak == pytest.approx(expected_peak, rel=1e-10)
+        assert trough == pytest.approx(expected_trough, rel=1e-10, abs=1e-12)
+
+
+@pytest.mark.parametrize("model_type", ["一室模型", "二室模型"])
+def test_steady_state_is_the_limit(model_type):
+    terms = simulation.disposition_terms(model_type, TYPICAL[model_type])
+    peak, trough = regimen.peak_trough(terms, 100.0, 8.0, np.inf)
+    expected_peak, expected_trough = explicit_peak_trough(terms, 100.0, 8.0, 500)
+    assert peak == pytest.approx(expected_peak, rel=1e-10)
+    assert trough == pytest.approx(expected_trough, rel=1e-10)
+
+
+def test_optimize_regimen_returns_feasible_pareto_set():
+    table = regimen.optimize_regimen("一室模型", TYPICAL["一室模型"], (5.0, 20.0), (1.0, None),
+                                     doses=np.arange(25, 301, 25), intervals=(4, 6, 8, 12, 24))
+    assert len(table) > 0
+    assert (table['peak'].between(5.0, 20.0)).all() and (table['trough'] >= 1.0).all()
+    objectives = np.round(np.column_stack([table['dose_rate'], 1 / table['interval'], table['peak_trough_ratio']]),
+                          10)
+    assert brute_force_pareto(objectives).all()
@@ -0,0 +1,80 @@
+"""ols_fit / linear_regression 與 statsmodels.OLS 的數值等價測試 (使用 dataset/ 內附的活頁簿)"""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import models
+
+sm = pytest.importorskip("statsmodels.api")
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
+
+
+def load_series():
+    """所有含 time / cp 欄位的工作表，依 file_processor 的方式清理並取 ln(cp)"""
+    series = []
+    for path in sorted(glob.glob(os.path.join(DATASET_DIR, "*.xlsx"))):
+        for sheet_name, data in pd.read_excel(path, sheet_name=None).items():
+            data.columns = data.columns.astype(str).str.lower()
+            if 'time' not in data.columns or 'cp' not in data.columns:
+                continue
+            # 說明用的工作表混有文字列，只保留數值列
+            data = data[['time', 'cp']].apply(pd.to_numeric, errors='coerce').dropna()
+            data = data[data['cp'] > 0].sort_values(by='time')
+            if len(data) < 3:
+                continue
+            time = data['time'].to_numpy(dtype=float)
+            ln_cp = np.log(data['cp'].to_numpy(dtype=float))
+            series.append(pytest.param(time, ln_cp, id=f"{os.path.basename(path)}:{sheet_name}"))
+    return series
+
+
+SERIES = load_series()
+
+
+def statsmodels_fit(time, cp):
+    results = sm.OLS(cp, sm.add_constant(time, has_constant='add')).fit()
+    return results.params[1], results.params[0], results.rsquared, results
+
+
+def test_datasets_found():
+    assert len(SERIES) >= 5
+
+
+@pytest.mark.parametrize("time, ln_cp", SERIES)
+def test_ols_fit_matches_statsmodels(time, ln_cp):
+    # 整條曲線與每個轉折點拆分後的末端相 (至少 3 點)
+    for start in range(0, len(time) - 2):
+        x, y = time[start:], ln_cp[start:]
+        if np.ptp(x) == 0:
+            continue  # 末端只剩同一時間點的重複測量，斜率無定義
+        slope, intercept = models.ols_fit(x, y)
+        expected_slope, expected_intercept, expected_r2, _ = statsmodels_fit(x, y)
+        r2 = 1 - np.sum((y - (intercept + slope * x)) ** 2) / np.sum((y - y.mean()) ** 2)
+        np.testing.assert_allclose(slope, expected_slope, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(intercept, expected_intercept, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(r2, expected_r2, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("time, ln_cp", SERIES)
+def test_linear_regression_matches_statsmodels(time, ln_cp):
+    predicted_cp, intercept, slope, new_time_range = models.linear_regression(time, ln_cp, np.max(time))
+    expected_slope, expected_intercept, _, results = statsmodels_fit(time, ln_cp)
+    assert intercept == round(expected_intercept, 4)
+    assert slope == round(expected_slope, 4)
+    np.testing.assert_allclose(predicted_cp, results.predict(sm.add_constant(new_time_range)), rtol=1e-9,
+                               atol=1e-12)
+
+
+def test_batch_matches_single_fits():
+    time, ln_cp = SERIES[0].values
+    n = len(time) - 2
+    stacked = np.stack([ln_cp[:n] + shift for shift in (0.0, 0.5, -1.0)])
+    slopes, intercepts = models.ols_fit(time[:n], stacked)
+    for row, slope, intercept in zip(stacked, slopes, intercepts):
+        expected_slope, expected_intercept, _, _ = statsmodels_fit(time[:n], row)
+        np.testing.assert_allclose([slope, intercept], [expected_slope, expected_intercept], rtol=1e-9,
+                                   atol=1e-12)
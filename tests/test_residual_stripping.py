@@ -0,0 +1,104 @@
+"""殘差法 (residual_mask / strip_two_compartment_cohort) 與原本 two_compartment_model 逐點迴圈的等價測試"""
+import numpy as np
+import pytest
+
+import models
+
+
+def baseline_residual_points(time, cp, b, b_slope):
+    """原本 two_compartment_model 中的逐點迴圈，回傳選入前段的點的索引"""
+    cp_i = np.array([b * np.exp(b_slope * t) for t in time]).flatten()
+    selected = []
+    for i in range(len(cp)):
+        if cp[i] > cp_i[i]:
+            x = np.log(cp[i] - cp_i[i])
+            if x < 0:
+                break
+            selected.append(i)
+    return selected
+
+
+def baseline_strip(time, cp, inflection_point):
+    """原本 two_compartment_model 的拆分與回歸，資料不適用時回傳 None
+
+    回歸使用 linear_regression (與 statsmodels 的等價見 test_regression_parity)。
+    """
+    ln_cp = np.log(cp)
+    inflection_index = np.where(time == inflection_point)[0][0]
+    if len(time) - inflection_index < 2:
+        return None
+    _, ln_b, b_slope, _ = models.linear_regression(time[inflection_index:], ln_cp[inflection_index:], time[-1])
+    b = np.exp(ln_b)
+    selected = baseline_residual_points(time, cp, b, b_slope)
+    if len(selected) < 2:
+        return None
+    _, ln_a, a_slope, _ = models.linear_regression(time[selected], ln_cp[selected], time[-1])
+    return np.exp(ln_a), -a_slope, b, -b_slope
+
+
+def random_profile(rng):
+    """含雜訊的雙指數曲線 (時間點不重複、依時間排序)"""
+    n_points = int(rng.integers(5, 16))
+    time = np.sort(rng.choice(np.arange(1, 200) * 0.25, n_points, replace=False))
+    a, alpha = rng.uniform(2, 60), rng.uniform(0.2, 3.0)
+    b, beta = rng.uniform(0.5, 15), rng.uniform(0.01, 0.3)
+    cp = (a * np.exp(-alpha * time) + b * np.exp(-beta * time)) * rng.lognormal(0, 0.15, n_points)
+    return time, cp
+
+
+def padded(profiles):
+    """長度不同的受試者以 NaN 填補成矩形陣列"""
+    width = max(len(time) for time, _ in profiles)
+    time = np.full((len(profiles), width), np.nan)
+    cp = np.full((len(profiles), width), np.nan)
+    for row, (subject_time, subject_cp) in enumerate(profiles):
+        time[row, :len(subject_time)] = subject_time
+        cp[row, :len(subject_cp)] = subject_cp
+    return time, cp
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_residual_mask_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    profiles, lines = [], []
+    for _ in range(100):
+        time, cp = random_profile(rng)
+        # 後段回歸線：以最後幾點回歸，或隨機的線 (涵蓋提早截斷與完全沒有點高於回歸線的情況)
+        if rng.random() < 0.5:
+            _, ln_b, b_slope, _ = models.linear_regression(time[-3:], np.log(cp[-3:]), time[-1])
+            b = np.exp(ln_b)
+        else:
+            b, b_slope = rng.uniform(0.1, 80), -rng.uniform(0.0, 1.0)
+        expected = baseline_residual_points(time, cp, b, b_slope)
+        np.testing.assert_array_equal(np.flatnonzero(models.residual_mask(time, cp, b, b_slope)), expected)
+        profiles.append((time, cp))
+        lines.append((b, b_slope))
+
+    # 整個族群一次計算 (NaN 填補的點不會被選入)
+    time, cp = padded(profiles)
+    b, b_slope = np.array(lines).T
+    mask = models.residual_mask(time, cp, b, b_slope)
+    for row, (subject_time, subject_cp) in enumerate(profiles):
+        expected = baseline_residual_points(subject_time, subject_cp, b[row], b_slope[row])
+        np.testing.assert_array_equal(np.flatnonzero(mask[row]), expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cohort_strip_matches_single_subjects(seed):
+    rng = np.random.default_rng(100 + seed)
+    profiles = [random_profile(rng) for _ in range(60)]
+    inflection_points = np.array([time[rng.integers(1, len(time))] for time, _ in profiles])
+    time, cp = padded(profiles)
+    cohort = models.strip_two_compartment_cohort(time, cp, inflection_points)
+
+    assert not cohort['valid'].all() and cohort['valid'].any()  # 隨機資料中兩種情況都應出現
+    for row, ((subject_time, subject_cp), inflection_point) in enumerate(zip(profiles, inflection_points)):
+        expected = baseline_strip(subject_time, subject_cp, inflection_point)
+        single = models._strip_two_compartment(subject_time, subject_cp, np.log(subject_cp), inflection_point)
+        assert bool(cohort['valid'][row]) == (expected is not None) == (single is not None)
+        if expected is None:
+            continue
+        a, alpha, b, beta = expected
+        np.testing.assert_allclose([cohort['a'][row], cohort['alpha'][row], cohort['b'][row], cohort['beta'][row]],
+                                   [a, alpha, b, beta], rtol=1e-9)
+        np.testing.assert_allclose([single[0], -single[1], single[4], -single[5]], [a, alpha, b, beta], rtol=1e-9)
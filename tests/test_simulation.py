@@ -0,0 +1,54 @@
+"""族群模擬：對數直方圖求得的百分位數與完整矩陣的 np.percentile 一致 (誤差在一個格子內)"""
+import numpy as np
+import pytest
+
+import simulation
+
+TIME = np.array([0.0, 0.5, 1.0, 2.0, 4.0, 8.0, 12.0, 24.0])
+TYPICAL = {
+    "一室模型": {'k': 0.2, 'V': 10.0},
+    "二室模型": {'V1': 8.0, 'k10': 0.3, 'k12': 0.5, 'k21': 0.2},
+}
+
+
+@pytest.mark.parametrize("model_type", ["一室模型", "二室模型"])
+@pytest.mark.parametrize("n_subjects", [7, 400, 3001])
+def test_histogram_percentiles_match_np_percentile(model_type, n_subjects):
+    omega = {name: 0.3 for name in TYPICAL[model_type]}
+    percentiles = (2.5, 5, 25, 50, 75, 95, 97.5)
+    # 分塊很小，直方圖的範圍由第一塊決定，其餘各塊逐一累積
+    options = dict(omega=omega, sigma=0.1, seed=5, max_chunk_bytes=4 * 8 * len(TIME) * 64)
+    full = simulation.simulate(model_type, TYPICAL[model_type], 100.0, TIME, n_subjects, **options)['concentrations']
+    summary = simulation.simulate(model_type, TYPICAL[model_type], 100.0, TIME, n_subjects, percentiles=percentiles,
+                                  **options)
+
+    histogram = simulation._LogHistogram(full[:64])  # 與 simulate 相同：範圍由第一塊 (64 位受試者) 決定
+    bin_factor = 10 ** histogram.width  # 一個格子的相對寬度 (每個時間點)
+    ordered = np.sort(full, axis=0)
+    for row, q in enumerate(percentiles):
+        # np.percentile 在相鄰兩個順序統計量之間內插；直方圖的結果應落在同一區間內 (加減一個格子)
+        lower = int(np.floor(q / 100 * (n_subjects - 1)))
+        upper = min(lower + 1, n_subjects - 1)
+        band = summary['bands'][row]
+        assert np.all(band >= ordered[lower] / bin_factor), q
+        assert np.all(band <= ordered[upper] * bin_factor), q
+        if n_subjects >= 3000:
+            np.testing.assert_allclose(band, np.percentile(full, q, axis=0), rtol=0.02)
+    np.testing.assert_allclose(summary['mean'], full.mean(axis=0), rtol=1e-12)
+
+
+def test_full_matrix_and_typical_curve():
+    typical = TYPICAL["一室模型"]
+    small = simulation.simulate("一室模型", typical, 100.0, TIME, 200, omega={'k': 0.2}, seed=1,
+                                max_chunk_bytes=4 * 8 * len(TIME) * 10)
+    assert small['concentrations'].shape == (200, len(TIME))
+    # 沒有變異時每位受試者都是典型曲線
+    exact = simulation.simulate("一室模型", typical, 100.0, TIME, 5, seed=1)['concentrations']
+    np.testing.assert_allclose(exact, np.broadcast_to(100.0 / 10.0 * np.exp(-0.2 * TIME), exact.shape))
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        simulation.simulate("一室模型", {'k': -1.0, 'V': 10.0}, 100.0, TIME, 10)
+    with pytest.raises(ValueError):
+        simulation.simulate("一室模型", TYPICAL["一室模型"], 100.0, TIME, 10, omega={'V1': 0.1})